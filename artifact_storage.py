@@ -0,0 +1,365 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import wandb
+
+from manifest import file_digest
+from utils import abs_path, check_folder
+
+
+def _list_files(path: str) -> dict:
+    """
+    Return the size of every file under a directory, by path relative to the directory.
+    """
+    files = {}
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            files[os.path.relpath(file_path, path)] = os.path.getsize(file_path)
+    return files
+
+
+class ArtifactCache:
+    """
+    A persistent index of the artifacts already downloaded, by artifact digest.
+
+    When an artifact with a known digest is requested again, its directory is returned right away instead of
+    downloading (or verifying every file of) the artifact again. An entry is only trusted if every file recorded for it
+    is still there with the same size.
+
+    Attributes:
+        index_path (str): The JSON file of the index.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        try:
+            with open(index_path) as f:
+                self.__index = json.load(f)
+        except (OSError, ValueError):
+            self.__index = {}
+
+    def get(self, digest: str):
+        """
+        Return the directory of a downloaded artifact.
+
+        Args:
+            digest (str): The digest of the artifact.
+
+        Returns:
+            str: the directory, or None if the artifact is not cached or its files changed
+        """
+        entry = self.__index.get(digest)
+        if entry is None or not os.path.isdir(entry["path"]):
+            return None
+
+        files = _list_files(entry["path"])
+        if any(files.get(file) != size for file, size in entry["files"].items()):
+            return None
+        return entry["path"]
+
+    def put(self, digest: str, path: str):
+        """
+        Record the directory an artifact was downloaded to.
+
+        Args:
+            digest (str): The digest of the artifact.
+            path (str): The directory of the artifact.
+        """
+        self.__index[digest] = {"path": path, "files": _list_files(path)}
+
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.__index, f)
+        os.replace(tmp_path, self.index_path)
+
+
+class WandbArtifactStorage:
+    """
+    Stores artifacts in W&B, through a run.
+
+    Downloads go through an ArtifactCache, and an artifact is only looked up once per run, until a new version of
+    it is uploaded. Uploads may run in a BackgroundUploader thread while the main thread downloads, so the calls to
+    the run and the artifacts looked up are guarded by a lock (waiting for an upload or a download is not).
+    """
+
+    def __init__(self, run, project_path: str, cache: ArtifactCache):
+        """
+        Args:
+            run (wandb.Run): The run the artifacts are logged to and used by.
+            project_path (str): The W&B project path, as owner/project.
+            cache (ArtifactCache): The cache of the downloaded artifacts.
+        """
+        self.run = run
+        self.project_path = project_path
+        self.cache = cache
+        self.__downloaded = {}
+        self.__lock = threading.Lock()
+
+    def upload(self, name: str, artifact_type: str, path: str, aliases: list, subdir: str = None):
+        """
+        Upload a file, a directory or a list of files as a new version of an artifact.
+
+        Args:
+            name (str): The name of the artifact.
+            artifact_type (str): The type of the artifact.
+            path (str | list): The file or directory to upload, or a list of files put at the root of the artifact.
+            aliases (list): The aliases of the new version.
+            subdir (str, optional): The directory the content of a directory is put under, in the artifact. Defaults to
+                None (the root of the artifact).
+
+        Returns:
+            wandb.Artifact: the logged artifact
+        """
+        artifact = wandb.Artifact(name, type=artifact_type)
+        if isinstance(path, list):
+            for file_path in path:
+                artifact.add_file(file_path)
+        elif os.path.isdir(path):
+            artifact.add_dir(path, name=subdir)
+        else:
+            artifact.add_file(path)
+
+        with self.__lock:
+            self.run.log_artifact(artifact, aliases=aliases)
+
+        # Wait for the artifact logging
+        artifact.wait()
+
+        # The aliases may point to the new version now
+        with self.__lock:
+            self.__downloaded = {key: value for key, value in self.__downloaded.items() if key[0] != name}
+        return artifact
+
+    def download(self, name: str, artifact_type: str, alias: str) -> str:
+        """
+        Use an artifact in the run and return the local directory of its content, downloading it if it is not cached.
+
+        Args:
+            name (str): The name of the artifact.
+            artifact_type (str): The type of the artifact.
+            alias (str): The alias of the version to use.
+
+        Returns:
+            str: the local directory of the artifact
+        """
+        key = (name, alias)
+        with self.__lock:
+            if key in self.__downloaded:
+                return self.__downloaded[key]
+            artifact = self.run.use_artifact('%s/%s:%s' % (self.project_path, name, alias), type=artifact_type)
+
+        path = self.cache.get(artifact.digest)
+        if path is None:
+            path = artifact.download()
+            self.cache.put(artifact.digest, path)
+
+        with self.__lock:
+            self.__downloaded[key] = path
+        return path
+
+
+class LocalArtifactStorage:
+    """
+    Stores artifacts in a local directory, standing in for W&B on machines without network access.
+
+    Every artifact is a directory of versions (v0, v1, ...) with an aliases.json file and a digests.json file. As in W&B, uploading content
+    identical to an existing version only moves the aliases to that version, and downloading returns the directory of
+    the version itself.
+
+    Attributes:
+        root (str): The directory of the artifacts.
+    """
+
+    ALIASES_FILE = "aliases.json"
+    DIGESTS_FILE = "digests.json"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def __digest(path: str) -> str:
+        """
+        Compute the digest of a file, of the files of a directory or of a list of files.
+        """
+        if isinstance(path, list):
+            entries = sorted((os.path.basename(file_path), file_digest(file_path)) for file_path in path)
+        elif not os.path.isdir(path):
+            return file_digest(path)
+        else:
+            entries = sorted((file, file_digest(abs_path(path, file))) for file in _list_files(path))
+        return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+    def __read(self, name: str, file: str) -> dict:
+        try:
+            with open(abs_path(self.root, name, file)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __write(self, name: str, file: str, data: dict):
+        with open(abs_path(self.root, name, file), 'w') as f:
+            json.dump(data, f)
+
+    def __versions(self, name: str) -> list:
+        artifact_path = abs_path(self.root, name)
+        if not os.path.isdir(artifact_path):
+            return []
+        versions = [entry for entry in os.listdir(artifact_path) if entry.startswith("v") and entry[1:].isdigit()]
+        return sorted(versions, key=lambda version: int(version[1:]))
+
+    def upload(self, name: str, artifact_type: str, path: str, aliases: list, subdir: str = None):
+        """
+        Store a file, a directory or a list of files as a new version of an artifact (see WandbArtifactStorage.upload).
+        """
+        digest = self.__digest(path) + (":" + subdir if subdir else "")
+
+        # Reuse the version with the same content, if any
+        digests = self.__read(name, self.DIGESTS_FILE)
+        versions = self.__versions(name)
+        version = next((existing for existing in versions if digests.get(existing) == digest), None)
+
+        if version is None:
+            version = "v%d" % (int(versions[-1][1:]) + 1 if versions else 0)
+            version_path = abs_path(self.root, name, version)
+            check_folder(version_path)
+            if isinstance(path, list):
+                for file_path in path:
+                    shutil.copy2(file_path, version_path)
+            elif os.path.isdir(path):
+                shutil.copytree(path, abs_path(version_path, subdir) if subdir else version_path, dirs_exist_ok=True)
+            else:
+                shutil.copy2(path, version_path)
+            digests[version] = digest
+            self.__write(name, self.DIGESTS_FILE, digests)
+
+        stored_aliases = self.__read(name, self.ALIASES_FILE)
+        for alias in list(aliases) + ["latest", version]:
+            stored_aliases[alias] = version
+        self.__write(name, self.ALIASES_FILE, stored_aliases)
+
+    def download(self, name: str, artifact_type: str, alias: str) -> str:
+        """
+        Return the directory of a version of an artifact (see WandbArtifactStorage.download).
+        """
+        version = self.__read(name, self.ALIASES_FILE).get(alias)
+        if version is None:
+            raise FileNotFoundError(f"No local artifact {name}:{alias} in {self.root}")
+        return abs_path(self.root, name, version)
+
+
+class BackgroundUploader:
+    """
+    Uploads artifacts through a storage in a background thread, so the pipeline goes on with its next step while they
+    are uploaded.
+
+    The uploads are done one at a time, in the order they were queued. `wait` is the barrier: it waits for the pending
+    uploads (of every artifact, or of one artifact), prints their status and raises the errors of the failed ones.
+    While an artifact is being uploaded, `local_path` gives its local files, so the next step reads them instead of
+    waiting to download them again. The uploaded files must not be modified until their upload is done.
+    """
+
+    def __init__(self, storage):
+        """
+        Args:
+            storage (WandbArtifactStorage | LocalArtifactStorage): The storage the artifacts are uploaded to.
+        """
+        self.storage = storage
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact_upload")
+        self.__pending = []
+        # Local directory of the last upload of each artifact
+        self.__local_paths = {}
+        self.__lock = threading.Lock()
+
+    def __upload(self, name, artifact_type, path, aliases, subdir):
+        start = time.perf_counter()
+        self.storage.upload(name, artifact_type, path, aliases, subdir)
+        return time.perf_counter() - start
+
+    def upload(self, name: str, artifact_type: str, path: str, aliases: list, subdir: str = None):
+        """
+        Queue the upload of a file, a directory or a list of files as a new version of an artifact (see
+        WandbArtifactStorage.upload).
+        """
+        future = self.__executor.submit(self.__upload, name, artifact_type, path, list(aliases), subdir)
+        with self.__lock:
+            self.__pending.append((name, future))
+            self.__local_paths[name] = self.__artifact_dir(path, subdir)
+        print(f"Queued the upload of the artifact {name}")
+
+    @staticmethod
+    def __artifact_dir(path, subdir):
+        """
+        Return the local directory laid out like the artifact of an upload, or None if there is none.
+        """
+        if isinstance(path, list):
+            folders = {os.path.dirname(os.path.abspath(file_path)) for file_path in path}
+            return folders.pop() if len(folders) == 1 else None
+        if not os.path.isdir(path):
+            return os.path.dirname(os.path.abspath(path))
+        if subdir is None:
+            return path
+        # The content of the directory is under its own name in the artifact
+        return os.path.dirname(os.path.abspath(path)) if os.path.basename(path.rstrip("/\\")) == subdir else None
+
+    def local_path(self, name: str):
+        """
+        Return the local directory of the content of an artifact whose upload isn't done yet, laid out like the
+        directory a download of the artifact returns.
+
+        Returns:
+            str: the directory, or None if no upload of the artifact is pending
+        """
+        with self.__lock:
+            if not any(upload_name == name and not future.done() for upload_name, future in self.__pending):
+                return None
+            return self.__local_paths.get(name)
+
+    def pending(self) -> list:
+        """
+        Return the names of the artifacts whose upload isn't done yet.
+        """
+        with self.__lock:
+            return [name for name, future in self.__pending if not future.done()]
+
+    def wait(self, name: str = None):
+        """
+        Wait for the pending uploads, print their status and raise the error of the first failed one.
+
+        Args:
+            name (str, optional): Only wait for the uploads of this artifact. Defaults to None (every upload).
+        """
+        with self.__lock:
+            waited = [(upload_name, future) for upload_name, future in self.__pending
+                      if name is None or upload_name == name]
+            self.__pending = [upload for upload in self.__pending if upload not in waited]
+
+        errors = []
+        for upload_name, future in waited:
+            try:
+                print(f"Uploaded the artifact {upload_name} in {future.result():.1f}s")
+            except Exception as e:
+                print(f"Upload of the artifact {upload_name} failed: {e}")
+                errors.append(e)
+
+        if errors:
+            raise IOError(f"{len(errors)} artifacts could not be uploaded, the first error was: {errors[0]}") \
+                from errors[0]
+
+    def close(self):
+        """
+        Wait for the pending uploads and stop the background thread.
+        """
+        try:
+            self.wait()
+        finally:
+            self.__executor.shutdown()
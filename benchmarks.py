@@ -0,0 +1,396 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import image
+from characteristics_store import NpyCharacteristicsWriter
+from classifier import Classifier
+from feature_registry import radiomics_profile
+from image import Image, ImageProcessor, ImageTuple, get_decode_cache
+from lung_segmentation import LungMaskGenerator
+from lung_seg_model import model
+from texture import TextureMatrices, lbp_image, tas_image
+from utils import abs_path, check_folder
+
+# Image sizes of the benchmarks
+BENCHMARK_SIZES = (256, 512, 1024)
+
+# Relative change of a result that counts as a regression
+REGRESSION_TOLERANCE = 0.2
+
+
+def synthetic_xray(size: int, seed: int = 0):
+    """
+    Generate a chest X-ray-like image and its lung mask.
+
+    Args:
+        size (int): The width and height of the image.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        tuple: (image, mask), both uint8 arrays of shape (size, size)
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((size, size), 170, dtype=np.uint8)
+    mask = np.zeros((size, size), dtype=np.uint8)
+
+    # Two dark ellipses standing for the lungs
+    for side in (0.3, 0.7):
+        center = (int(size * (side + rng.uniform(-0.03, 0.03))), int(size * rng.uniform(0.45, 0.55)))
+        axes = (int(size * rng.uniform(0.12, 0.16)), int(size * rng.uniform(0.28, 0.34)))
+        cv2.ellipse(img, center, axes, 0, 0, 360, 70, -1)
+        cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+
+    # Soft edges (the masks of the segmentation model have them too) and some texture
+    img = cv2.GaussianBlur(img, (0, 0), size / 64)
+    mask = cv2.GaussianBlur(mask, (0, 0), size / 128)
+    noise = rng.normal(0, 12, (size, size))
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    return img, mask
+
+
+def write_synthetic_dataset(folder: str, count: int, size: int):
+    """
+    Write a synthetic dataset of images and masks, laid out like the generated datasets.
+
+    Args:
+        folder (str): The folder where the "images" and "masks" folders are created.
+        count (int): The number of images.
+        size (int): The width and height of the images.
+
+    Returns:
+        tuple: (images folder path, masks folder path)
+    """
+    images_path = abs_path(folder, "images")
+    masks_path = abs_path(folder, "masks")
+    check_folder(images_path)
+    check_folder(masks_path)
+
+    for i in range(count):
+        img, mask = synthetic_xray(size, seed=i)
+        cv2.imwrite(abs_path(images_path, "xray_%d.png" % i), img)
+        cv2.imwrite(abs_path(masks_path, "xray_%d_mask.png" % i), mask)
+
+    return images_path, masks_path
+
+
+def bench_radiomics_extractor(count: int = 20, size: int = 256):
+    """
+    Compare the per-image cost of ImageTuple.radiomics when a new extractor is built for every image (the old
+    behaviour) and when the extractor of the process is reused.
+
+    Args:
+        count (int, optional): The number of images. Defaults to 20.
+        size (int, optional): The width and height of the images. Defaults to 256.
+
+    Returns:
+        dict: the mean seconds per image for both modes
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        images_path, masks_path = write_synthetic_dataset(folder, count, size)
+        tuples = [ImageTuple.from_image(Image(abs_path(images_path, file), target_size=(size, size)),
+                                        masks_path, (size, size))
+                  for file in sorted(os.listdir(images_path))]
+
+        def time_per_image(clear_cache):
+            start = time.perf_counter()
+            for img_tuple in tuples:
+                if clear_cache:
+                    image._RADIOMICS_EXTRACTORS.clear()
+                img_tuple.radiomics()
+            return (time.perf_counter() - start) / count
+
+        results = {
+            "new_extractor_per_image": time_per_image(clear_cache=True),
+            "cached_extractor": time_per_image(clear_cache=False),
+        }
+
+    print(f"Radiomics per image ({size}x{size}, {count} images): "
+          f"{results['new_extractor_per_image'] * 1000:.1f} ms with a new extractor, "
+          f"{results['cached_extractor'] * 1000:.1f} ms with the cached one")
+    return results
+
+
+def peak_rss() -> int:
+    """
+    Return the peak resident memory of the process so far, in bytes (see run_isolated).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(func, items, items_per_call: int = 1) -> dict:
+    """
+    Call a function on every item and summarize the latencies.
+
+    Args:
+        func (callable): The function, called with each item.
+        items (list): The items.
+        items_per_call (int or list, optional): The number of images each call handles, for the throughput, or the
+            number of images of each item. Defaults to 1.
+
+    Returns:
+        dict: the throughput (images/s), the latency percentiles and mean (seconds per call), and the peak RSS of the
+        process when it is done (bytes), which is the peak of the benchmark when it runs in its own process
+    """
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.asarray(latencies)
+    num_images = sum(items_per_call) if isinstance(items_per_call, list) else len(items) * items_per_call
+    p50, p90, p99 = np.percentile(latencies, (50, 90, 99))
+    return {
+        "throughput": float(num_images / latencies.sum()),
+        "latency_p50": float(p50),
+        "latency_p90": float(p90),
+        "latency_p99": float(p99),
+        "latency_mean": float(latencies.mean()),
+        "peak_rss": peak_rss(),
+    }
+
+
+def bench_image_load(images_path, size):
+    """
+    Time the decoding and resizing of the images by Image, without the decode cache.
+    """
+    files = [abs_path(images_path, file) for file in sorted(os.listdir(images_path))]
+    decode_cache = get_decode_cache()
+
+    def load(file):
+        # The decode cache is None when it is disabled in the config
+        if decode_cache is not None:
+            decode_cache.clear()
+        Image(file, target_size=(size, size))
+
+    return measure(load, files)
+
+
+def bench_image_processor(images_path, masks_path, size, batch_size=8):
+    """
+    Time CLAHE and the masking of ImageProcessor, one batch of decoded images at a time.
+    """
+    tuples = [ImageTuple.from_image(Image(abs_path(images_path, file), target_size=(size, size)), masks_path,
+                                    (size, size))
+              for file in sorted(os.listdir(images_path))]
+    processor = ImageProcessor(images_path, masks_path, (size, size))
+    batches = [(np.stack([t.image.data for t in tuples[i:i + batch_size]]),
+                np.stack([t.mask.data for t in tuples[i:i + batch_size]]))
+               for i in range(0, len(tuples), batch_size)]
+
+    # The first call compiles the masking kernel
+    processor.process_batch(*batches[0])
+    return measure(lambda batch: processor.process_batch(*batch), batches,
+                   items_per_call=[len(images) for images, _ in batches])
+
+
+def bench_mask_generator(images_path, size, batch_size=4):
+    """
+    Time LungMaskGenerator on the images, with an untrained U-Net of the same architecture (so no weights are needed),
+    from the decoding of the images to the writing of the masks.
+    """
+    files = [abs_path(images_path, file) for file in sorted(os.listdir(images_path))]
+    seg_model = model(input_size=(size, size, 1))
+    with tempfile.TemporaryDirectory() as masks_path:
+        generator = LungMaskGenerator(input_size=(size, size, 1), target_size=(size, size), folder_in=images_path,
+                                      folder_out=masks_path, batch_size=batch_size)
+        # The first call builds the graph of the model
+        generator.generate(files[:batch_size], seg_model)
+        batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+        return measure(lambda batch: generator.generate(batch, seg_model), batches,
+                       items_per_call=[len(batch) for batch in batches])
+
+
+def bench_mahotas(images_path, size):
+    """
+    Time Image.mahotas_characteristics.
+    """
+    images = [Image(abs_path(images_path, file), target_size=(size, size)) for file in sorted(os.listdir(images_path))]
+    return measure(lambda img: img.mahotas_characteristics(), images)
+
+
+def bench_radiomics(images_path, masks_path, size):
+    """
+    Time ImageTuple.radiomics, with the extractor of the process already built.
+    """
+    tuples = [ImageTuple.from_image(Image(abs_path(images_path, file), target_size=(size, size)), masks_path,
+                                    (size, size))
+              for file in sorted(os.listdir(images_path))]
+    tuples[0].radiomics()
+    return measure(lambda img_tuple: img_tuple.radiomics(), tuples)
+
+
+def bench_lbp_tas(images_path, size):
+    """
+    Time the LBP and TAS kernels on an image, as the feature extraction runs them.
+    """
+    images = [Image(abs_path(images_path, file), target_size=(size, size)).data
+              for file in sorted(os.listdir(images_path))]
+    # The first call compiles the kernels
+    lbp_image(images[0])
+    tas_image(images[0])
+    return measure(lambda data: (lbp_image(data), tas_image(data)), images)
+
+
+def bench_texture_engine(images_path, masks_path, size):
+    """
+    Time the texture engine: building the texture matrices of an image and its mask, and computing the Haralick
+    features and the radiomics texture features from them.
+    """
+    tuples = [ImageTuple.from_image(Image(abs_path(images_path, file), target_size=(size, size)), masks_path,
+                                    (size, size))
+              for file in sorted(os.listdir(images_path))]
+    profile = radiomics_profile()
+
+    def extract(img_tuple):
+        textures = TextureMatrices.from_profile(img_tuple.image.data, img_tuple.mask.data, profile)
+        textures.haralick()
+        textures.radiomics_features()
+
+    # The first call compiles the kernels
+    extract(tuples[0])
+    return measure(extract, tuples)
+
+
+def bench_load_characteristics(rows=20000, columns=219, repeat=5):
+    """
+    Time the loading, balancing, scaling and feature selection of the characteristics by the Classifier, on a
+    synthetic npy characteristics folder of three labels.
+    """
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        path = abs_path(folder, "characteristics")
+        with NpyCharacteristicsWriter(path, rows) as writer:
+            for i in range(rows):
+                writer.write(rng.random(columns), i % 3)
+        result = measure(lambda _: Classifier(characteristics_artifact=path), range(repeat), items_per_call=rows)
+    return result
+
+
+def run_isolated(bench, *args):
+    """
+    Run a benchmark function in a fresh process and return its result.
+
+    The peak RSS of a process only grows, so measured in a process shared by every benchmark it would be the peak of
+    the biggest one run so far: each benchmark gets its own process instead.
+    """
+    with ProcessPoolExecutor(1, mp_context=mp.get_context("spawn")) as executor:
+        return executor.submit(bench, *args).result()
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, count=8) -> dict:
+    """
+    Run every benchmark on synthetic images of each size, with no dataset, GPU or network needed. Each benchmark runs
+    in its own process (see run_isolated).
+
+    Args:
+        sizes (iterable, optional): The image sizes. Defaults to 256, 512 and 1024.
+        count (int, optional): The number of images of each size. Defaults to 8.
+
+    Returns:
+        dict: the results of each benchmark, by "name/size"
+    """
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            images_path, masks_path = write_synthetic_dataset(folder, count, size)
+            for name, bench, args in (("image_load", bench_image_load, (images_path, size)),
+                                      ("image_processor", bench_image_processor, (images_path, masks_path, size)),
+                                      ("mask_generator", bench_mask_generator, (images_path, size)),
+                                      ("mahotas_characteristics", bench_mahotas, (images_path, size)),
+                                      ("lbp_tas", bench_lbp_tas, (images_path, size)),
+                                      ("radiomics", bench_radiomics, (images_path, masks_path, size)),
+                                      ("texture_engine", bench_texture_engine, (images_path, masks_path, size))):
+                print(f"Running {name} at {size}x{size}")
+                results["%s/%d" % (name, size)] = run_isolated(bench, *args)
+
+    print("Running load_characteristics")
+    results["load_characteristics"] = run_isolated(bench_load_characteristics)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list:
+    """
+    Compare benchmark results with a baseline: a lower throughput, or a higher median latency or peak RSS, by more
+    than the tolerance is a regression.
+
+    Args:
+        results (dict): The results, see run_benchmarks.
+        baseline (dict): The baseline results.
+        tolerance (float, optional): The relative change allowed. Defaults to 0.2.
+
+    Returns:
+        list[str]: the regressions found
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']:.2f}/s < {base['throughput']:.2f}/s")
+        for key in ("latency_p50", "peak_rss"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {result[key]:.4g} > {base[key]:.4g}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image and feature hot paths on synthetic images.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES))
+    parser.add_argument("--count", type=int, default=8, help="images of each size")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--radiomics-extractor", action="store_true",
+                        help="also compare a new radiomics extractor per image with the cached one")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.count)
+    report = {"machine": {"platform": platform.platform(), "python": platform.python_version(),
+                          "cpus": os.cpu_count()},
+              "results": results}
+    if args.radiomics_extractor:
+        # Not a measure() result, so it is reported next to the results rather than compared with the baseline
+        print("Running radiomics_extractor")
+        report["radiomics_extractor"] = run_isolated(bench_radiomics_extractor)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create it")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regression against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
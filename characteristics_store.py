@@ -0,0 +1,177 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils import abs_path, check_folder
+
+# Supported characteristics formats
+CSV_FORMAT = "csv"
+NPY_FORMAT = "npy"
+
+# Files of the npy format, inside the characteristics folder
+NPY_FEATURES_FILE = "features.npy"
+NPY_LABELS_FILE = "labels.npy"
+
+# Names of the feature columns, inside the npy folder or next to the csv file (with this suffix)
+COLUMNS_FILE = "columns.json"
+
+
+def columns_path(path: str) -> str:
+    """
+    Return the path of the file with the names of the feature columns of a csv file or an npy folder.
+    """
+    if os.path.isdir(path) or not path.endswith(".csv"):
+        return abs_path(path, COLUMNS_FILE)
+    return path + "." + COLUMNS_FILE
+
+
+def write_columns(path: str, columns):
+    """
+    Write the names of the feature columns of a csv file or an npy folder, if they are known.
+    """
+    if columns is not None:
+        with open(columns_path(path), 'w') as f:
+            json.dump(list(columns), f)
+
+
+def load_columns(path: str):
+    """
+    Load the names of the feature columns of a csv file or an npy folder.
+
+    Returns:
+        list[str]: the names, or None if they were not written
+    """
+    try:
+        with open(columns_path(path)) as f:
+            return json.load(f)
+    except OSError:
+        return None
+
+
+class CsvCharacteristicsWriter:
+    """
+    Writes one row of features per image to a csv file, followed by the label of the image.
+    """
+
+    def __init__(self, path: str, columns=None):
+        self.path = path
+        self.columns = columns
+        self.__file = open(path, 'w')
+        self.__writer = csv.writer(self.__file)
+
+    def write(self, features, label):
+        """
+        Write the features and the label of an image.
+
+        Args:
+            features (list): The features of the image.
+            label (int): The label of the image.
+        """
+        self.__writer.writerow(list(features) + [label])
+
+    def close(self):
+        self.__file.close()
+        write_columns(self.path, self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class NpyCharacteristicsWriter:
+    """
+    Writes the features of the images as a float32 matrix and their labels as an int32 vector, to a pair of .npy files
+    inside a folder, so they can be memory-mapped when loaded.
+    """
+
+    def __init__(self, path: str, num_rows: int, columns=None):
+        """
+        Args:
+            path (str): The folder where the .npy files are written.
+            num_rows (int): The maximum number of rows (images) that will be written.
+            columns (list[str], optional): The names of the feature columns. Defaults to None (unknown).
+        """
+        self.path = path
+        self.columns = columns
+        self.num_rows = num_rows
+        self.count = 0
+        self.features = None
+        self.labels = np.empty(num_rows, dtype=np.int32)
+
+    def write(self, features, label):
+        """
+        Write the features and the label of an image.
+
+        Args:
+            features (list): The features of the image.
+            label (int): The label of the image.
+        """
+        if self.features is None:
+            # The number of features is known with the first image
+            self.features = np.empty((self.num_rows, len(features)), dtype=np.float32)
+        self.features[self.count] = features
+        self.labels[self.count] = label
+        self.count += 1
+
+    def close(self):
+        check_folder(self.path)
+        features = self.features if self.features is not None else np.empty((0, 0), dtype=np.float32)
+        np.save(abs_path(self.path, NPY_FEATURES_FILE), features[:self.count])
+        np.save(abs_path(self.path, NPY_LABELS_FILE), self.labels[:self.count])
+        write_columns(self.path, self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def characteristics_writer(path: str, characteristics_format: str, num_rows: int, columns=None):
+    """
+    Create a characteristics writer for the given format.
+
+    Args:
+        path (str): The csv file or the npy folder to write.
+        characteristics_format (str): "csv" or "npy".
+        num_rows (int): The maximum number of rows (images) that will be written.
+        columns (list[str], optional): The names of the feature columns, written along with them. Defaults to None.
+
+    Returns:
+        CsvCharacteristicsWriter or NpyCharacteristicsWriter: the writer
+    """
+    if characteristics_format == CSV_FORMAT:
+        return CsvCharacteristicsWriter(path, columns)
+    if characteristics_format == NPY_FORMAT:
+        return NpyCharacteristicsWriter(path, num_rows, columns)
+    raise ValueError(f"Invalid characteristics format: {characteristics_format}")
+
+
+def load_characteristics(path: str):
+    """
+    Load the features and labels written by a characteristics writer.
+
+    The npy format is memory-mapped, so loading it doesn't copy or parse anything.
+
+    Args:
+        path (str): The csv file or the npy folder.
+
+    Returns:
+        tuple: (features matrix, labels vector)
+    """
+    if os.path.isdir(path):
+        features = np.load(abs_path(path, NPY_FEATURES_FILE), mmap_mode='r')
+        labels = np.load(abs_path(path, NPY_LABELS_FILE), mmap_mode='r')
+        return features, labels
+
+    # The csv writer writes no header, the names of the columns are in their own file
+    characteristics_df = pd.read_csv(path, header=None)
+    columns = load_columns(path)
+    if columns is not None:
+        characteristics_df.columns = list(columns) + ["label"]
+    return characteristics_df.iloc[:, :-1].values, characteristics_df.iloc[:, -1].values
@@ -14,7 +14,9 @@ from wandb.keras import WandbCallback
 import wandb
 
 from tuner import CustomTuner
-from utils import load_config
+from utils import abs_path, load_config
+from characteristics_store import load_characteristics, load_columns
+from feature_registry import FeatureSelection
 from wandb_utils import WandbUtils
 
 
@@ -36,6 +38,9 @@ class Classifier:
         # Load the WandB project name from the configuration file
         self.wdb_project = load_config("wb_project_name")
 
+        # Selected columns of the characteristics, when their names are known (see save_selection)
+        self.selection = None
+
         num_samples = -1
 
         # Load the characteristics artifact if provided
@@ -54,34 +59,35 @@ class Classifier:
 
     def __load_characteristics(self, characteristics_artifact):
         """
-        Loads the image characteristics and labels from a CSV file, splits the data into training and testing sets, and normalizes the image characteristics using the StandardScaler function.
+        Loads the image characteristics and labels from a CSV file or an npy folder, keeps the same number of samples
+        for each label and normalizes the image characteristics using the MinMaxScaler function.
 
         Args:
-            characteristics_artifact (str): The path to the CSV file containing the image characteristics and labels.
-            num_samples (int): The number of samples to load for each label.
-            test_size (float, optional): The proportion of the data to use for testing. Defaults to 0.2.
+            characteristics_artifact (str): The path to the CSV file or the npy folder containing the image characteristics and labels.
         Returns:
-            None
+            int: The number of samples kept for each label.
         """
-        # Read the CSV file containing the image characteristics
-        characteristics_df = pd.read_csv(characteristics_artifact)
-        print("SHAPE:" + str(characteristics_df.shape))
+        # Read the image characteristics (the npy format is memory-mapped, not copied)
+        all_characteristics, all_labels = load_characteristics(characteristics_artifact)
+        print("SHAPE:" + str(all_characteristics.shape))
 
-        # Group the DataFrame by the label column
-        grouped = characteristics_df.groupby(characteristics_df.columns[-1])
+        # Group the rows by label
+        classes = np.unique(all_labels)
+        grouped = [np.flatnonzero(all_labels == label) for label in classes]
 
         # Define the number of classes
         self.num_classes = len(grouped)
 
         # Define the num_samples based on the label with less samples
-        num_samples = min([len(group) for _, group in grouped])
+        num_samples = min([len(group) for group in grouped])
 
-        # Create a new DataFrame with the first <num_samples> elements from each group
-        characteristics_df = pd.concat([group.iloc[:num_samples] for _, group in grouped])
+        # Keep the first <num_samples> rows of each group
+        rows = np.concatenate([group[:num_samples] for group in grouped])
 
         # Extract the input data (image characteristics) and output data (labels)
-        image_characteristics = characteristics_df.iloc[:, :-1].values
-        self.labels = characteristics_df.iloc[:, -1].values
+        # Indexing the rows already copies them, keep that copy as float32 instead of converting it again
+        image_characteristics = all_characteristics[rows]
+        self.labels = np.asarray(all_labels[rows])
 
         # Normalize the data using the MinMaxScaler function
         scaler = MinMaxScaler(feature_range=(0, 1))
@@ -92,8 +98,31 @@ class Classifier:
         kbest.fit(normalized_characteristics, self.labels)
         self.features = kbest.transform(normalized_characteristics)
 
+        # Keep the selected columns, so the characteristics of new images can be extracted from only the feature
+        # families they need
+        columns = load_columns(characteristics_artifact)
+        if columns is not None:
+            self.selection = FeatureSelection([columns[i] for i in kbest.get_support(indices=True)])
+            print(f"Selected features from the families: {', '.join(self.selection.families())}")
+
         return num_samples
 
+    def save_selection(self, path: str = None):
+        """
+        Write the selected columns of the characteristics, for "extract_selected_features" (see FeatureSelection).
+
+        Args:
+            path (str, optional): The JSON file to write. Defaults to "feature_selection_path" in the config.
+
+        Returns:
+            bool: whether the selection was written, which needs the names of the columns of the characteristics
+        """
+        if self.selection is None:
+            print("The names of the characteristics columns are unknown, no feature selection saved")
+            return False
+        self.selection.save(path or abs_path(load_config("feature_selection_path")))
+        return True
+
     def categorize_labels(self, labels):
         """
         Convert the labels of the dataset to categorical format if necessary.
@@ -0,0 +1,351 @@
+import os
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from manifest import file_digest
+from utils import abs_path
+
+# JPEG start of frame markers, which hold the size of the image
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(file_path):
+    """
+    Read the size of a PNG or JPEG image from its header, without decoding it.
+
+    Args:
+        file_path (str): path to the image file
+
+    Returns:
+        tuple: (width, height), or None if the format is not recognized
+    """
+    header = image_header(file_path)
+    return None if header is None else header[1:]
+
+
+def image_header(file_path):
+    """
+    Read the format and the size of a PNG or JPEG image from its header, without decoding it.
+
+    Args:
+        file_path (str): path to the image file
+
+    Returns:
+        tuple: (format, width, height), the format being "png" or "jpeg", or None if the format is not recognized
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(24)
+
+        # PNG: the IHDR chunk comes first
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and len(head) == 24:
+            return ("png",) + struct.unpack('>II', head[16:24])
+
+        if head[:2] != b'\xff\xd8':
+            return None
+
+        # JPEG: walk the segments up to the start of frame
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            code = marker[1]
+            while code == 0xFF:
+                padding = f.read(1)
+                if not padding:
+                    return None
+                code = padding[0]
+            if code == 0x01 or 0xD0 <= code <= 0xD8:
+                # Markers without a segment
+                continue
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if code in _JPEG_SOF_MARKERS:
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:5])
+                return "jpeg", width, height
+            f.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+
+def mask_filename(image_filename: str) -> str:
+    """
+    Return the file name of the mask of an image file (of a raw or a processed image).
+    """
+    filename, fileext = os.path.splitext(os.path.basename(image_filename))
+    return ("%s_mask%s" % (filename, fileext)).replace("_processed", "")
+
+
+class DatasetIndex:
+    """
+    A persisted index of the image files of a folder: their names, sizes, modification times, dimensions and content
+    digests, and the names of their masks in a masks folder.
+
+    The index is a table of fixed-size columns stored as an .npz file next to the folder (see `index_path`), so it
+    isn't uploaded with it. It replaces the scans of the folder and the pairing of the masks by file name: it is built
+    once, and then only the new or changed files are read again when it is updated. Each process loads the index of a
+    folder once, trusting it as long as the modification time of the folder didn't change, so whoever writes or deletes
+    files of a folder calls `update` afterwards (`verify` checks every file instead).
+
+    Attributes:
+        folder (str): The folder of the images.
+        entries (ndarray): Structured array of the files, sorted by name.
+        masks_folder (str): The masks folder the masks were paired from, or None.
+    """
+
+    SUFFIX = ".index.npz"
+
+    # Indexes loaded by this process, by folder
+    __loaded = {}
+
+    def __init__(self, folder, entries, folder_mtime, masks_folder=None, masks_mtime=None):
+        self.folder = folder
+        self.entries = entries
+        self.folder_mtime = folder_mtime
+        self.masks_folder = masks_folder
+        self.masks_mtime = masks_mtime
+        self.__rows = {name: i for i, name in enumerate(entries["name"])}
+
+    @staticmethod
+    def index_path(folder):
+        """
+        Return the path of the index file of a folder.
+        """
+        return folder.rstrip("/\\") + DatasetIndex.SUFFIX
+
+    @staticmethod
+    def __dtype(name_length):
+        return np.dtype([("name", "U%d" % name_length), ("size", np.int64), ("mtime", np.int64),
+                         ("width", np.int32), ("height", np.int32), ("digest", "S64"),
+                         ("mask", "U%d" % (name_length + 5))])
+
+    @staticmethod
+    def __scan(folder):
+        """
+        Return the name, size and modification time of every image file of a folder (the files glob("*g") finds),
+        sorted by name.
+        """
+        files = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith("g") and not entry.name.startswith(".") and entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return sorted(files)
+
+    @classmethod
+    def open(cls, folder):
+        """
+        Open the stored index of a folder.
+
+        Returns:
+            DatasetIndex: the index, or None if it doesn't exist or can't be read
+        """
+        try:
+            with np.load(cls.index_path(folder)) as stored:
+                masks_folder = str(stored["masks_folder"]) or None
+                return cls(folder, stored["entries"], int(stored["folder_mtime"]), masks_folder,
+                           int(stored["masks_mtime"]))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        """
+        Write the index file, through a temporary file of its own, so processes saving the same index don't clash.
+
+        The index only saves work, so failing to write it is reported rather than raised: the next process to load it
+        builds it again.
+
+        Returns:
+            bool: whether the index file was written
+        """
+        path = self.index_path(self.folder)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp.npz", dir=os.path.dirname(os.path.abspath(path)))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, entries=self.entries, folder_mtime=np.int64(self.folder_mtime),
+                         masks_folder=np.str_(self.masks_folder or ""), masks_mtime=np.int64(self.masks_mtime or 0))
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            print(f"Could not save the index of {self.folder}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    @classmethod
+    def build(cls, folder, previous=None, num_threads=None):
+        """
+        Index the image files of a folder, reading only the files that are new or changed since the previous index.
+
+        Args:
+            folder (str): The folder of the images.
+            previous (DatasetIndex, optional): The previous index of the folder. Defaults to None (read every file).
+            num_threads (int, optional): The number of reading threads. Defaults to the number of CPUs.
+
+        Returns:
+            DatasetIndex: the index, saved
+        """
+        folder_mtime = os.stat(folder).st_mtime_ns
+        files = cls.__scan(folder)
+        entries = np.zeros(len(files), dtype=cls.__dtype(max([len(name) for name, _, _ in files], default=1)))
+        if files:
+            entries["name"], entries["size"], entries["mtime"] = zip(*files)
+
+        changed = []
+        for i, (name, size, mtime) in enumerate(files):
+            row = previous.row(name) if previous is not None else None
+            if row is not None and (row["size"], row["mtime"]) == (size, mtime):
+                entries["width"][i], entries["height"][i], entries["digest"][i] = \
+                    row["width"], row["height"], row["digest"]
+            else:
+                changed.append(i)
+
+        def read(i):
+            file_path = abs_path(folder, files[i][0])
+            return image_size(file_path) or (0, 0), file_digest(file_path)
+
+        # Most of the time goes to reading the files, which releases the GIL
+        with ThreadPoolExecutor(num_threads or os.cpu_count()) as executor:
+            for i, ((width, height), digest) in zip(changed, executor.map(read, changed)):
+                entries["width"][i], entries["height"][i], entries["digest"][i] = width, height, digest
+
+        if changed:
+            print(f"Indexed {len(changed)} new or changed files of {folder}, {len(files) - len(changed)} are unchanged")
+
+        index = cls(folder, entries, folder_mtime)
+        index.save()
+        return index
+
+    def __is_current(self):
+        """
+        Whether the folder still has the files of the index, with the same sizes and modification times.
+        """
+        files = self.__scan(self.folder)
+        if len(files) != len(self.entries):
+            return False
+        if not files:
+            return True
+        names, sizes, mtimes = zip(*files)
+        return (self.entries["name"].tolist() == list(names) and np.array_equal(self.entries["size"], sizes)
+                and np.array_equal(self.entries["mtime"], mtimes))
+
+    @classmethod
+    def load(cls, folder):
+        """
+        Return the index of a folder, loading it only once per process, and building it if it doesn't exist or files
+        were added to or removed from the folder since it was built (only the new or changed files are read).
+
+        Only the modification time of the folder is checked, not every file: a file overwritten in place isn't seen
+        until `update` (called by whoever writes the files) or `verify`. The steps reading a folder call `verify` once,
+        in the parent process, before the image stacks are opened and the worker processes load the index.
+        """
+        index = cls.__loaded.get(folder)
+        if index is None and not os.path.isdir(folder):
+            # Like an empty folder, without keeping or saving it
+            return cls(folder, np.zeros(0, dtype=cls.__dtype(1)), 0)
+        if index is None:
+            index = cls.open(folder)
+            if index is None or index.folder_mtime != os.stat(folder).st_mtime_ns:
+                index = cls.build(folder, index)
+            cls.__loaded[folder] = index
+        return index
+
+    @classmethod
+    def verify(cls, folder):
+        """
+        Return the index of a folder, after checking the size and modification time of every file, and updating the
+        index if any changed (for files changed in place by something that didn't call `update`).
+        """
+        index = cls.load(folder)
+        if os.path.isdir(folder) and not index.__is_current():
+            index = cls.update(folder)
+        return index
+
+    @classmethod
+    def update(cls, folder):
+        """
+        Update the index of a folder after its files were written or deleted, checking the size and modification time
+        of every file.
+        """
+        index = cls.build(folder, cls.__loaded.get(folder) or cls.open(folder))
+        cls.__loaded[folder] = index
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        """
+        Return the file names of the images, sorted.
+        """
+        return self.entries["name"].tolist()
+
+    def paths(self):
+        """
+        Return the paths of the image files, sorted by name.
+        """
+        return [abs_path(self.folder, name) for name in self.names()]
+
+    def row(self, file_path):
+        """
+        Return the entry of an image file, or None if it isn't in the index.
+        """
+        i = self.__rows.get(os.path.basename(file_path))
+        return None if i is None else self.entries[i]
+
+    def digest(self, file_path):
+        """
+        Return the SHA-256 digest of the content of an image file, or None if it isn't in the index.
+        """
+        row = self.row(file_path)
+        return None if row is None else row["digest"].decode()
+
+    def dimensions(self, file_path):
+        """
+        Return the (width, height) of an image file, or None if it isn't in the index or its format is unknown.
+        """
+        row = self.row(file_path)
+        if row is None or row["width"] == 0:
+            return None
+        return int(row["width"]), int(row["height"])
+
+    def pair_masks(self, masks_folder):
+        """
+        Pair every image with its mask in a masks folder, unless they were already paired with the current masks.
+
+        Args:
+            masks_folder (str): The folder of the masks.
+
+        Returns:
+            DatasetIndex: this index
+        """
+        masks_index = DatasetIndex.load(masks_folder)
+        if self.masks_folder == masks_folder and self.masks_mtime == masks_index.folder_mtime:
+            return self
+
+        masks = set(masks_index.names())
+        self.entries["mask"] = [mask if mask in masks else "" for mask in map(mask_filename, self.entries["name"])]
+        self.masks_folder = masks_folder
+        self.masks_mtime = masks_index.folder_mtime
+        self.save()
+        return self
+
+    def mask_path(self, file_path, masks_folder):
+        """
+        Return the path of the mask of an image file in a masks folder.
+
+        Returns:
+            str: the path of the mask, or None if the image has no mask there
+        """
+        self.pair_masks(masks_folder)
+        row = self.row(file_path)
+        if row is None or not row["mask"]:
+            return None
+        return abs_path(masks_folder, str(row["mask"]))
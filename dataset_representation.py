@@ -1,5 +1,6 @@
 from utils import abs_path, load_config
-from glob import glob
+from dataset_index import DatasetIndex
+from image import ImageStack
 
 # TAG VARIABLES:
 DATASET_TAG = "dataset"
@@ -28,6 +29,8 @@ class DatasetRepresentation:
             Get a list of all files with the specified extension from the dataset directory.
         wb_artifact_path(project_path, wdb_alias):
             Get the W&B artifact path for the dataset.
+        image_stack(target_size):
+            Get the memory-mapped image stack of the dataset, building it if needed.
     """
 
     def __init__(self, parent_tag: str, tag: str, path: str):
@@ -46,7 +49,7 @@ class DatasetRepresentation:
 
     def images(self, extension: str = "g") -> list[str]:
         """
-        Get a list of all files with the specified extension from the dataset directory.
+        Get a list of all files with the specified extension from the dataset directory, from its DatasetIndex.
 
         Args:
             extension: The file extension to search for. Defaults to "g".
@@ -54,11 +57,23 @@ class DatasetRepresentation:
         Returns:
             A list of all files with the specified extension from the dataset directory.
         """
-        return glob(self.path + f"/*{extension}")
+        return [path for path in DatasetIndex.load(self.path).paths() if path.endswith(extension)]
 
     def wb_artifact_path(self, project_path: str, wdb_alias: str) -> str:
         return '%s/%s:%s' % (project_path, self.tag, wdb_alias)
 
+    def image_stack(self, target_size) -> ImageStack:
+        """
+        Get the memory-mapped image stack of the dataset, building it if it doesn't exist or the images changed.
+
+        Args:
+            target_size: The size of the images in the stack.
+
+        Returns:
+            The image stack of the dataset.
+        """
+        return ImageStack.load(self.path, target_size)
+
 
 class CovidDataset(DatasetRepresentation):
     def __init__(self):
@@ -92,7 +107,10 @@ class NormalProcessedDataset(DatasetRepresentation):
 
 class Characteristics(DatasetRepresentation):
     def __init__(self):
-        super().__init__(CHARACTERISTICS_TAG, CHARACTERISTICS_TAG, abs_path(load_config("characteristics_path")))
+        # "csv" is a single file, "npy" is a folder with the feature matrix and the label vector
+        self.format = load_config("characteristics_format")
+        path_key = "characteristics_npy_path" if self.format == "npy" else "characteristics_path"
+        super().__init__(CHARACTERISTICS_TAG, CHARACTERISTICS_TAG, abs_path(load_config(path_key)))
 
 
 class Model(DatasetRepresentation):
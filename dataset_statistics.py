@@ -0,0 +1,169 @@
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    A mergeable quantile sketch of many independent series of non-negative values (one per histogram bin), in
+    constant memory.
+
+    Values are counted in logarithmic buckets (as in DDSketch), so any quantile is known within `relative_accuracy`
+    of its exact value, whatever the number of values added. Two sketches with the same parameters are merged by
+    adding their buckets, so sketches built in different processes can be combined.
+
+    Attributes:
+        size (int): The number of series.
+        relative_accuracy (float): The relative error bound of the quantiles.
+        count (int): The number of values added to each series.
+    """
+
+    def __init__(self, size: int, relative_accuracy: float = 0.01, max_value: float = 2 ** 32):
+        """
+        Args:
+            size (int): The number of series.
+            relative_accuracy (float, optional): The relative error bound of the quantiles. Defaults to 0.01.
+            max_value (float, optional): The biggest value expected, bigger values are counted as it. Defaults to 2^32.
+        """
+        self.size = size
+        self.relative_accuracy = relative_accuracy
+        self.max_value = max_value
+        self.count = 0
+        self.__gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.__log_gamma = math.log(self.__gamma)
+        num_buckets = int(math.ceil(math.log(max_value) / self.__log_gamma)) + 1
+        # Values below 1 (including zeros) share the first bucket
+        self.buckets = np.zeros((size, num_buckets), dtype=np.int64)
+        self.zeros = np.zeros(size, dtype=np.int64)
+
+    def add(self, values):
+        """
+        Add one value to every series.
+
+        Args:
+            values (array_like): The values, one per series.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        is_zero = values <= 0
+        self.zeros += is_zero
+
+        with np.errstate(divide='ignore'):
+            indexes = np.ceil(np.log(np.maximum(values, 1)) / self.__log_gamma).astype(np.int64)
+        indexes = np.clip(indexes, 0, self.buckets.shape[1] - 1)
+        rows = np.flatnonzero(~is_zero)
+        self.buckets[rows, indexes[rows]] += 1
+        self.count += 1
+
+    def merge(self, other: "QuantileSketch"):
+        """
+        Add the values of another sketch with the same parameters to this one.
+
+        Returns:
+            QuantileSketch: this sketch
+        """
+        if self.buckets.shape != other.buckets.shape or self.relative_accuracy != other.relative_accuracy:
+            raise ValueError("Only sketches with the same parameters can be merged")
+        self.buckets += other.buckets
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float):
+        """
+        Return the q-quantile of every series.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            ndarray: the quantile of each series
+        """
+        if self.count == 0:
+            return np.full(self.size, np.nan)
+
+        rank = q * (self.count - 1)
+        cumulative = np.cumsum(self.buckets, axis=1) + self.zeros[:, np.newaxis]
+        indexes = np.argmax(cumulative > rank, axis=1)
+        # Middle of the bucket, which is within relative_accuracy of every value in it
+        values = 2 * self.__gamma ** indexes / (self.__gamma + 1)
+        values[indexes == 0] = 1
+        return np.where(self.zeros > rank, 0, values)
+
+
+class HistogramStatistics:
+    """
+    Streaming statistics of the histograms of a dataset: exact per-bin totals and means, and approximate per-bin
+    medians and percentiles.
+
+    It is fed one histogram at a time by any pass over the images, uses constant memory, and can be merged with the
+    statistics built by other processes.
+
+    Attributes:
+        bins (int): The number of bins of the histograms.
+        count (int): The number of histograms added.
+        totals (ndarray): The per-bin sum of the histograms.
+    """
+
+    def __init__(self, bins: int = 255, relative_accuracy: float = 0.01):
+        self.bins = bins
+        self.count = 0
+        self.totals = np.zeros(bins, dtype=np.int64)
+        self.sketch = QuantileSketch(bins, relative_accuracy)
+
+    @staticmethod
+    def from_images(images):
+        """
+        Compute the statistics of the histograms of some images in a single pass.
+
+        Args:
+            images (iterable[Image]): The images.
+
+        Returns:
+            HistogramStatistics: the statistics
+        """
+        statistics = HistogramStatistics()
+        for img in images:
+            statistics.add(img.hist())
+        return statistics
+
+    def add(self, histogram):
+        """
+        Add the histogram of an image.
+
+        Args:
+            histogram (array_like): The histogram, with `bins` values.
+        """
+        histogram = np.asarray(histogram)
+        self.totals += histogram.astype(np.int64)
+        self.sketch.add(histogram)
+        self.count += 1
+
+    def merge(self, other: "HistogramStatistics"):
+        """
+        Add the histograms of other statistics to these ones.
+
+        Returns:
+            HistogramStatistics: these statistics
+        """
+        self.totals += other.totals
+        self.sketch.merge(other.sketch)
+        self.count += other.count
+        return self
+
+    def mean(self):
+        """
+        Return the exact per-bin mean of the histograms.
+        """
+        return self.totals / max(self.count, 1)
+
+    def median(self):
+        """
+        Return the per-bin median of the histograms, within the relative accuracy of the sketch.
+        """
+        return self.sketch.quantile(0.5)
+
+    def percentile(self, p: float):
+        """
+        Return the per-bin p-th percentile of the histograms, within the relative accuracy of the sketch.
+        """
+        return self.sketch.quantile(p / 100)
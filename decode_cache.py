@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+
+class DecodeCache:
+    """
+    A process-wide, byte-bounded LRU cache of decoded image arrays.
+
+    The cached arrays are shared by everyone who reads the same key, so they are made read-only when stored.
+
+    Attributes:
+        max_bytes (int): The maximum number of bytes of the cached arrays.
+        bytes (int): The number of bytes of the cached arrays.
+        hits (int): The number of lookups that found their key.
+        misses (int): The number of lookups that didn't.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached array of a key, or None if it isn't cached.
+        """
+        with self.__lock:
+            array = self.__entries.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Mark it as the most recently used
+            self.__entries.move_to_end(key)
+            return array
+
+    def put(self, key, array):
+        """
+        Cache an array, evicting the least recently used ones to stay under the byte bound.
+
+        Arrays bigger than the whole cache are not cached.
+        """
+        if array.nbytes > self.max_bytes:
+            return
+        array.setflags(write=False)
+
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self.__entries[key] = array
+            self.bytes += array.nbytes
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Return the hit and miss counters and the size of the cache.
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.__entries), "bytes": self.bytes}
+
+    def __len__(self):
+        return len(self.__entries)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class FeatureCache:
+    """
+    A persistent, content-addressed cache of per-image feature vectors.
+
+    Every entry is a .npy file named after the hash of what produced it (the image and mask data and the extraction
+    configuration), so a changed image or configuration simply misses the cache. The cache is bounded in size: when it
+    grows past `max_bytes`, the least recently used entries are deleted.
+
+    Attributes:
+        path (str): The folder of the cache.
+        max_bytes (int): The maximum size of the cache, in bytes.
+    """
+
+    # Fraction of max_bytes kept after an eviction, so that evictions don't happen on every write
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Initializes a FeatureCache object, creating its folder if needed.
+
+        Args:
+            path (str): The folder of the cache.
+            max_bytes (int): The maximum size of the cache, in bytes.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.__size = None
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(*arrays: np.ndarray, **config) -> str:
+        """
+        Compute the cache key of the given arrays and configuration.
+
+        Args:
+            *arrays (ndarray): The data the features are computed from.
+            **config: Anything else the features depend on (must be JSON serializable).
+
+        Returns:
+            str: the hex digest of the key
+        """
+        digest = hashlib.sha256()
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(f"{array.dtype}{array.shape}".encode())
+            digest.update(array.data)
+        digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def __file(self, key: str) -> str:
+        """
+        Return the path of the entry of a key, spread over sub folders to keep the folders small.
+        """
+        return os.path.join(self.path, key[:2], key + ".npy")
+
+    def get(self, key: str):
+        """
+        Return the cached features of a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            ndarray: the cached features, or None if they are not cached
+        """
+        file = self.__file(key)
+        try:
+            features = np.load(file)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return features
+
+    def put(self, key: str, features):
+        """
+        Store the features of a key, evicting the least recently used entries if the cache gets too big.
+
+        Args:
+            key (str): The cache key.
+            features (array_like): The features to store.
+        """
+        file = self.__file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+
+        # Count the size before writing, and without the entry this one replaces
+        size = self.size()
+        try:
+            size -= os.path.getsize(file)
+        except OSError:
+            pass
+
+        # Write to a temporary file first, so readers never see a partial entry
+        tmp_file = file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            np.save(f, np.asarray(features, dtype=np.float64))
+        os.replace(tmp_file, file)
+
+        self.__size = size + os.path.getsize(file)
+        if self.__size > self.max_bytes:
+            self.evict()
+
+    def __entries(self):
+        """
+        Generate (last use time, size, path) for every entry of the cache.
+        """
+        for root, _, files in os.walk(self.path):
+            for file in files:
+                if not file.endswith(".npy"):
+                    continue
+                file = os.path.join(root, file)
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, file
+
+    def size(self) -> int:
+        """
+        Return the size of the cache, in bytes.
+        """
+        if self.__size is None:
+            self.__size = sum(size for _, size, _ in self.__entries())
+        return self.__size
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is back under its size bound.
+        """
+        entries = sorted(self.__entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.EVICTION_TARGET
+
+        for _, entry_size, file in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(file)
+                size -= entry_size
+            except OSError:
+                pass
+
+        self.__size = size
@@ -0,0 +1,126 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+# Percentiles of the per-image measures reported for each feature family
+PROFILE_PERCENTILES = (50, 90, 99)
+
+
+class FamilyProfiler:
+    """
+    Measures the wall time and the memory allocated by each feature family, for a single image at a time.
+
+    The allocations are those seen by tracemalloc (Python objects and NumPy arrays), as the peak traced memory while
+    the family runs. Tracing slows the extraction down, so it is optional.
+
+    Attributes:
+        measures (dict): The (seconds, bytes) of each family measured since the last `reset`.
+    """
+
+    def __init__(self, allocations: bool = False):
+        """
+        Args:
+            allocations (bool, optional): Whether to measure the allocations too. Defaults to False.
+        """
+        self.allocations = allocations
+        self.measures = {}
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        """
+        Forget the measures, before the next image.
+        """
+        self.measures = {}
+
+    @contextmanager
+    def measure(self, family: str):
+        """
+        Measure the code run inside the context as the given family.
+        """
+        if self.allocations:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[1] - start_memory if self.allocations else 0
+            self.measures[family] = (seconds, allocated)
+
+
+class FeatureProfile:
+    """
+    The per-image measures of every feature family over a run, aggregated into percentiles.
+
+    Attributes:
+        times (dict): The seconds taken by each image, by family.
+        allocations (dict): The bytes allocated for each image, by family.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.allocations = {}
+
+    def add(self, measures: dict):
+        """
+        Add the measures of an image.
+
+        Args:
+            measures (dict): The (seconds, bytes) of each family, see FamilyProfiler.
+        """
+        for family, (seconds, allocated) in measures.items():
+            self.times.setdefault(family, []).append(seconds)
+            self.allocations.setdefault(family, []).append(allocated)
+
+    def __len__(self):
+        return max([len(times) for times in self.times.values()], default=0)
+
+    def summary(self) -> dict:
+        """
+        Return the count, total, mean and percentiles of the time and of the allocations of each family, with the
+        families sorted from the slowest to the fastest overall.
+
+        Returns:
+            dict: the statistics, by family
+        """
+        summary = {}
+        for family, times in self.times.items():
+            times = np.asarray(times)
+            allocations = np.asarray(self.allocations[family])
+            statistics = {"count": len(times), "time_total": float(times.sum()), "time_mean": float(times.mean()),
+                          "alloc_mean": float(allocations.mean())}
+            for p, time_p, alloc_p in zip(PROFILE_PERCENTILES, np.percentile(times, PROFILE_PERCENTILES),
+                                          np.percentile(allocations, PROFILE_PERCENTILES)):
+                statistics["time_p%d" % p] = float(time_p)
+                statistics["alloc_p%d" % p] = float(alloc_p)
+            summary[family] = statistics
+        return dict(sorted(summary.items(), key=lambda item: -item[1]["time_total"]))
+
+    def metrics(self, prefix: str = "feature_profile") -> dict:
+        """
+        Return the summary as flat metrics, e.g. "feature_profile/radiomics_glcm/time_p90", to log them to W&B.
+        """
+        return {"%s/%s/%s" % (prefix, family, name): value
+                for family, statistics in self.summary().items() for name, value in statistics.items()}
+
+    def save(self, path: str):
+        """
+        Write the summary to a JSON report.
+        """
+        with open(path, 'w') as f:
+            json.dump({"images": len(self), "percentiles": list(PROFILE_PERCENTILES), "families": self.summary()}, f,
+                      indent=2)
+
+    def report(self):
+        """
+        Print the time percentiles of each family, the slowest first.
+        """
+        for family, statistics in self.summary().items():
+            print(f"{family}: {statistics['time_total']:.1f}s in total, "
+                  f"p50 {statistics['time_p50'] * 1000:.1f} ms, p99 {statistics['time_p99'] * 1000:.1f} ms, "
+                  f"{statistics['alloc_p50'] / 2 ** 20:.1f} MB allocated (p50)")
@@ -0,0 +1,177 @@
+import json
+import os
+
+from utils import load_config
+
+# Feature families, in the order their columns come in the characteristics
+LBP_FAMILY = "lbp"
+ZERNIKE_FAMILY = "zernike"
+TAS_FAMILY = "tas"
+MAHOTAS_FAMILIES = (LBP_FAMILY, ZERNIKE_FAMILY, TAS_FAMILY)
+
+# PyRadiomics feature classes that can be extracted (the 3D shape features don't make sense for 2D images)
+RADIOMICS_CLASSES = ("firstorder", "glcm", "gldm", "glrlm", "glszm", "ngtdm", "shape2D")
+RADIOMICS_PREFIX = "radiomics_"
+RADIOMICS_FAMILIES = tuple(RADIOMICS_PREFIX + feature_class for feature_class in RADIOMICS_CLASSES)
+
+FEATURE_FAMILIES = MAHOTAS_FAMILIES + RADIOMICS_FAMILIES
+
+# Number of columns of each Mahotas family: LBP with radius 8 and 8 points, Zernike moments of radius 10 and degree 10,
+# and TAS
+MAHOTAS_COLUMNS = {LBP_FAMILY: 36, ZERNIKE_FAMILY: 36, TAS_FAMILY: 54}
+
+# Features of each PyRadiomics class (those it enables by default, i.e. not deprecated), sorted by name as their
+# columns are
+RADIOMICS_FEATURES = {
+    "firstorder": ("10Percentile", "90Percentile", "Energy", "Entropy", "InterquartileRange", "Kurtosis", "Maximum",
+                   "Mean", "MeanAbsoluteDeviation", "Median", "Minimum", "Range", "RobustMeanAbsoluteDeviation",
+                   "RootMeanSquared", "Skewness", "TotalEnergy", "Uniformity", "Variance"),
+    "glcm": ("Autocorrelation", "ClusterProminence", "ClusterShade", "ClusterTendency", "Contrast", "Correlation",
+             "DifferenceAverage", "DifferenceEntropy", "DifferenceVariance", "Id", "Idm", "Idmn", "Idn", "Imc1", "Imc2",
+             "InverseVariance", "JointAverage", "JointEnergy", "JointEntropy", "MCC", "MaximumProbability",
+             "SumAverage", "SumEntropy", "SumSquares"),
+    "gldm": ("DependenceEntropy", "DependenceNonUniformity", "DependenceNonUniformityNormalized",
+             "DependenceVariance", "GrayLevelNonUniformity", "GrayLevelVariance", "HighGrayLevelEmphasis",
+             "LargeDependenceEmphasis", "LargeDependenceHighGrayLevelEmphasis", "LargeDependenceLowGrayLevelEmphasis",
+             "LowGrayLevelEmphasis", "SmallDependenceEmphasis", "SmallDependenceHighGrayLevelEmphasis",
+             "SmallDependenceLowGrayLevelEmphasis"),
+    "glrlm": ("GrayLevelNonUniformity", "GrayLevelNonUniformityNormalized", "GrayLevelVariance",
+              "HighGrayLevelRunEmphasis", "LongRunEmphasis", "LongRunHighGrayLevelEmphasis",
+              "LongRunLowGrayLevelEmphasis", "LowGrayLevelRunEmphasis", "RunEntropy", "RunLengthNonUniformity",
+              "RunLengthNonUniformityNormalized", "RunPercentage", "RunVariance", "ShortRunEmphasis",
+              "ShortRunHighGrayLevelEmphasis", "ShortRunLowGrayLevelEmphasis"),
+    "glszm": ("GrayLevelNonUniformity", "GrayLevelNonUniformityNormalized", "GrayLevelVariance",
+              "HighGrayLevelZoneEmphasis", "LargeAreaEmphasis", "LargeAreaHighGrayLevelEmphasis",
+              "LargeAreaLowGrayLevelEmphasis", "LowGrayLevelZoneEmphasis", "SizeZoneNonUniformity",
+              "SizeZoneNonUniformityNormalized", "SmallAreaEmphasis", "SmallAreaHighGrayLevelEmphasis",
+              "SmallAreaLowGrayLevelEmphasis", "ZoneEntropy", "ZonePercentage", "ZoneVariance"),
+    "ngtdm": ("Busyness", "Coarseness", "Complexity", "Contrast", "Strength"),
+    "shape2D": ("Elongation", "MajorAxisLength", "MaximumDiameter", "MeshSurface", "MinorAxisLength", "Perimeter",
+                "PerimeterSurfaceRatio", "PixelSurface", "Sphericity"),
+}
+
+# PyRadiomics profiles, selected by "radiomics_profile" in the config. Never change a profile: add a new version, so
+# the columns of the characteristics extracted with a profile stay the same.
+# - mask_threshold: the mask pixels above it are the lungs (as ImageProcessor masks the images)
+# - params: the PyRadiomics parameters, the images being 2D, without diagnostics and with a fixed bin width
+RADIOMICS_PROFILES = {
+    "lean_2d_v1": {
+        "mask_threshold": 20,
+        "params": {
+            "setting": {"force2D": True, "force2Ddimension": 0, "binWidth": 25, "label": 1, "additionalInfo": False},
+            "imageType": {"Original": {}},
+            "featureClass": {"firstorder": [], "glcm": [], "gldm": [], "glrlm": [], "glszm": [], "ngtdm": []},
+        },
+    },
+    "lean_2d_shape_v1": {
+        "mask_threshold": 20,
+        "params": {
+            "setting": {"force2D": True, "force2Ddimension": 0, "binWidth": 25, "label": 1, "additionalInfo": False},
+            "imageType": {"Original": {}},
+            "featureClass": {"firstorder": [], "glcm": [], "gldm": [], "glrlm": [], "glszm": [], "ngtdm": [],
+                             "shape2D": []},
+        },
+    },
+}
+
+
+def radiomics_profile(name: str = None) -> dict:
+    """
+    Return a PyRadiomics profile (see RADIOMICS_PROFILES), with its name.
+
+    Args:
+        name (str, optional): The name of the profile. Defaults to "radiomics_profile" in the config.
+
+    Returns:
+        dict: the profile
+    """
+    name = name or load_config("radiomics_profile")
+    if name not in RADIOMICS_PROFILES:
+        raise ValueError(f"Unknown radiomics profile: {name}")
+    return dict(RADIOMICS_PROFILES[name], name=name)
+
+
+def feature_columns(families=None, profile: str = None) -> list:
+    """
+    Return the names of the columns of the characteristics extracted with the given feature families, in order.
+
+    Args:
+        families (iterable, optional): The feature families. Defaults to None (every family).
+        profile (str, optional): The name of the radiomics profile, whose feature classes are extracted. Defaults to
+            "radiomics_profile" in the config.
+
+    Returns:
+        list[str]: the column names
+    """
+    feature_classes = radiomics_profile(profile)["params"]["featureClass"]
+    columns = []
+    for family in sort_families(families or FEATURE_FAMILIES):
+        if family in MAHOTAS_COLUMNS:
+            columns.extend("%s_%d" % (family, i) for i in range(MAHOTAS_COLUMNS[family]))
+        elif family[len(RADIOMICS_PREFIX):] in feature_classes:
+            columns.extend("%s_%s" % (family, name) for name in RADIOMICS_FEATURES[family[len(RADIOMICS_PREFIX):]])
+    return columns
+
+
+def column_family(column: str) -> str:
+    """
+    Return the feature family of a column name, e.g. "lbp" for "lbp_3" and "radiomics_glcm" for
+    "radiomics_glcm_Contrast".
+    """
+    parts = column.split("_")
+    if column.startswith(RADIOMICS_PREFIX):
+        return "_".join(parts[:2])
+    return parts[0]
+
+
+def sort_families(families) -> tuple:
+    """
+    Return the given feature families in the order of FEATURE_FAMILIES, checking they all exist.
+    """
+    families = set(families)
+    unknown = families.difference(FEATURE_FAMILIES)
+    if unknown:
+        raise ValueError(f"Unknown feature families: {sorted(unknown)}")
+    return tuple(family for family in FEATURE_FAMILIES if family in families)
+
+
+class FeatureSelection:
+    """
+    The columns of the characteristics a classifier was trained on.
+
+    It tells which feature families have to be extracted for new images, so the other ones are skipped (see
+    "extract_selected_features" in the config).
+
+    Attributes:
+        columns (list[str]): The names of the selected columns, in the order the classifier takes them.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+
+    def families(self) -> tuple:
+        """
+        Return the feature families the selected columns come from.
+        """
+        return sort_families(column_family(column) for column in self.columns)
+
+    def save(self, path: str):
+        """
+        Write the selection to a JSON file.
+        """
+        with open(path, 'w') as f:
+            json.dump({"columns": self.columns}, f)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Read a selection written by `save`.
+
+        Returns:
+            FeatureSelection: the selection, or None if the file doesn't exist
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            selection = json.load(f)
+        return FeatureSelection(selection["columns"])
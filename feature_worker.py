@@ -0,0 +1,111 @@
+import logging
+
+from feature_cache import FeatureCache
+from feature_profile import FamilyProfiler
+from feature_registry import FEATURE_FAMILIES, sort_families
+from image import Image, ImageTuple, disable_decode_cache, features_config
+
+# Feature cache of a worker process, only read from (the parent process writes the new entries)
+_FEATURE_CACHE = None
+
+
+# Whether the worker processes read the images and masks from their image stacks
+_USE_STACKS = False
+
+
+# Feature families extracted by the worker processes
+_FEATURE_FAMILIES = FEATURE_FAMILIES
+
+
+# Profiler of the feature families of a worker process, when the extraction is profiled
+_PROFILER = None
+
+
+def init_feature_worker(cache_path=None, cache_max_bytes=None, use_stacks=False, families=None, profiling=None):
+    """
+    Initialize a feature extraction worker process.
+
+    Args:
+        cache_path (str, optional): The folder of the feature cache. Defaults to None (no cache).
+        cache_max_bytes (int, optional): The size bound of the feature cache.
+        use_stacks (bool, optional): Whether to read the images and masks from their image stacks. Defaults to False.
+        families (iterable, optional): The feature families to extract. Defaults to None (every family).
+        profiling (str, optional): None, "time" to measure the time of each feature family, or "allocations" to
+            measure their allocations too. Defaults to None.
+    """
+    global _FEATURE_CACHE, _USE_STACKS, _FEATURE_FAMILIES, _PROFILER
+    _USE_STACKS = use_stacks
+    _FEATURE_FAMILIES = sort_families(families or FEATURE_FAMILIES)
+    if profiling:
+        _PROFILER = FamilyProfiler(allocations=profiling == "allocations")
+    if cache_path:
+        _FEATURE_CACHE = FeatureCache(cache_path, cache_max_bytes)
+
+    # Each image and mask is decoded once here, a decode cache per worker would fill up with nothing ever read again
+    disable_decode_cache()
+
+    # PyRadiomics logs a lot of noise for every image
+    logger = logging.getLogger("radiomics")
+    logger.setLevel(logging.ERROR)
+
+
+def extract_features(task):
+    """
+    Extract the features of a single image inside a worker process.
+
+    Args:
+        task (tuple): (image path, masks directory path, target size, label)
+
+    Returns:
+        tuple: (cache key, features, whether the features came from the cache, histogram of the image, measures of the
+        feature families). The cache key is None without a cache, the measures are None when the extraction is not
+        profiled or the features came from the cache.
+    """
+    image_path, masks_path, target_size, _ = task
+    if _USE_STACKS:
+        img_tuple = ImageTuple.from_stacks(image_path, masks_path, target_size)
+    else:
+        img_tuple = ImageTuple.from_image(Image(image_path, target_size=target_size), masks_path, target_size)
+    return _extract_tuple_features(img_tuple, target_size)
+
+
+def extract_array_features(task):
+    """
+    Extract the features of a single image already processed in memory, inside a worker process.
+
+    Args:
+        task (tuple): (image path, mask path, processed image data, mask data, target size, label)
+
+    Returns:
+        tuple: see extract_features
+    """
+    image_path, mask_path, img_data, mask_data, target_size, _ = task
+    img_tuple = ImageTuple(Image.from_array(image_path, img_data), Image.from_array(mask_path, mask_data),
+                           check=False)
+    return _extract_tuple_features(img_tuple, target_size)
+
+
+def _extract_tuple_features(img_tuple, target_size):
+    """
+    Extract the features of an image and its mask (see extract_features).
+    """
+    img = img_tuple.image
+    # Side output for the dataset statistics, so the histograms need no separate pass
+    hist = img.hist()
+
+    key = None
+    if _FEATURE_CACHE is not None:
+        key = FeatureCache.key(img.data, img_tuple.mask.data, target_size=target_size,
+                               features=features_config(families=_FEATURE_FAMILIES))
+        features = _FEATURE_CACHE.get(key)
+        if features is not None:
+            return key, features.tolist(), True, hist, None
+
+    measures = None
+    if _PROFILER is not None:
+        _PROFILER.reset()
+        features = img_tuple.features(_FEATURE_FAMILIES, _PROFILER).values()
+        measures = _PROFILER.measures
+    else:
+        features = img_tuple.features(_FEATURE_FAMILIES).values()
+    return key, [float(feature) for feature in features], False, hist, measures
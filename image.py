@@ -1,5 +1,3 @@
-import pandas as pd
-from glob import glob
 import cv2
 import numpy as np
 import os
@@ -7,16 +5,182 @@ import matplotlib.pyplot as plt
 import mahotas as mt
 from numba import njit, prange
 
-from lung_seg_model import model
-
-from utils import abs_path, load_config
+from utils import abs_path, check_folder, load_config
+from shutil import rmtree
+from worker_pool import ChunkedWorkerPool
+from feature_cache import FeatureCache
+from characteristics_store import characteristics_writer
+from image_writer import ImageWriter
+from decode_cache import DecodeCache
+from dataset_statistics import HistogramStatistics
+from dataset_index import DatasetIndex, image_header, mask_filename
+from feature_profile import FamilyProfiler, FeatureProfile
+from feature_registry import (FEATURE_FAMILIES, LBP_FAMILY, MAHOTAS_FAMILIES, RADIOMICS_CLASSES, RADIOMICS_PREFIX,
+                              TAS_FAMILY, ZERNIKE_FAMILY, column_family, feature_columns,
+                              radiomics_profile, sort_families)
+from texture import TEXTURE_CLASSES, TextureMatrices, lbp_image, tas_image, validate_features
+import radiomics
 from radiomics import featureextractor
 import SimpleITK as sitk
-import multiprocessing as mp
-import logging
 import tqdm
-import math
-import csv
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Radiomics feature extractors of this process, by their parameters
+_RADIOMICS_EXTRACTORS = {}
+
+
+def get_radiomics_extractor(params: dict = None):
+    """
+    Return the radiomics feature extractor of this process for the given parameters, creating it on first use.
+
+    Building an extractor parses its settings and registers every feature class and filter, so each process keeps one
+    per set of parameters instead of building one per image.
+
+    Args:
+        params (dict, optional): PyRadiomics parameters. Defaults to None (the PyRadiomics defaults).
+
+    Returns:
+        RadiomicsFeatureExtractor: the cached extractor
+    """
+    key = json.dumps(params, sort_keys=True, default=str)
+    extractor = _RADIOMICS_EXTRACTORS.get(key)
+    if extractor is None:
+        extractor = featureextractor.RadiomicsFeatureExtractor(params) if params else \
+            featureextractor.RadiomicsFeatureExtractor()
+        _RADIOMICS_EXTRACTORS[key] = extractor
+    return extractor
+
+
+# Bump it whenever the extracted features change, so cached features are not reused
+FEATURES_VERSION = 3
+
+
+def features_config(families=None) -> dict:
+    """
+    Describe how the features of an image are extracted, for the feature cache keys.
+
+    Args:
+        families (iterable, optional): The feature families extracted. Defaults to None (every family).
+
+    Returns:
+        dict: the extraction configuration
+    """
+    return {
+        "version": FEATURES_VERSION,
+        "families": list(sort_families(families or FEATURE_FAMILIES)),
+        "mahotas": {"lbp": [8, 8], "zernike": [10, 10], "tas": True, "mahotas_version": mt.__version__},
+        "radiomics": radiomics_profile(),
+        "radiomics_version": radiomics.__version__,
+        "texture_engine": load_config("texture_engine"),
+        "reduced_decode": load_config("reduced_decode"),
+    }
+
+
+# Reduced decode modes, from the most reduced
+_REDUCED_GRAYSCALE_MODES = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                            (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                            (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+
+def imread_grayscale(file_path, target_size):
+    """
+    Decode an image file in grayscale, at a reduced resolution when it is still bigger than the target size.
+
+    OpenCV decodes JPEG files directly at 1/2, 1/4 or 1/8 of their resolution, which is several times faster and
+    smaller than decoding them at full resolution only to resize them down afterwards. The result still has to be
+    resized to the target size. PNG files are always decoded at full resolution: OpenCV would only decimate them after
+    decoding, which is no faster and gives other pixels than resizing. Set "reduced_decode" to false in the config to
+    always decode at full resolution.
+
+    Args:
+        file_path (str): path to the image file
+        target_size (tuple): the (width, height) the image will be resized to
+
+    Returns:
+        ndarray: the decoded uint8 image, at least as big as target_size when the source is, or None if the file
+        could not be read
+    """
+    flag = cv2.IMREAD_GRAYSCALE
+
+    if load_config("reduced_decode"):
+        header = image_header(file_path)
+        if header is not None and header[0] == "jpeg":
+            # The EXIF orientation may swap width and height, so compare with the smallest side
+            smallest_side = min(header[1:])
+            for factor, reduced_flag in _REDUCED_GRAYSCALE_MODES:
+                if smallest_side // factor >= max(target_size):
+                    flag = reduced_flag
+                    break
+
+    return cv2.imread(file_path, flag)
+
+
+def decode_resized(file_path, target_size):
+    """
+    Decode an image file in grayscale and resize it to the target size, without going through the decode cache.
+
+    Args:
+        file_path (str): path to the image file
+        target_size (tuple): the (width, height) of the image
+
+    Returns:
+        ndarray: the uint8 image
+    """
+    # load image in grayscale, at a reduced resolution when possible
+    img = imread_grayscale(file_path, target_size)
+
+    # resize image, while it is still uint8
+    return cv2.resize(img, target_size)
+
+
+def normalize(img, dtype=None):
+    """
+    Divide a uint8 image by 255 in the floating point dtype of the precision policy.
+
+    Normalizing is done as late as possible (after resizing), so the image stays uint8 for as long as possible, and
+    in "float_dtype" from the config (float32 by default, float16 to halve the memory of stored images) instead of
+    float64.
+
+    Args:
+        img (ndarray): uint8 image data
+        dtype (optional): the floating point dtype. Defaults to "float_dtype" in the config.
+
+    Returns:
+        ndarray: the image data, between 0 and 1
+    """
+    dtype = np.dtype(dtype or load_config("float_dtype"))
+    return img.astype(dtype) / dtype.type(255)
+
+
+# Decode cache of this process, see get_decode_cache
+_DECODE_CACHE = None
+
+
+def get_decode_cache():
+    """
+    Return the decode cache of this process, creating it on first use.
+
+    The cache is bounded by "decode_cache_max_bytes" in the config, and disabled when it is 0.
+
+    Returns:
+        DecodeCache: the cache, or None if it is disabled
+    """
+    global _DECODE_CACHE
+    if _DECODE_CACHE is None:
+        max_bytes = load_config("decode_cache_max_bytes")
+        _DECODE_CACHE = DecodeCache(max_bytes) if max_bytes else False
+    return _DECODE_CACHE or None
+
+
+def disable_decode_cache():
+    """
+    Disable the decode cache of this process, dropping what it holds. For the processes that decode every file once,
+    like the feature extraction workers: a cache of their own would only hold memory.
+    """
+    global _DECODE_CACHE
+    _DECODE_CACHE = False
 
 
 class Image:
@@ -26,20 +190,46 @@ class Image:
 
         Args:
             file_path (str): path to image file
-            divide (bool): whether to divide the image by 255 after loading
+            divide (bool): whether to divide the image by 255 after loading (see normalize)
             reshape (bool): whether to reshape the image to 1D array
 
         Attributes:
             path (str): path to image file
             divide (bool): whether to divide the image by 255 after loading
             reshape (bool): whether to reshape the image to 1D array
-            data (ndarray): image data
+            data (ndarray): image data, read-only when it comes from the decode cache
         """
         self.file_path = file_path
         self.divide = divide
         self.reshape = reshape
         self.data = self.__load_file(target_size)
 
+    @classmethod
+    def from_array(cls, file_path, data, divide=False, reshape=False):
+        """
+        Create an Image from already decoded and resized uint8 data, such as a slice of an ImageStack.
+
+        Args:
+            file_path (str): path to the image file the data comes from
+            data (ndarray): 2D uint8 image data, used without copying unless divide or reshape are set
+            divide (bool): whether to divide the image by 255
+            reshape (bool): whether to reshape the image to a (1, height, width, 1) array
+
+        Returns:
+            Image: the image
+        """
+        img = cls.__new__(cls)
+        img.file_path = file_path
+        img.divide = divide
+        img.reshape = reshape
+
+        if divide:
+            data = normalize(data)
+        if reshape:
+            data = np.reshape(data, (1,) + data.shape + (1,))
+        img.data = data
+        return img
+
     def __load_file(self, target_size):
         """
         Load image file, preprocess and return the data.
@@ -50,15 +240,17 @@ class Image:
         Returns:
             ndarray: preprocessed image data
         """
-        # load image in grayscale
-        img = cv2.imread(self.file_path, cv2.IMREAD_GRAYSCALE)
-
-        # divide image by 255
-        if self.divide:
-            img = img / 255
-
-        # resize image
-        img = cv2.resize(img, target_size)
+        cache = get_decode_cache()
+        if cache is None:
+            img = self.__decode(target_size)
+        else:
+            # The modification time and size make sure a rewritten file is not read from the cache
+            stat = os.stat(self.file_path)
+            key = (self.file_path, stat.st_mtime_ns, stat.st_size, tuple(target_size), self.divide)
+            img = cache.get(key)
+            if img is None:
+                img = self.__decode(target_size)
+                cache.put(key, img)
 
         # reshape image
         if self.reshape:
@@ -67,6 +259,24 @@ class Image:
 
         return img
 
+    def __decode(self, target_size):
+        """
+        Decode the image file and resize it.
+
+        Args:
+            target_size (tuple): target size to resize the image
+
+        Returns:
+            ndarray: decoded image data
+        """
+        img = decode_resized(self.file_path, target_size)
+
+        # divide image by 255
+        if self.divide:
+            img = normalize(img)
+
+        return img
+
     def get_filename(self):
         """
         Return filename.
@@ -76,16 +286,27 @@ class Image:
         """
         return os.path.splitext(os.path.basename(self.file_path))
 
-    def save_as_processed(self, out_path):
+    @staticmethod
+    def processed_filename(file_path):
+        """
+        Return the file name of the processed version of an image file, with 'processed' tag.
+        """
+        filename, fileext = os.path.splitext(os.path.basename(file_path))
+        return "%s_processed%s" % (filename, fileext)
+
+    def save_as_processed(self, out_path, writer=None):
         """
         Save the image to a file, with 'processed' tag.
 
         Args:
-            path_dir (str): directory to save the file
+            out_path (str): directory to save the file
+            writer (ImageWriter): writer to queue the file to, instead of writing it right away
         """
-        filename, fileext = self.get_filename()
-        result_file = abs_path(out_path, "%s_processed%s" % (filename, fileext))
-        cv2.imwrite(result_file, self.data)
+        result_file = abs_path(out_path, self.processed_filename(self.file_path))
+        if writer is not None:
+            writer.write(result_file, self.data)
+        else:
+            cv2.imwrite(result_file, self.data)
 
     def shape(self):
         """
@@ -132,68 +353,224 @@ class Image:
     def haralick(self):
         """
         Calculate and return the mean of Haralick texture features for 4 types of adjacency.
+
+        They are computed by the texture engine, or by mahotas, depending on "texture_engine" in the config (see
+        ImageTuple.radiomics_features).
+
         Returns:
             ndarray: Mean of the Haralick texture features.
         """
+        engine = load_config("texture_engine")
+        if engine != "library":
+            ht_mean = TextureMatrices(self.data).haralick()
+            if engine == "native":
+                return ht_mean
+
         # Calculate Haralick texture features for 4 types of adjacency
         textures = mt.features.haralick(self.data)
 
         # Take the mean of the Haralick texture features
-        ht_mean = np.mean(textures, axis=0)
+        library_mean = np.mean(textures, axis=0)
 
-        return ht_mean
+        if engine == "validate":
+            validate_features({"haralick_%d" % i: value for i, value in enumerate(ht_mean)},
+                              {"haralick_%d" % i: value for i, value in enumerate(library_mean)}, self.file_path)
+        return library_mean
 
     def mahotas_characteristics(self):
         # Extract the Mahotas characteristics from the image data
-        features = []
+        return list(self.mahotas_features().values())
+
+    def mahotas_features(self, families=MAHOTAS_FAMILIES):
+        """
+        Extract the Mahotas features of the given families, skipping the other ones.
+
+        The LBP and TAS features are computed by the numba kernels of the texture engine (see texture.lbp_image and
+        texture.tas_image), or by mahotas, depending on "texture_engine" in the config (see
+        ImageTuple.radiomics_features).
+
+        Args:
+            families (iterable): The Mahotas feature families (see feature_registry). Defaults to every one.
+
+        Returns:
+            dict: the features, by column name ("lbp_0", "zernike_0", "tas_0", ...)
+        """
+        features = {}
+        families = set(families)
+        engine = load_config("texture_engine")
 
         # LBP features
-        lbp = mt.features.lbp(self.data, 8, 8)
-        features.extend(lbp)
+        if LBP_FAMILY in families:
+            features.update(self.__texture_features(LBP_FAMILY, engine, lbp_image,
+                                                    lambda data: mt.features.lbp(data, 8, 8)))
 
         # Zernike moments
-        zernike = mt.features.zernike(self.data, 10, 10)
-        features.extend(zernike)
+        if ZERNIKE_FAMILY in families:
+            features.update(("%s_%d" % (ZERNIKE_FAMILY, i), value)
+                            for i, value in enumerate(mt.features.zernike(self.data, 10, 10)))
 
         # TAS features
-        tas = mt.features.tas(self.data)
-        features.extend(tas)
+        if TAS_FAMILY in families:
+            features.update(self.__texture_features(TAS_FAMILY, engine, tas_image, mt.features.tas))
 
         return features
 
+    def __texture_features(self, family, engine, native, library):
+        """
+        Compute the features of a family with the texture engine or with the library, or compare both (see
+        ImageTuple.radiomics_features).
+        """
+        if engine != "library":
+            features = {"%s_%d" % (family, i): value for i, value in enumerate(native(self.data))}
+            if engine == "native":
+                return features
+
+        library_features = {"%s_%d" % (family, i): value for i, value in enumerate(library(self.data))}
+        if engine == "validate":
+            validate_features(features, library_features, self.file_path)
+        return library_features
+
 
 class ImageTuple:
     """This is a class that represents an image and its corresponding mask image.
     The mask image also has an associated image object, which allows for
     convenient access to the mask image's properties."""
 
-    def __init__(self, image: Image, mask: Image):
+    def __init__(self, image: Image, mask: Image, check: bool = True):
         self.image = image
         self.mask = mask
-        self.check_consistency()
+        # The tuples paired by the DatasetIndex are consistent already
+        if check:
+            self.check_consistency()
+
+    @staticmethod
+    def mask_path(image_path: str, masks_dir_path: str) -> str:
+        """This method returns the path of the mask image of an image, in the given masks directory, as paired by the
+        DatasetIndex of the image directory (or the path it would have, when the mask is missing)."""
+        mask_img_path = DatasetIndex.load(os.path.dirname(image_path)).mask_path(image_path, masks_dir_path)
+        if mask_img_path is None:
+            # Loading it will fail with the expected path
+            mask_img_path = "%s/%s" % (masks_dir_path, mask_filename(image_path))
+        return mask_img_path
 
     @staticmethod
     def from_image(image: Image, masks_dir_path: str, target_size):
         """This method creates an ImageTuple from an image and a masks directory.
         The masks directory is used to find the corresponding mask image for the input image."""
-        img_filename = image.get_filename()
-        mask_img_filename = "%s_mask%s" % (img_filename[0], img_filename[1])
-        mask_img_path = "%s/%s" % (masks_dir_path, mask_img_filename)
-        mask_img_path = mask_img_path.replace("_processed", "")  # Just in case of loading processed images
+        mask_img_path = ImageTuple.mask_path(image.file_path, masks_dir_path)
         mask = Image(mask_img_path, False, False, target_size=target_size)
-        return ImageTuple(image, mask)
+        return ImageTuple(image, mask, check=False)
+
+    @staticmethod
+    def from_stacks(image_path: str, masks_dir_path: str, target_size):
+        """This method creates an ImageTuple from the image stacks of the image directory and of the masks directory,
+        without decoding any file."""
+        image = ImageStack.cached(os.path.dirname(image_path), target_size).image(image_path)
+        mask = ImageStack.cached(masks_dir_path, target_size).image(ImageTuple.mask_path(image_path, masks_dir_path))
+        return ImageTuple(image, mask, check=False)
+
+    def radiomics(self, profile: str = None):
+        # Extract the PyRadiomics features of the profile, in the order of their columns
+        return list(self.radiomics_features(profile=profile).values())
+
+    def radiomics_features(self, classes=RADIOMICS_CLASSES, profile: str = None):
+        """
+        Extract the PyRadiomics features of the given feature classes, with the parameters of a radiomics profile (see
+        feature_registry).
 
-    def radiomics(self):
-        # Convert numpy array to SimpleITK image
-        sitk_image = sitk.GetImageFromArray(np.expand_dims(self.image.data, axis=0))
-        sitk_mask = sitk.GetImageFromArray(np.expand_dims(self.mask.data, axis=0))
+        The texture classes (glcm, glrlm and glszm) are computed by the texture engine (see texture.TextureMatrices),
+        which builds their matrices once for the image and its mask, and the other classes by a PyRadiomics extractor
+        that only computes them. "texture_engine" in the config selects who computes the texture classes:
+        - "native": the texture engine
+        - "library": PyRadiomics
+        - "validate": both, printing the features the texture engine gets wrong, and keeping the PyRadiomics ones
 
-        # Create the feature extractor
-        extractor = featureextractor.RadiomicsFeatureExtractor()
+        The mask is binarized with the threshold of the profile. The columns come class by class, in the order of
+        RADIOMICS_CLASSES, and sorted by name within each class, so their layout doesn't depend on PyRadiomics.
 
-        # Run the feature extraction
+        Args:
+            classes (iterable): The PyRadiomics feature classes. Defaults to every class of the profile.
+            profile (str, optional): The name of the radiomics profile. Defaults to "radiomics_profile" in the config.
+
+        Returns:
+            dict: the features, by column name ("radiomics_glcm_Contrast", ...)
+        """
+        profile = radiomics_profile(profile)
+        params = profile["params"]
+        classes = [feature_class for feature_class in RADIOMICS_CLASSES
+                   if feature_class in set(classes) and feature_class in params["featureClass"]]
+        if not classes:
+            return {}
+
+        engine = load_config("texture_engine")
+        native_classes = [] if engine == "library" else \
+            [feature_class for feature_class in classes if feature_class in TEXTURE_CLASSES]
+        library_classes = classes if engine == "validate" else \
+            [feature_class for feature_class in classes if feature_class not in native_classes]
+
+        features = {}
+        if native_classes:
+            textures = TextureMatrices.from_profile(self.image.data, self.mask.data, profile)
+            features.update(textures.radiomics_features(native_classes))
+        if library_classes:
+            library_features = self.__library_radiomics(library_classes, profile)
+            if engine == "validate":
+                validate_features(features, {name: value for name, value in library_features.items()
+                                             if column_family(name)[len(RADIOMICS_PREFIX):] in native_classes},
+                                  self.image.file_path)
+            features.update(library_features)
+
+        # Order the columns
+        ordered = {}
+        for feature_class in classes:
+            prefix = "%s%s_" % (RADIOMICS_PREFIX, feature_class)
+            ordered.update((name, features[name]) for name in sorted(features) if name.startswith(prefix))
+        return ordered
+
+    def __library_radiomics(self, classes, profile: dict) -> dict:
+        """
+        Extract the PyRadiomics features of the given feature classes with PyRadiomics, by column name.
+        """
+        params = profile["params"]
+        # The 2D images are single slice volumes for SimpleITK, force2D keeps the features 2D. The image is given as
+        # float, PyRadiomics computes the bin edges in the image type, which overflows for uint8 images
+        sitk_image = sitk.GetImageFromArray(np.expand_dims(self.image.data, axis=0).astype(np.float64))
+        mask_data = (self.mask.data > profile["mask_threshold"]).astype(np.uint8)
+        sitk_mask = sitk.GetImageFromArray(np.expand_dims(mask_data, axis=0))
+
+        # Reuse the feature extractor of this process, for the classes requested
+        extractor = get_radiomics_extractor(dict(params, featureClass={feature_class: params["featureClass"][feature_class]
+                                                                       for feature_class in classes}))
         result = extractor.execute(imageFilepath=sitk_image, maskFilepath=sitk_mask)
-        return list(result.values())[36:]
+
+        # "original_glcm_Contrast" becomes "radiomics_glcm_Contrast"
+        return {RADIOMICS_PREFIX + key[len("original_"):]: float(value) for key, value in result.items()
+                if key.startswith("original_")}
+
+    def features(self, families=None, profiler: FamilyProfiler = None):
+        """
+        Extract the features of the given families, in the order of the columns of the characteristics.
+
+        Args:
+            families (iterable, optional): The feature families (see feature_registry). Defaults to None (every one).
+            profiler (FamilyProfiler, optional): The profiler to measure each family with. Each PyRadiomics class then
+                runs on its own, so its measure includes the setup of a PyRadiomics extraction. Defaults to None.
+
+        Returns:
+            dict: the features, by column name
+        """
+        families = sort_families(families or FEATURE_FAMILIES)
+        if profiler is not None:
+            features = {}
+            for family in families:
+                with profiler.measure(family):
+                    features.update(self.features([family]))
+            return features
+
+        features = self.image.mahotas_features([family for family in families if family in MAHOTAS_FAMILIES])
+        features.update(self.radiomics_features(
+            [family[len(RADIOMICS_PREFIX):] for family in families if family.startswith(RADIOMICS_PREFIX)]))
+        return features
 
     def check_consistency(self):
         # Get the filenames of the image and the mask
@@ -211,12 +588,224 @@ class ImageTuple:
                 f"The mask {mask_filename}.{mask_extension} is not valid for {image_filename}.{image_extension}!")
 
 
+class ImageStack:
+    """
+    A contiguous, memory-mapped uint8 stack of the images of a folder at a given size, with the names of their files.
+
+    The stack is stored next to the folder (see `stack_path`) and is rebuilt when the files of the folder change,
+    decoding only the new and changed files, so each image of a dataset version is decoded once and then read by every
+    stage without decoding or copying.
+
+    Attributes:
+        folder (str): The folder of the images.
+        target_size (tuple): The size of the images in the stack.
+        data (ndarray): Memory-mapped uint8 array of shape (N, height, width), opened read-only.
+        files (list[str]): The file names of the images, in the order of the stack.
+    """
+
+    DATA_FILE = "images.npy"
+    FILES_FILE = "files.json"
+
+    # Bump it whenever the decoding of the images changes, so every stack is built again
+    DECODE_VERSION = 2
+
+    # Stacks opened by this process, with the DatasetIndex of their folder, by (folder, target size)
+    __opened = {}
+
+    def __init__(self, folder, target_size, data, files):
+        self.folder = folder
+        self.target_size = tuple(target_size)
+        self.data = data
+        self.files = files
+        self.__indexes = {filename: i for i, filename in enumerate(files)}
+
+    @staticmethod
+    def stack_path(folder, target_size):
+        """
+        Return the folder of the stack of a folder, at the given size.
+        """
+        return "%s_stack_%dx%d" % (folder.rstrip("/\\"), target_size[0], target_size[1])
+
+    @staticmethod
+    def __signature(folder):
+        """
+        Return the name, size and modification time of every image file of a folder, sorted by name, from the
+        DatasetIndex of the folder.
+        """
+        entries = DatasetIndex.load(folder).entries
+        return [[name, int(size), int(mtime)] for name, size, mtime in zip(entries["name"].tolist(), entries["size"],
+                                                                           entries["mtime"])]
+
+    @classmethod
+    def __stored_signature(cls, stack_path):
+        """
+        Return the signature of the files of the stack stored at a path, or None if there is no such stack or it was
+        decoded with other settings.
+        """
+        try:
+            with open(abs_path(stack_path, cls.FILES_FILE)) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(stored, dict) or stored.get("decode") != cls.__decode_config():
+            return None
+        return stored["files"]
+
+    @classmethod
+    def __decode_config(cls):
+        """
+        Describe how the images of a stack are decoded.
+        """
+        return {"version": cls.DECODE_VERSION, "reduced_decode": load_config("reduced_decode")}
+
+    @classmethod
+    def open(cls, folder, target_size):
+        """
+        Open the stack of a folder.
+
+        Args:
+            folder (str): The folder of the images.
+            target_size (tuple): The size of the images.
+
+        Returns:
+            ImageStack: the stack, or None if it doesn't exist or the files of the folder changed since it was built
+        """
+        stack_path = cls.stack_path(folder, target_size)
+        signature = cls.__stored_signature(stack_path)
+        if signature is None or signature != cls.__signature(folder):
+            return None
+
+        data = np.load(abs_path(stack_path, cls.DATA_FILE), mmap_mode='r')
+        return cls(folder, target_size, data, [filename for filename, _, _ in signature])
+
+    @classmethod
+    def __previous_rows(cls, stack_path, shape):
+        """
+        Return the row of each (name, size, modification time) in the stack stored at a path, and its data.
+
+        Returns:
+            tuple: (dict, ndarray), or ({}, None) if there is no such stack, it was decoded with other settings or its
+            images don't have the given shape
+        """
+        signature = cls.__stored_signature(stack_path)
+        if signature is None:
+            return {}, None
+        try:
+            data = np.load(abs_path(stack_path, cls.DATA_FILE), mmap_mode='r')
+        except (OSError, ValueError):
+            return {}, None
+
+        if data.shape != (len(signature),) + tuple(shape):
+            return {}, None
+        return {tuple(entry): i for i, entry in enumerate(signature)}, data
+
+    @classmethod
+    def build(cls, folder, target_size, num_threads=None):
+        """
+        Build a new stack of the images of a folder, replacing the previous one.
+
+        The rows of the previous stack whose file has the same name, size and modification time are copied over, only
+        the new and changed files are decoded.
+
+        Args:
+            folder (str): The folder of the images.
+            target_size (tuple): The size of the images.
+            num_threads (int, optional): The number of decoding threads. Defaults to the number of CPUs.
+
+        Returns:
+            ImageStack: the stack
+        """
+        signature = cls.__signature(folder)
+        stack_path = cls.stack_path(folder, target_size)
+        tmp_path = stack_path + ".tmp"
+        check_folder(tmp_path)
+
+        width, height = target_size
+        data = np.lib.format.open_memmap(abs_path(tmp_path, cls.DATA_FILE), mode='w+', dtype=np.uint8,
+                                         shape=(len(signature), height, width))
+
+        previous_rows, previous_data = cls.__previous_rows(stack_path, (height, width))
+        to_decode = []
+        for i, entry in enumerate(signature):
+            row = previous_rows.get(tuple(entry))
+            if row is None:
+                to_decode.append(i)
+            else:
+                data[i] = previous_data[row]
+        # The previous stack is replaced below
+        del previous_data
+
+        def decode(i):
+            # The stack replaces the decoded images, so they are not kept in the decode cache
+            data[i] = decode_resized(abs_path(folder, signature[i][0]), target_size)
+
+        # cv2 releases the GIL while decoding
+        with ThreadPoolExecutor(num_threads or os.cpu_count()) as executor:
+            list(tqdm.tqdm(executor.map(decode, to_decode), total=len(to_decode),
+                           desc=f"Building image stack of {folder}"))
+        data.flush()
+        del data
+
+        with open(abs_path(tmp_path, cls.FILES_FILE), 'w') as f:
+            json.dump({"decode": cls.__decode_config(), "files": signature}, f)
+
+        # Replace the previous stack only once the new one is complete
+        if os.path.exists(stack_path):
+            rmtree(stack_path)
+        os.replace(tmp_path, stack_path)
+
+        return cls.open(folder, target_size)
+
+    @classmethod
+    def load(cls, folder, target_size):
+        """
+        Open the stack of a folder, building it first if it doesn't exist or is outdated.
+        """
+        return cls.open(folder, target_size) or cls.build(folder, target_size)
+
+    @classmethod
+    def cached(cls, folder, target_size):
+        """
+        Return the stack of a folder, loading it only once per process, and again once the DatasetIndex of the folder
+        was updated.
+        """
+        key = (folder, tuple(target_size))
+        index = DatasetIndex.load(folder)
+        opened = cls.__opened.get(key)
+        if opened is None or opened[0] is not index:
+            opened = cls.__opened[key] = (index, cls.load(folder, target_size))
+        return opened[1]
+
+    def __len__(self):
+        return len(self.files)
+
+    def paths(self):
+        """
+        Return the paths of the image files, in the order of the stack.
+        """
+        return [abs_path(self.folder, filename) for filename in self.files]
+
+    def index(self, file_path):
+        """
+        Return the position of an image file in the stack.
+        """
+        return self.__indexes[os.path.basename(file_path)]
+
+    def image(self, file_path, divide=False, reshape=False):
+        """
+        Return an Image of the stack, whose data is a view of the memory-mapped stack.
+        """
+        return Image.from_array(abs_path(self.folder, os.path.basename(file_path)),
+                                self.data[self.index(file_path)], divide, reshape)
+
+
 class ImageLoader:
     """
     A class for generating and preprocessing image data for COVID-19 detection.
     """
 
-    def load_from(self, path: str, target_size, divide: bool = False, reshape: bool = False, only_data: bool = False, yield_len=False):
+    def load_from(self, path: str, target_size, divide: bool = False, reshape: bool = False, only_data: bool = False, yield_len=False, use_stack: bool = None):
         """
         Generates an Image object from a given path.
 
@@ -230,6 +819,9 @@ class ImageLoader:
             Optional. Default is False. Whether to reshape the image into a specified shape.
         only_data : bool
             Optional. Default is False. Whether to return only the data of the image or the entire Image object.
+        use_stack : bool
+            Optional. Defaults to "use_image_stacks" in the config. Whether to read the images from the ImageStack of
+            the folder instead of decoding every file.
 
         Returns:
         -------
@@ -237,7 +829,21 @@ class ImageLoader:
             If only_data is True, returns the data of the image. Otherwise, returns the entire Image object.
 
         """
-        image_files = glob(path + "/*g")
+        if use_stack is None:
+            use_stack = load_config("use_image_stacks")
+
+        if use_stack:
+            stack = ImageStack.cached(path, target_size)
+
+            if yield_len:
+                yield len(stack)
+
+            for image_file in stack.files:
+                img = stack.image(image_file, divide, reshape)
+                yield img.data if only_data else img
+            return
+
+        image_files = DatasetIndex.load(path).paths()
 
         if yield_len:
             yield len(image_files)
@@ -261,263 +867,404 @@ class ImageSaver:
 
     def save_to(self, path_dir):
         """
-        Save all Image objects in the ImageSaver object to the given directory.
+        Save all Image objects in the ImageSaver object to the given directory, encoding them in a pool of threads.
 
         Args:
             path_dir (str): The directory to save the images in.
         """
-        for img in self.images:
-            img.save_as_processed(path_dir)
+        with ImageWriter() as writer:
+            for img in self.images:
+                img.save_as_processed(path_dir, writer)
+
+
+# CLAHE objects are not thread-safe, so each thread gets its own
+_THREAD_LOCAL = threading.local()
+
+
+def _clahe():
+    """
+    Return the CLAHE object of the calling thread, creating it on first use.
+    """
+    clahe = getattr(_THREAD_LOCAL, "clahe", None)
+    if clahe is None:
+        clahe = _THREAD_LOCAL.clahe = cv2.createCLAHE()
+    return clahe
 
 
 class ImageProcessor:
-    def __init__(self, base_path: str, masks_path: str, target_size, divide: bool = False, reshape: bool = False, only_data: bool = False):
+    def __init__(self, base_path: str, masks_path: str, target_size, divide: bool = False, reshape: bool = False, only_data: bool = False, files: list = None):
+        """
+        Initializes an ImageProcessor object. The images and masks are only decoded when they are processed, one at a
+        time.
+
+        Args:
+            base_path (str): The folder of the images.
+            masks_path (str): The folder of the masks.
+            target_size (tuple): The size the images and masks are resized to.
+            files (list, optional): The paths of the images of the folder to process. Defaults to None (every image).
+        """
         self.base_path = base_path
         self.masks_path = masks_path
+        self.target_size = target_size
+        self.divide = divide
+        self.reshape = reshape
+        self.only_data = only_data
+        self.files = files
+        self.num_threads = load_config("processing_threads") or os.cpu_count()
+        self.use_stacks = load_config("use_image_stacks")
 
-        print("Loading images...")
-        # Load images:
-        image_loader = ImageLoader().load_from(self.base_path, target_size, divide, reshape, only_data)
-        self.tuples = list(map(lambda img: ImageTuple.from_image(
-            img, self.masks_path, target_size=target_size), image_loader))
-        print("Images loaded.")
+    def tuples(self):
+        """
+        Generate the (image, mask) tuples of the folder, decoding each one only when it is requested (or reading it
+        from the image stacks of the folders, when they are used).
+
+        Yields:
+            ImageTuple: the next image and its mask
+        """
+        if self.use_stacks:
+            image_paths = ImageStack.cached(self.base_path, self.target_size).paths()
+            if self.files is not None:
+                filenames = {os.path.basename(file) for file in self.files}
+                image_paths = [path for path in image_paths if os.path.basename(path) in filenames]
+            for image_path in image_paths:
+                yield ImageTuple.from_stacks(image_path, self.masks_path, self.target_size)
+            return
+
+        if self.files is not None:
+            image_loader = (Image(file, self.divide, self.reshape, target_size=self.target_size) for file in self.files)
+        else:
+            image_loader = ImageLoader().load_from(self.base_path, self.target_size, self.divide, self.reshape,
+                                                   self.only_data, use_stack=False)
+        for img in image_loader:
+            yield ImageTuple.from_image(img, self.masks_path, target_size=self.target_size)
 
     @staticmethod
     @njit(parallel=True)
     def __apply_mask(img_data, mask_data):
         """
-        Apply mask to an image.
+        Apply the masks to a stack of images, in place.
 
         Args:
-        - img (ndarray): 2D array of shape (256, 256)
-        - mask (ndarray): 2D array of shape (256, 256)
+        - img_data (ndarray): 3D uint8 array of shape (N, height, width), modified in place
+        - mask_data (ndarray): 3D array of shape (N, height, width)
+        """
+        num_images, height, width = img_data.shape
+        # A single parallel loop over the rows of every image of the batch
+        for k in prange(num_images * height):
+            n = k // height
+            i = k % height
+            for j in range(width):
+                if mask_data[n, i, j] <= 20:
+                    img_data[n, i, j] = 0
+
+    def process_batch(self, img_data, mask_data, in_place: bool = False, executor=None):
+        """
+        Apply CLAHE and the masks to a stack of images.
 
-        Returns:
-        - modified_img (ndarray): modified 2D array of shape (256, 256)
-        """
-        modified_img_data = np.copy(img_data)
-        for i in prange(img_data.shape[0]):
-            for j in prange(img_data.shape[1]):
-                if mask_data[i, j] <= 20:
-                    modified_img_data[i, j] = 0
-        return modified_img_data
-
-    def __process_image(self, img, mask):
-        clahe = cv2.createCLAHE()
-        eq_img_data = clahe.apply(img.data)
-        processed_image_data = self.__apply_mask(eq_img_data, mask.data)
-        img.data = processed_image_data
-        # Return the Image object with the new processed data
-        return img
+        CLAHE runs in a pool of threads (OpenCV releases the GIL), each one with its own CLAHE object, and the masks
+        are then applied to the whole stack by a single parallel kernel.
 
-    def process(self):
-        return list(map(lambda tuple: self.__process_image(tuple.image, tuple.mask), self.tuples))
+        Args:
+        - img_data (ndarray): 3D uint8 array of shape (N, height, width)
+        - mask_data (ndarray): 3D array of shape (N, height, width)
+        - in_place (bool): whether to write the result over img_data instead of a new array
+        - executor (ThreadPoolExecutor): the thread pool to use. Defaults to a new one for this batch.
 
+        Returns:
+        - processed_data (ndarray): 3D uint8 array of shape (N, height, width)
+        """
+        processed_data = img_data if in_place else np.empty_like(img_data)
 
-class LungMaskGenerator:
-    """
-    Class for segmenting lung images using the U-Net model.
+        def equalize(n):
+            processed_data[n] = _clahe().apply(img_data[n])
 
-    This code is based on the work presented in:
-    https://www.kaggle.com/eduardomineo/u-net-lung-segmentation-montgomery-shenzhen/execution#4.-Results
-    """
+        if executor is None:
+            with ThreadPoolExecutor(self.num_threads) as batch_executor:
+                list(batch_executor.map(equalize, range(len(img_data))))
+        else:
+            list(executor.map(equalize, range(len(img_data))))
 
-    def __init__(self, input_size=(256, 256, 1),
-                 target_size=(256, 256),
-                 folder_in='',
-                 folder_out=''):
-        """
-        Initializes an LungMaskGenerator object.
+        self.__apply_mask(processed_data, mask_data)
+        return processed_data
 
-        Args:
-        - input_size: a tuple representing the input shape of the U-Net model.
-        - target_size: a tuple representing the target shape of the input images.
-        - folder_in: a string representing the path to the input folder containing the lung images.
-        - folder_out: a string representing the path to the output folder where the masks will be saved.
+    def __batches(self, batch_size):
         """
-        self.input_size = input_size
-        self.target_size = target_size
-        self.folder_in = folder_in
-        self.folder_out = folder_out
-
-    def __load_image(self, img_file):
+        Generate lists of at most `batch_size` (image, mask) tuples.
         """
-        Loads and processes an image file.
+        batch = []
+        for img_tuple in self.tuples():
+            batch.append(img_tuple)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def process_tuples(self, batch_size: int = None):
+        """
+        Generate the processed images along with their masks, decoding and processing them one batch at a time, so
+        only the current batch is held in memory.
 
         Args:
-        - test_file: a string representing the path to the image file.
+            batch_size (int, optional): The number of images processed at once. Defaults to "processing_batch_size"
+                in the config.
 
-        Returns:
-        - A numpy array representing the preprocessed image.
+        Yields:
+            ImageTuple: the next processed image and its mask
         """
-        img = cv2.imread(img_file, cv2.IMREAD_GRAYSCALE)
-        img = img / 255
-        img = cv2.resize(img, self.target_size)
-        img = np.reshape(img, img.shape + (1,))
-        img = np.reshape(img, (1,) + img.shape)
-        return img
-
-    def __load_images(self, img_files):
+        batch_size = batch_size or load_config("processing_batch_size")
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            for batch in self.__batches(batch_size):
+                img_data = np.stack([img_tuple.image.data for img_tuple in batch])
+                mask_data = np.stack([img_tuple.mask.data for img_tuple in batch])
+                processed_data = self.process_batch(img_data, mask_data, in_place=True, executor=executor)
+                for img_tuple, data in zip(batch, processed_data):
+                    # Update the Image object with the new processed data
+                    img_tuple.image.data = data
+                    yield img_tuple
+
+    def process_stream(self, batch_size: int = None):
         """
-        Generator function that yields preprocessed image arrays.
-
-        Args:
-        - test_files: a list of strings representing the paths to the image files.
+        Generate the processed images, decoding and processing them one batch at a time (see process_tuples).
 
         Yields:
-        - A numpy array representing the preprocessed image.
+            Image: the next processed image
         """
-        for img_file in img_files:
-            yield self.__load_image(img_file)
+        for img_tuple in self.process_tuples(batch_size):
+            yield img_tuple.image
+
+    def process(self):
+        return list(self.process_stream())
 
-    def __save_result(self, save_path, npyfile, test_files):
+    def save_to(self, path_dir, max_in_flight: int = None, statistics: HistogramStatistics = None):
         """
-        Saves the segmented images to disk.
+        Decode, process and save every image of the folder in a single pass.
+
+        The processed images are queued to an ImageWriter, which blocks once `max_in_flight` images are waiting to be
+        written, so the memory used doesn't grow with the number of images.
 
         Args:
-        - save_path: a string representing the path to the output folder.
-        - npyfile: a numpy array representing the segmented images.
-        - test_files: a list of strings representing the paths to the input image files.
+            path_dir (str): The directory to save the processed images in.
+            max_in_flight (int, optional): The maximum number of processed images waiting to be written. Defaults to
+                "processing_max_in_flight" in the config.
+            statistics (HistogramStatistics, optional): Statistics the histograms of the processed images are added to.
         """
-        for i, item in enumerate(npyfile):
-            result_file = test_files[i]
-            img = (item[:, :, 0] * 255.).astype(np.uint8)
-
-            filename, fileext = os.path.splitext(os.path.basename(result_file))
+        with ImageWriter(queue_size=max_in_flight or load_config("processing_max_in_flight")) as writer:
+            for img in self.process_stream():
+                if statistics is not None:
+                    statistics.add(img.hist())
+                img.save_as_processed(path_dir, writer)
 
-            result_file = os.path.join(save_path, "%s_mask%s" % (filename, fileext))
 
-            cv2.imwrite(result_file, img)
+class ImageCharacteristics:
+    def __init__(self, cov_images_artifact, normal_images_artifact, target_size, families=None):
+        """
+        Initializes an ImageCharacteristics object with the cov and non-cov images found in the given folders.
 
-    def generate(self):
+        Args:
+        - cov_images_artifact (str): The path to the folder with the processed cov images.
+        - normal_images_artifact (str): The path to the folder with the processed non-cov images.
+        - target_size (tuple): The size the images are resized to before the extraction.
+        - families (iterable): The feature families to extract (see feature_registry), for instance those of a
+          FeatureSelection. Defaults to None (every family).
         """
-        This method loads the saved model from disk, generates image predictions for the images in the specified input folder, and saves the segmented images to the specified output folder.
+        self.target_size = target_size
+        self.families = sort_families(families or FEATURE_FAMILIES)
+        # Per feature family measures of the last save(), when "feature_profiling" is set
+        self.profile = None
+        # Sorted by the DatasetIndex, so the rows of the output file always come in the same order. Every file is
+        # checked, so the stacks and the workers never read the stale entries of a file overwritten in place
+        self.cov_images = DatasetIndex.verify(cov_images_artifact).paths()
+        self.cov_lenght = len(self.cov_images)
+        self.normal_images = DatasetIndex.verify(normal_images_artifact).paths()
+        self.normal_lenght = len(self.normal_images)
+        # Histogram statistics of the images, filled as a side output of save()
+        self.cov_statistics = HistogramStatistics()
+        self.normal_statistics = HistogramStatistics()
+
+    def __tasks(self, cov_masks_path, normal_masks_path):
+        """
+        Generate the extraction tasks: the normal images first (label 0), then the cov images (label 1).
+        """
+        for img_path in self.normal_images:
+            yield (img_path, normal_masks_path, self.target_size, 0)
+        for img_path in self.cov_images:
+            yield (img_path, cov_masks_path, self.target_size, 1)
 
-        :return: None
+    def save(self, file_path, cov_masks_path, normal_masks_path, characteristics_format="csv"):
         """
-        # Load saved model from disk
-        model = model(input_size=self.input_size)
-        model.load_weights('segmentation_model.hdf5')
+        Computes the texture and radiomics features for each image in a pool of worker processes and saves them to a
+        csv file or an npy folder, in the same order as the images are listed.
 
-        # Get list of image files from input folder
-        files = glob(self.folder_in + "/*g")
+        The number of workers, the chunk size and the per-image timeout are read from the configuration file.
+        Images that fail or time out are reported and left out of the file. When "feature_cache_path" is set, the
+        features of images already seen with the same mask, size and configuration are read from the feature cache
+        instead of being computed again. The histogram statistics of the cov and non-cov images are gathered along the
+        way, in cov_statistics and normal_statistics.
 
-        # Generate predictions for images in input folder
-        gen = self.__load_images(files)  # TODO: check if this should be changed for the global loader
-        results = model.predict_generator(gen, len(files), verbose=1)
+        Args:
+        - file_path (str): The path to the file (or folder, for the npy format) where the data will be saved.
+        - cov_masks_path (str): The path to the folder with the cov masks.
+        - normal_masks_path (str): The path to the folder with the non-cov masks.
+        - characteristics_format (str): "csv" or "npy", see characteristics_store.
+        """
+        # The worker functions live in their own module, which imports this one
+        from feature_worker import extract_features
 
-        # Save segmented images to output folder
-        self.__save_result(self.folder_out, results, files)
+        self.__verify_masks(cov_masks_path, normal_masks_path)
 
+        # Pair the masks before the workers start, so they only read the indexes
+        for images, masks_path in ((self.normal_images, normal_masks_path), (self.cov_images, cov_masks_path)):
+            if images:
+                DatasetIndex.load(os.path.dirname(images[0])).pair_masks(masks_path)
 
-class ImageCharacteristics:
-    def __init__(self, cov_images_artifact, normal_images_artifact, target_size):
-        # TODO: Fix docstrings
-        """
-        Initializes an ImageCharacteristics object with a list of cov and non-cov images.
+        use_stacks = load_config("use_image_stacks")
+        if use_stacks:
+            # Build the stacks before the workers start, so they only have to open them
+            self.__build_stacks(cov_masks_path, normal_masks_path)
 
-        Args:
-        - cov_images (list): A list of Image objects representing the cov images.
-        - normal_images (list): A list of Image objects representing the non-cov images.
-        """
-        loader = ImageLoader()
-        self.cov_images = loader.load_from(cov_images_artifact,
-                                           target_size,
-                                           False, False, False, yield_len=True)
-        self.cov_lenght = self.cov_images.__next__()
-        self.normal_images = loader.load_from(normal_images_artifact,
-                                              target_size,
-                                              False, False, False, yield_len=True)
-        self.normal_lenght = self.normal_images.__next__()
+        self.__save(file_path, characteristics_format, extract_features,
+                    self.__tasks(cov_masks_path, normal_masks_path), use_stacks)
 
-    def __extract_from_image(self, img: Image, label, mask_path):
-        img_tuple = ImageTuple.from_image(img, mask_path, img.shape())
-        yield from img.mahotas_characteristics()
-        yield from img_tuple.radiomics()
-        yield label
-
-    def save(self, file_path, cov_masks_path, normal_masks_path):
+    def save_fused(self, file_path, cov_masks_path, normal_masks_path, characteristics_format="csv",
+                   cov_processed_path=None, normal_processed_path=None):
         """
-        Computes the histogram and texture features for each image and saves them to a csv file.
+        Processes the raw images the object was created with (see ImageProcessor) and computes their features, in a
+        single pass: each image stays in memory from its decoding to its features, and the processed images are only
+        written to disk when their folders are given.
+
+        The processing of the next images in this process overlaps with the feature extraction of the previous ones in
+        the worker pool. The features are computed from the processed arrays themselves: for lossless formats (PNG)
+        they are those `save` gets from the saved processed images, but for lossy ones (JPEG) `save` reads the images
+        back after their lossy encoding, so its features and feature cache keys differ from these.
 
         Args:
-        - file_path (str): The path to the file where the data will be saved.
+        - file_path (str): The path to the file (or folder, for the npy format) where the data will be saved.
+        - cov_masks_path (str): The path to the folder with the cov masks.
+        - normal_masks_path (str): The path to the folder with the non-cov masks.
+        - characteristics_format (str): "csv" or "npy", see characteristics_store.
+        - cov_processed_path (str): The folder to save the processed cov images in. Defaults to None (not saved).
+        - normal_processed_path (str): The folder to save the processed non-cov images in. Defaults to None.
         """
-        logger = logging.getLogger("radiomics")
-        logger.setLevel(logging.ERROR)
-        # Define the number of worker processes to use
-        num_workers = 24
+        from feature_worker import extract_array_features
 
-        # Create a pool of worker processes
-        pool = mp.Pool(num_workers)
+        self.__verify_masks(cov_masks_path, normal_masks_path)
 
-        try:
-            # Open the output file for writing
-            with open(file_path, 'w') as f:
-                writer = csv.writer(f)
-
-                # Extract features from the normal images in parallel
-                normal_progress = tqdm.tqdm(total=self.normal_lenght, desc='Extracting features from normal images')
-                for img in self.normal_images:
-                    features = self.__extract_from_image(img, 0, normal_masks_path)
-                    writer.writerow(features)
-                    normal_progress.update(1)
-
-                # Extract features from the cov images in parallel
-                cov_progress = tqdm.tqdm(total=self.cov_lenght, desc='Extracting features from cov images')
-                for img in self.cov_images:
-                    features = self.__extract_from_image(img, 1, cov_masks_path)
-                    writer.writerow(features)
-                    cov_progress.update(1)
-
-        finally:
-            # Close the worker processes
-            pool.close()
-            pool.join()
+        if load_config("use_image_stacks"):
+            self.__build_stacks(cov_masks_path, normal_masks_path)
 
+        with ImageWriter() as writer:
+            def tasks():
+                for images, masks_path, processed_path, label in (
+                        (self.normal_images, normal_masks_path, normal_processed_path, 0),
+                        (self.cov_images, cov_masks_path, cov_processed_path, 1)):
+                    if not images:
+                        continue
+                    processor = ImageProcessor(os.path.dirname(images[0]), masks_path, self.target_size, files=images)
+                    for img_tuple in processor.process_tuples():
+                        if processed_path is not None:
+                            img_tuple.image.save_as_processed(processed_path, writer)
+                        yield (img_tuple.image.file_path, img_tuple.mask.file_path, img_tuple.image.data,
+                               img_tuple.mask.data, self.target_size, label)
 
-class ImageDataHistogram:
+            self.__save(file_path, characteristics_format, extract_array_features, tasks(), False)
 
     @staticmethod
-    def __hist_mean(images):
+    def __verify_masks(cov_masks_path, normal_masks_path):
+        """
+        Check every file of the masks folders against their DatasetIndex (see DatasetIndex.verify), before their
+        stacks are opened and the workers load their indexes.
+        """
+        for masks_path in {cov_masks_path, normal_masks_path}:
+            DatasetIndex.verify(masks_path)
+
+    def __build_stacks(self, cov_masks_path, normal_masks_path):
+        """
+        Build the image stacks of the images and of the masks, if they don't exist or are outdated.
         """
-        This function takes a list of images as an argument and returns the mean of the histograms of each image.
-        It first creates a list of histograms for each image using the img.hist() method, then calculates the mean of all
-        the histograms using the np.mean() method with axis=0 indicating that the mean should be calculated along the columns.
-        Finally, it returns the mean value.
+        for masks_path in {cov_masks_path, normal_masks_path}:
+            ImageStack.load(masks_path, self.target_size)
+        for images in (self.cov_images, self.normal_images):
+            if images:
+                ImageStack.load(os.path.dirname(images[0]), self.target_size)
+
+    def __save(self, file_path, characteristics_format, extract, tasks, use_stacks):
+        """
+        Run the extraction tasks in the worker pool and write the features of each image, in the order of the tasks
+        (see save). The last item of each task is the label of its image.
         """
-        histograms = [img.hist() for img in images]
-        hist_mean = np.mean(histograms, axis=0)
-        return hist_mean
+        from feature_worker import init_feature_worker
+
+        cache_path = load_config("feature_cache_path")
+        cache_max_bytes = load_config("feature_cache_max_bytes")
+        cache = FeatureCache(cache_path, cache_max_bytes) if cache_path else None
+        profiling = load_config("feature_profiling")
+        self.profile = FeatureProfile() if profiling else None
+
+        pool = ChunkedWorkerPool(num_workers=load_config("feature_extraction_workers"),
+                                 chunksize=load_config("feature_extraction_chunksize"),
+                                 task_timeout=load_config("feature_extraction_timeout"),
+                                 initializer=init_feature_worker,
+                                 initargs=(cache_path, cache_max_bytes, use_stacks, self.families, profiling))
+        failed = []
+        cache_hits = 0
+
+        # Open the output file for writing
+        num_images = self.normal_lenght + self.cov_lenght
+        with characteristics_writer(file_path, characteristics_format, num_images,
+                                    feature_columns(self.families)) as writer:
+            progress = tqdm.tqdm(total=num_images, desc='Extracting features')
+            for task, succeeded, result in pool.map(extract, tasks):
+                label = task[-1]
+                if succeeded:
+                    key, features, cached, hist, measures = result
+                    if measures is not None:
+                        self.profile.add(measures)
+                    statistics = self.cov_statistics if label == 1 else self.normal_statistics
+                    statistics.add(hist)
+                    if cached:
+                        cache_hits += 1
+                    elif cache is not None:
+                        cache.put(key, features)
+                    # The label is not part of the cached features
+                    writer.write(features, label)
+                else:
+                    failed.append(task[0])
+                    print(f"Feature extraction failed for {task[0]}: {result}")
+                progress.update(1)
+            progress.close()
+
+        if cache is not None:
+            print(f"{cache_hits} of {num_images} images were read from the feature cache")
+        if failed:
+            print(f"{len(failed)} images were left out of {file_path}")
+        if self.profile is not None and len(self.profile):
+            self.profile.report()
+            self.profile.save(abs_path(load_config("feature_profile_path")))
+
+
+class ImageDataHistogram:
 
     @staticmethod
-    def hist_mean(path, img_target_size):
+    def statistics(path, img_target_size):
         """
-        This function takes in a path and returns the mean of the histogram of the image at that path.
-        It generates an image using the ImageGenerator class and calls ImageDataHistogram's __hist_mean() method to calculate
-        the mean of the histogram.
+        This function computes the histogram statistics (see HistogramStatistics) of the images at the given path, in a
+        single pass and in constant memory.
         """
-        return ImageDataHistogram.__hist_mean(ImageLoader().load_from(
+        return HistogramStatistics.from_images(ImageLoader().load_from(
             abs_path(path), target_size=img_target_size))
 
     @staticmethod
-    def __hist_median(images):
+    def hist_mean(path, img_target_size):
         """
-        This function takes in a list of images (images) and returns the median of the histograms of each image (hist_median).
-        It uses a list comprehension to create a list of the histograms for each image (histograms), then uses NumPy's median()
-        function to calculate the median of those histograms, with axis=0 indicating that the median should be calculated along
-        the first axis. The result is returned as hist_median.
+        This function takes in a path and returns the mean of the histograms of the images at that path.
         """
-        histograms = [img.hist() for img in images]
-        hist_median = np.median(histograms, axis=0)
-        return hist_median
+        return ImageDataHistogram.statistics(path, img_target_size).mean()
 
     @staticmethod
     def hist_median(path, img_target_size):
         """
-        This function takes in a path to an image and returns the median of its histogram.
-        It generates an image using the ImageGenerator class and calls the __hist_median() method of the ImageDataHistogram class
-        to get the median of its histogram.
+        This function takes in a path and returns the median of the histograms of the images at that path, within the
+        relative accuracy of HistogramStatistics.
         """
-        return ImageDataHistogram.__hist_median(ImageLoader().load_from(
-            abs_path(path), target_size=img_target_size))
+        return ImageDataHistogram.statistics(path, img_target_size).median()
@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+
+import cv2
+
+from utils import load_config
+
+
+class ImageWriter:
+    """
+    Writes images to disk with a pool of threads, so the encoding overlaps with whatever the caller does next.
+
+    OpenCV releases the GIL while encoding, so the threads encode in parallel. The queue of pending images is bounded:
+    `write` blocks when the threads fall behind, which keeps the memory used by the pending images bounded too.
+
+    Use it as a context manager, or call `close` when done: errors raised by the threads are raised again by `flush`
+    and `close`.
+
+    Attributes:
+        count (int): The number of images written.
+        bytes (int): The number of (uncompressed) bytes of the images written.
+    """
+
+    def __init__(self, num_threads: int = None, queue_size: int = None):
+        """
+        Initializes an ImageWriter object and starts its threads.
+
+        Args:
+            num_threads (int, optional): The number of writer threads. Defaults to "image_writer_threads" in the config.
+            queue_size (int, optional): The maximum number of pending images. Defaults to "image_writer_queue_size" in
+                the config.
+        """
+        self.num_threads = num_threads or load_config("image_writer_threads")
+        self.count = 0
+        self.bytes = 0
+        self.__queue = queue.Queue(queue_size or load_config("image_writer_queue_size"))
+        self.__errors = []
+        self.__lock = threading.Lock()
+        self.__start_time = time.perf_counter()
+        self.__threads = [threading.Thread(target=self.__work, daemon=True) for _ in range(self.num_threads)]
+        for thread in self.__threads:
+            thread.start()
+
+    def __work(self):
+        """
+        Write the queued images until a None sentinel is received.
+        """
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is None:
+                    return
+                path, data = item
+                if not cv2.imwrite(path, data):
+                    raise IOError(f"Could not write {path}")
+                with self.__lock:
+                    self.count += 1
+                    self.bytes += data.nbytes
+            except Exception as e:
+                with self.__lock:
+                    self.__errors.append(e)
+            finally:
+                self.__queue.task_done()
+
+    def write(self, path: str, data):
+        """
+        Queue an image to be written. The image data must not be modified afterwards.
+
+        Args:
+            path (str): The path of the file, its extension sets the encoding.
+            data (ndarray): The image data.
+        """
+        self.__raise_errors()
+        self.__queue.put((path, data))
+
+    def __raise_errors(self):
+        with self.__lock:
+            errors, self.__errors = self.__errors, []
+        if errors:
+            raise IOError(f"{len(errors)} images could not be written, the first error was: {errors[0]}") from errors[0]
+
+    def flush(self):
+        """
+        Wait until every queued image is written, raising the errors of the threads.
+        """
+        self.__queue.join()
+        self.__raise_errors()
+
+    def throughput(self) -> float:
+        """
+        Return the number of images written per second since the writer started.
+        """
+        return self.count / max(time.perf_counter() - self.__start_time, 1e-9)
+
+    def close(self, raise_errors: bool = True):
+        """
+        Write the pending images, stop the threads and raise their errors.
+
+        Args:
+            raise_errors (bool, optional): Whether to raise the errors of the threads. Defaults to True.
+
+        Returns:
+            dict: the number of images written ("count"), their size in bytes ("bytes") and the number of images written
+            per second ("throughput")
+        """
+        try:
+            self.__queue.join()
+            if raise_errors:
+                self.__raise_errors()
+        finally:
+            for _ in self.__threads:
+                self.__queue.put(None)
+            for thread in self.__threads:
+                thread.join()
+
+        return {"count": self.count, "bytes": self.bytes, "throughput": self.throughput()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't hide an exception raised inside the with block behind the errors of the threads
+        self.close(raise_errors=exc_type is None)
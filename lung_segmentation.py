@@ -0,0 +1,140 @@
+import os
+
+import cv2
+import numpy as np
+import tensorflow as tf
+import tqdm
+
+from dataset_index import DatasetIndex
+from image import imread_grayscale, normalize
+from image_writer import ImageWriter
+from lung_seg_model import model
+from utils import load_config
+
+# Weights of the lung segmentation model
+SEGMENTATION_MODEL_WEIGHTS = 'segmentation_model.hdf5'
+
+
+class LungMaskGenerator:
+    """
+    Class for segmenting lung images using the U-Net model.
+
+    This code is based on the work presented in:
+    https://www.kaggle.com/eduardomineo/u-net-lung-segmentation-montgomery-shenzhen/execution#4.-Results
+    """
+
+    def __init__(self, input_size=(256, 256, 1),
+                 target_size=(256, 256),
+                 folder_in='',
+                 folder_out='',
+                 batch_size=None):
+        """
+        Initializes an LungMaskGenerator object.
+
+        Args:
+        - input_size: a tuple representing the input shape of the U-Net model.
+        - target_size: a tuple representing the target shape of the input images.
+        - folder_in: a string representing the path to the input folder containing the lung images.
+        - folder_out: a string representing the path to the output folder where the masks will be saved.
+        - batch_size: the number of images segmented at once. Defaults to "mask_generation_batch_size" in the config.
+        """
+        self.input_size = input_size
+        self.target_size = target_size
+        self.folder_in = folder_in
+        self.folder_out = folder_out
+        self.batch_size = batch_size or load_config("mask_generation_batch_size")
+
+    def __load_image(self, img_file):
+        """
+        Loads and processes an image file.
+
+        Args:
+        - img_file: a string representing the path to the image file.
+
+        Returns:
+        - A float32 numpy array of shape (height, width, 1) representing the preprocessed image.
+        """
+        img = imread_grayscale(img_file, self.target_size)
+        img = cv2.resize(img, self.target_size)
+        # The model always runs in float32, whatever the storage dtype is
+        img = normalize(img, np.float32)
+        return np.reshape(img, img.shape + (1,))
+
+    def __load_images(self, img_files):
+        """
+        Build the input pipeline of the model: the images are decoded and resized in parallel, batched and
+        prefetched while the model runs on the previous batch.
+
+        Args:
+        - img_files: a list of strings representing the paths to the image files.
+
+        Returns:
+        - A tf.data.Dataset of float32 batches of shape (batch_size, height, width, 1), in the order of img_files.
+        """
+        image_shape = (self.target_size[1], self.target_size[0], 1)
+
+        def load(img_file):
+            # cv2 releases the GIL while decoding, so the parallel calls really run in parallel
+            img = tf.numpy_function(lambda path: self.__load_image(path.decode()), [img_file], tf.float32)
+            return tf.ensure_shape(img, image_shape)
+
+        dataset = tf.data.Dataset.from_tensor_slices(img_files)
+        dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+        return dataset.batch(self.batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def __save_result(self, save_path, npyfile, test_files, writer):
+        """
+        Saves the segmented images to disk.
+
+        Args:
+        - save_path: a string representing the path to the output folder.
+        - npyfile: a numpy array representing the segmented images.
+        - test_files: a list of strings representing the paths to the input image files.
+        - writer: the ImageWriter the segmented images are queued to.
+        """
+        for i, item in enumerate(npyfile):
+            result_file = test_files[i]
+            img = (item[:, :, 0] * 255.).astype(np.uint8)
+
+            result_file = os.path.join(save_path, self.mask_filename(result_file))
+
+            writer.write(result_file, img)
+
+    @staticmethod
+    def mask_filename(img_file):
+        """
+        Return the file name of the mask generated for an image file.
+        """
+        filename, fileext = os.path.splitext(os.path.basename(img_file))
+        return "%s_mask%s" % (filename, fileext)
+
+    def generate(self, files=None, seg_model=None):
+        """
+        This method loads the saved model from disk, generates image predictions for the images in the specified input folder, and saves the segmented images to the specified output folder.
+
+        The masks of each batch are saved as soon as the batch is predicted, so the predictions of the whole folder are
+        never held in memory.
+
+        :param files: the paths of the images to segment. Defaults to None (every image of the input folder).
+        :param seg_model: the segmentation model. Defaults to None (the U-Net with the saved weights).
+        :return: None
+        """
+        # Load saved model from disk
+        if seg_model is None:
+            seg_model = model(input_size=self.input_size)
+            seg_model.load_weights(SEGMENTATION_MODEL_WEIGHTS)
+
+        # Get list of image files from input folder
+        if files is None:
+            files = DatasetIndex.load(self.folder_in).paths()
+
+        # Generate predictions for images in input folder, saving the segmented images of each batch to output folder
+        dataset = self.__load_images(files)
+        progress = tqdm.tqdm(total=len(files), desc='Generating masks')
+        with ImageWriter() as writer:
+            for i, batch in enumerate(dataset):
+                results = seg_model.predict_on_batch(batch)
+                batch_files = files[i * self.batch_size:(i + 1) * self.batch_size]
+                self.__save_result(self.folder_out, results, batch_files, writer)
+                progress.update(len(batch_files))
+        progress.close()
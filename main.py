@@ -20,6 +20,17 @@ class Main:
         self.is_categorical = is_categorical
 
     def preprocessing(self, input_size, target_size, skip_to_step=None):
+        """
+        Run the preprocessing steps, from the first one or from `skip_to_step`.
+
+        Each mode numbers its own steps, from 1:
+        - classic: 1 upload the dataset, 2 generate the masks, 3 process the images, 4 extract the characteristics
+        - fused ("fused_preprocessing" in the config): 1 upload the dataset, 2 generate the masks, 3 process the
+          images and extract the characteristics in a single pass
+
+        Raises:
+            ValueError: if `skip_to_step` is not a step of the mode
+        """
         # Initialize the Preprocessing class
         pp = Preprocessing(img_input_size=input_size, img_target_size=target_size)
         covid_artifact = None
@@ -66,6 +77,11 @@ class Main:
             self.wdb.upload_dataset_artifact(CovidProcessedDataset())
             self.wdb.upload_dataset_artifact(NormalProcessedDataset())
 
+        def log_feature_profile():
+            # Log the per feature family measures of the extraction, when it was profiled
+            if pp.feature_profile is not None and len(pp.feature_profile):
+                self.wdb.log(pp.feature_profile.metrics())
+
         def extract_characteristics():
             nonlocal covid_masks_artifact, normal_masks_artifact
             # Load the processed datasets as artifacts
@@ -78,19 +94,48 @@ class Main:
             if not normal_masks_artifact:
                 normal_masks_artifact = self.wdb.load_dataset_artifact(NormalMaskDataset())
 
-            self.wdb.log_histogram_chart_comparison(target_size)
-
-            # Generate characteristics file
-            pp.generate_characteristics(
+            # Generate characteristics file, with the histogram statistics as a side output
+            cov_statistics, normal_statistics = pp.generate_characteristics(
                 covid_processed_artifact, normal_processed_artifact,
                 covid_masks_artifact, normal_masks_artifact)
 
+            self.wdb.log_histogram_chart_comparison(target_size, cov_statistics, normal_statistics)
+            log_feature_profile()
+
+            # Upload characteristics
+            self.wdb.upload_characteristics()
+
+        def fused_extract_characteristics():
+            # Load the dataset and masks artifacts
+            covid_artifact, normal_artifact = load_dataset_artifacts()
+            covid_mask_artifact = self.wdb.load_dataset_artifact(CovidMaskDataset())
+            normal_mask_artifact = self.wdb.load_dataset_artifact(NormalMaskDataset())
+
+            # Process the images and generate the characteristics file in a single pass
+            cov_statistics, normal_statistics = pp.generate_fused_characteristics(
+                covid_artifact, covid_mask_artifact, normal_artifact, normal_mask_artifact)
+
+            self.wdb.log_histogram_chart_comparison(target_size, cov_statistics, normal_statistics)
+            log_feature_profile()
+
+            # Upload the processed datasets, when they were saved as a side output
+            if load_config("fused_save_processed"):
+                self.wdb.upload_dataset_artifact(CovidProcessedDataset())
+                self.wdb.upload_dataset_artifact(NormalProcessedDataset())
+
             # Upload characteristics
             self.wdb.upload_characteristics()
 
-        steps = [upload_base_dataset, generate_mask_dataset, processing, extract_characteristics]
+        if load_config("fused_preprocessing"):
+            mode = "fused"
+            steps = [upload_base_dataset, generate_mask_dataset, fused_extract_characteristics]
+        else:
+            mode = "classic"
+            steps = [upload_base_dataset, generate_mask_dataset, processing, extract_characteristics]
 
         if skip_to_step is not None:
+            if not 1 <= skip_to_step <= len(steps):
+                raise ValueError(f"Invalid step {skip_to_step}: the {mode} preprocessing has steps 1 to {len(steps)}")
             steps = steps[skip_to_step-1:]
 
         print(f"Given step:{skip_to_step}, running {steps}")
@@ -102,6 +147,8 @@ class Main:
     def tuning(self):
         characteristics_artifact = self.wdb.load_characteristics()
         classifier = Classifier(characteristics_artifact=characteristics_artifact)
+        # Save the selected columns, so the characteristics of new images can skip the other feature families
+        classifier.save_selection()
 
         if self.is_categorical:
             accuracy = tf.keras.metrics.CategoricalAccuracy()
@@ -174,12 +221,14 @@ class Main:
     def finish(self): self.wdb.finish()
 
 
-# RUN
-main = Main(["cross_val_test"], is_categorical=True)
-try:
-    # main.preprocessing(input_size=(512, 512, 1), target_size=(512, 512), skip_to_step=4)
-    main.tuning()
-finally:
-    main.finish()
+# RUN (guarded: the feature extraction workers are spawned, and re-import this script)
+if __name__ == "__main__":
+    main = Main(["cross_val_test"], is_categorical=True)
+    try:
+        # Step 4 extracts the characteristics in the classic mode, step 3 in the fused mode (see Main.preprocessing)
+        # main.preprocessing(input_size=(512, 512, 1), target_size=(512, 512), skip_to_step=4)
+        main.tuning()
+    finally:
+        main.finish()
 
-print("Finish")
+    print("Finish")
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+
+from utils import abs_path
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 digest of the content of a file.
+
+    Args:
+        file_path: The path of the file.
+        chunk_size: The number of bytes read at once.
+
+    Returns:
+        The hex digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StepManifest:
+    """
+    A record of what a preprocessing step produced: for every output file, the content digests of the input files it
+    was produced from, along with the parameters of the step.
+
+    It lets a rerun of the step redo only the outputs whose inputs changed. When the parameters change, every output is
+    outdated. The manifest is stored as a JSON file next to the output folder, so it isn't uploaded with it.
+
+    Attributes:
+        output_folder (str): The output folder of the step.
+        params (dict): The parameters of the step (target size, model weights digest, ...).
+        path (str): The path of the manifest file.
+    """
+
+    def __init__(self, output_folder: str, params: dict):
+        """
+        Load the manifest of an output folder, discarding its entries if they were produced with other parameters.
+
+        Args:
+            output_folder: The output folder of the step.
+            params: The parameters of the step, JSON serializable.
+        """
+        self.output_folder = output_folder
+        # Round-trip through JSON so tuples and lists compare equal to what was stored
+        self.params = json.loads(json.dumps(params, sort_keys=True, default=str))
+        self.path = output_folder.rstrip("/\\") + ".manifest.json"
+        self.__entries = {}
+        self.__signatures = {}
+
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = None
+
+        if stored is not None and stored.get("params") == self.params:
+            self.__entries = stored.get("entries", {})
+
+    def __signature(self, file_path: str, previous=None) -> list:
+        """
+        Return [size, modification time, digest] of an input file. The digest of the previous signature is reused when
+        the size and modification time didn't change, so unchanged files are not read again.
+        """
+        if file_path in self.__signatures:
+            return self.__signatures[file_path]
+
+        stat = os.stat(file_path)
+        if previous is not None and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+            signature = previous
+        else:
+            signature = [stat.st_size, stat.st_mtime_ns, file_digest(file_path)]
+        self.__signatures[file_path] = signature
+        return signature
+
+    def is_current(self, output_name: str, input_paths: list) -> bool:
+        """
+        Check whether an output exists and was produced from the current content of its inputs.
+
+        Args:
+            output_name: The file name of the output, in the output folder.
+            input_paths: The paths of the input files of the output.
+
+        Returns:
+            True if the output doesn't need to be produced again.
+        """
+        entry = self.__entries.get(output_name)
+        if entry is None or not os.path.exists(abs_path(self.output_folder, output_name)):
+            return False
+
+        previous_inputs = entry["inputs"]
+        if len(previous_inputs) != len(input_paths):
+            return False
+
+        for input_path, previous in zip(input_paths, previous_inputs):
+            if self.__signature(input_path, previous)[2] != previous[2]:
+                return False
+        return True
+
+    def record(self, output_name: str, input_paths: list):
+        """
+        Record that an output was produced from the current content of its inputs.
+
+        Args:
+            output_name: The file name of the output, in the output folder.
+            input_paths: The paths of the input files of the output.
+        """
+        self.__entries[output_name] = {"inputs": [self.__signature(input_path) for input_path in input_paths]}
+
+    def prune(self, output_names):
+        """
+        Delete the outputs that are not expected anymore (their inputs were removed), and forget them.
+
+        Args:
+            output_names: The file names of every expected output.
+        """
+        output_names = set(output_names)
+        for output_name in list(self.__entries):
+            if output_name not in output_names:
+                output_path = abs_path(self.output_folder, output_name)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                del self.__entries[output_name]
+
+    def save(self):
+        """
+        Write the manifest file.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"params": self.params, "entries": self.__entries}, f)
+        os.replace(tmp_path, self.path)
@@ -1,7 +1,15 @@
-from image import LungMaskGenerator, ImageProcessor, ImageSaver, ImageCharacteristics
-from utils import check_folder
+from image import Image, ImageTuple, ImageProcessor, ImageCharacteristics
+from lung_segmentation import SEGMENTATION_MODEL_WEIGHTS, LungMaskGenerator
+from dataset_index import DatasetIndex
+from manifest import StepManifest, file_digest
+from utils import abs_path, check_folder, load_config
+from feature_registry import FeatureSelection
 from dataset_representation import Characteristics, CovidMaskDataset, CovidProcessedDataset,  NormalMaskDataset, NormalProcessedDataset
 
+# Bump them whenever the masks generation or the processing change, so every output is produced again
+MASKS_STEP_VERSION = 2
+PROCESSING_STEP_VERSION = 2
+
 
 class Preprocessing:
     def __init__(self, img_target_size, img_input_size):
@@ -9,18 +17,39 @@ class Preprocessing:
         Initialize the Preprocessing object.
 
         Args:
-            wandb (WandbUtils): The WandbUtils object to use for logging.
+            img_target_size (tuple): The size the images are resized to.
+            img_input_size (tuple): The input shape of the segmentation model.
         """
         self.covid_mask_dataset = CovidMaskDataset()
         self.normal_masks = NormalMaskDataset()
         self.characteristics = Characteristics()
         self.img_target_size = img_target_size
         self.img_input_size = img_input_size
+        self.families = self.__feature_families()
+        # Per feature family measures of the last characteristics generation, when "feature_profiling" is set
+        self.feature_profile = None
+
+    @staticmethod
+    def __feature_families():
+        """
+        Return the feature families to extract: those of the saved feature selection when "extract_selected_features"
+        is set (to score new images), or None for every family (to train).
+        """
+        if not load_config("extract_selected_features"):
+            return None
+        selection = FeatureSelection.load(abs_path(load_config("feature_selection_path")))
+        if selection is None:
+            print("No feature selection saved, extracting every feature family")
+            return None
+        return selection.families()
 
     def generate_lungs_masks(self, covid_artifact, normal_artifact):
         """
         Generate lung masks for the COVID and normal chest X-ray images.
 
+        Only the masks of new or changed images are generated: the masks whose image, model weights and sizes didn't
+        change since the previous run (see StepManifest) are kept.
+
         Args:
             covid_artifact (wandb.Artifact): The COVID chest X-ray images artifact.
             normal_artifact (wandb.Artifact): The normal chest X-ray images artifact.
@@ -28,20 +57,46 @@ class Preprocessing:
         Returns:
             None
         """
-        # For re-creating the folders
-        check_folder(self.covid_mask_dataset.path)
-        check_folder(self.normal_masks.path)
-
-        # Generate masks
-        LungMaskGenerator(folder_in=covid_artifact, folder_out=self.covid_mask_dataset.path,
-                          target_size=self.img_target_size, input_size=self.img_input_size).generate()
-        LungMaskGenerator(folder_in=normal_artifact, folder_out=self.normal_masks.path,
-                          target_size=self.img_target_size, input_size=self.img_input_size).generate()
+        params = {
+            "version": MASKS_STEP_VERSION,
+            "target_size": self.img_target_size,
+            "input_size": self.img_input_size,
+            "reduced_decode": load_config("reduced_decode"),
+            "weights": file_digest(SEGMENTATION_MODEL_WEIGHTS),
+        }
+
+        for images_path, masks_path in ((covid_artifact, self.covid_mask_dataset.path),
+                                        (normal_artifact, self.normal_masks.path)):
+            # Create the folder if needed, keeping the previous masks
+            check_folder(masks_path, clear_folder=False)
+            manifest = StepManifest(masks_path, params)
+
+            # Find the images whose mask is missing or outdated, checking every image file (one may have been
+            # overwritten in place)
+            images = DatasetIndex.verify(images_path).paths()
+            outdated = [img for img in images if not manifest.is_current(LungMaskGenerator.mask_filename(img), [img])]
+            print(f"Generating {len(outdated)} masks in {masks_path}, {len(images) - len(outdated)} are up to date")
+
+            # Generate masks
+            if outdated:
+                LungMaskGenerator(folder_in=images_path, folder_out=masks_path,
+                                  target_size=self.img_target_size, input_size=self.img_input_size).generate(outdated)
+
+            for img in outdated:
+                manifest.record(LungMaskGenerator.mask_filename(img), [img])
+            # Delete the masks of removed images
+            manifest.prune([LungMaskGenerator.mask_filename(img) for img in images])
+            manifest.save()
+            # Index the new masks
+            DatasetIndex.update(masks_path)
 
     def process_images(self, *artifacts):
         """
         Process the COVID and normal images, and save the processed images to the specified paths.
 
+        Only new images, or images whose mask changed, are processed again: the other processed images are kept (see
+        StepManifest).
+
         Args:
             *artifacts: The COVID and normal chest X-ray images artifacts and their corresponding mask artifacts.
         Returns:
@@ -53,41 +108,95 @@ class Preprocessing:
         normal_artifact = artifacts[2]
         normal_mask_artifact = artifacts[3]
 
-        # Initialize the image processors with the dataset artifacts
-        cov_processor = ImageProcessor(covid_artifact, covid_mask_artifact, target_size=self.img_target_size)
-        normal_processor = ImageProcessor(normal_artifact, normal_mask_artifact, target_size=self.img_target_size)
+        params = {"version": PROCESSING_STEP_VERSION, "target_size": self.img_target_size,
+                  "reduced_decode": load_config("reduced_decode")}
 
-        # Process the images
         print("Processing images\n")
-        cov_processed = cov_processor.process()
-        normal_processed = normal_processor.process()
-
-        cov_processed_artifact = CovidProcessedDataset()
-        normal_processed_artifact = NormalProcessedDataset()
-
-        # Save the processed images
-        cov_save_path = cov_processed_artifact.path
-        normal_save_path = normal_processed_artifact.path
-
-        # Create the save paths if they don't exist, and delete any previous
-        check_folder(cov_save_path)
-        check_folder(normal_save_path)
-
-        # Save the processed images to the specified paths
-        ImageSaver(cov_processed).save_to(cov_save_path)
-        ImageSaver(normal_processed).save_to(normal_save_path)
+        for images_path, masks_path, save_path in (
+                (covid_artifact, covid_mask_artifact, CovidProcessedDataset().path),
+                (normal_artifact, normal_mask_artifact, NormalProcessedDataset().path)):
+            # Create the save path if it doesn't exist, keeping the previous processed images
+            check_folder(save_path, clear_folder=False)
+            manifest = StepManifest(save_path, params)
+
+            # Find the images whose processed image is missing or outdated, checking every image and mask file (one
+            # may have been overwritten in place, and the image stacks would still hold its old pixels)
+            images = DatasetIndex.verify(images_path).paths()
+            DatasetIndex.verify(masks_path)
+
+            def inputs(img):
+                return [img, ImageTuple.mask_path(img, masks_path)]
+
+            outdated = [img for img in images if not manifest.is_current(Image.processed_filename(img), inputs(img))]
+            print(f"Processing {len(outdated)} images into {save_path}, {len(images) - len(outdated)} are up to date")
+
+            # Process the images and save them to the specified path, one batch at a time
+            if outdated:
+                ImageProcessor(images_path, masks_path, target_size=self.img_target_size, files=outdated).save_to(save_path)
+
+            for img in outdated:
+                manifest.record(Image.processed_filename(img), inputs(img))
+            # Delete the processed images of removed images
+            manifest.prune([Image.processed_filename(img) for img in images])
+            manifest.save()
+            # Index the new processed images
+            DatasetIndex.update(save_path)
 
     def generate_characteristics(self,
                                  cov_processed_artifact, normal_processed_artifact, cov_masks_artifact, normal_masks_artifact):
         """
         Generate image characteristics for the processed COVID and normal chest X-ray images.
 
+        Only the features of new or changed images are computed, the others come from the feature cache (see
+        ImageCharacteristics.save).
+
         Args:
             cov_processed_artifact (wandb.Artifact): The processed COVID chest X-ray images artifact.
             normal_processed_artifact (wandb.Artifact): The processed normal chest X-ray images artifact.
 
         Returns:
-            None
+            tuple: The histogram statistics (HistogramStatistics) of the COVID and of the normal processed images,
+            gathered during the extraction.
+        """
+        ic = ImageCharacteristics(cov_processed_artifact, normal_processed_artifact, self.img_target_size, self.families)
+        ic.save(self.characteristics.path, cov_masks_artifact, normal_masks_artifact, self.characteristics.format)
+        self.feature_profile = ic.profile
+        return ic.cov_statistics, ic.normal_statistics
+
+    def generate_fused_characteristics(self, covid_artifact, covid_masks_artifact, normal_artifact,
+                                       normal_masks_artifact, save_processed=None):
+        """
+        Process the COVID and normal chest X-ray images and generate their characteristics in a single pass, without
+        writing and reading back the processed images (see ImageCharacteristics.save_fused).
+
+        Args:
+            covid_artifact (str): The COVID chest X-ray images folder.
+            covid_masks_artifact (str): The COVID masks folder.
+            normal_artifact (str): The normal chest X-ray images folder.
+            normal_masks_artifact (str): The normal masks folder.
+            save_processed (bool, optional): Whether to also save the processed images, as a side output. Defaults to
+                "fused_save_processed" in the config.
+
+        Returns:
+            tuple: The histogram statistics (HistogramStatistics) of the COVID and of the normal processed images.
         """
-        ic = ImageCharacteristics(cov_processed_artifact, normal_processed_artifact, self.img_target_size)
-        ic.save(self.characteristics.path, cov_masks_artifact, normal_masks_artifact)
+        if save_processed is None:
+            save_processed = load_config("fused_save_processed")
+
+        cov_processed_path = normal_processed_path = None
+        if save_processed:
+            cov_processed_path = CovidProcessedDataset().path
+            normal_processed_path = NormalProcessedDataset().path
+            # Every processed image is written again
+            check_folder(cov_processed_path)
+            check_folder(normal_processed_path)
+
+        ic = ImageCharacteristics(covid_artifact, normal_artifact, self.img_target_size, self.families)
+        ic.save_fused(self.characteristics.path, covid_masks_artifact, normal_masks_artifact,
+                      self.characteristics.format, cov_processed_path, normal_processed_path)
+        self.feature_profile = ic.profile
+
+        if save_processed:
+            DatasetIndex.update(cov_processed_path)
+            DatasetIndex.update(normal_processed_path)
+        return ic.cov_statistics, ic.normal_statistics
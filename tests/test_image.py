@@ -0,0 +1,25 @@
+import cv2
+import numpy as np
+
+from dataset_index import image_header
+from image import imread_grayscale
+
+TARGET_SIZE = (128, 128)
+
+
+def test_png_decoded_at_full_resolution(tmp_path):
+    # A reduced decode of a PNG file decimates it, which gives other pixels than the resize
+    data = np.random.default_rng(0).integers(0, 256, (1024, 768), dtype=np.uint8)
+    file_path = str(tmp_path / "image.png")
+    cv2.imwrite(file_path, data)
+    assert image_header(file_path) == ("png", 768, 1024)
+    np.testing.assert_array_equal(imread_grayscale(file_path, TARGET_SIZE), data)
+
+
+def test_jpeg_decoded_at_reduced_resolution(tmp_path):
+    data = np.random.default_rng(0).integers(0, 256, (1024, 768), dtype=np.uint8)
+    file_path = str(tmp_path / "image.jpg")
+    cv2.imwrite(file_path, data)
+    assert image_header(file_path) == ("jpeg", 768, 1024)
+    # The smallest side is 768, so a quarter of it still covers the target size
+    assert imread_grayscale(file_path, TARGET_SIZE).shape == (256, 192)
@@ -0,0 +1,106 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import image
+import utils
+from dataset_index import mask_filename
+from image import Image, ImageProcessor
+from preprocessing import Preprocessing
+
+TARGET_SIZE = (32, 32)
+SHAPE = (48, 40)
+
+
+def write_image(images_path, masks_path, name, seed, write_mask=True):
+    """
+    Write a random image, and its mask, to an images folder and its masks folder.
+    """
+    rng = np.random.default_rng(seed)
+    cv2.imwrite(os.path.join(images_path, name), rng.integers(0, 256, SHAPE, dtype=np.uint8))
+    if write_mask:
+        cv2.imwrite(os.path.join(masks_path, mask_filename(name)), (rng.random(SHAPE) < 0.6).astype(np.uint8) * 255)
+
+
+def expected_processed(images_path, masks_path, name):
+    """
+    Process an image from its files, without the image stacks.
+    """
+    processor = ImageProcessor(images_path, masks_path, TARGET_SIZE, files=[os.path.join(images_path, name)])
+    processor.use_stacks = False
+    return next(processor.process_stream()).data
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    """
+    Record the file names of the images decoded, with the decode cache disabled so every decode shows.
+    """
+    names = []
+    imread_grayscale = image.imread_grayscale
+
+    def recording_imread(file_path, target_size):
+        names.append(os.path.basename(file_path))
+        return imread_grayscale(file_path, target_size)
+
+    monkeypatch.setattr(image, "imread_grayscale", recording_imread)
+    monkeypatch.setattr(image, "_DECODE_CACHE", False)
+    return names
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    """
+    Create the covid and normal images and masks folders, and point the processed folders of the config to tmp_path.
+    """
+    utils.load_config("use_image_stacks")
+    paths = {}
+    for key in ("covid", "covid_masks", "normal", "normal_masks"):
+        paths[key] = str(tmp_path / key)
+        os.makedirs(paths[key])
+    for key in ("covid_processed_path", "normal_processed_path"):
+        paths[key] = str(tmp_path / key)
+        monkeypatch.setitem(utils.CONFIG_JSON, key, paths[key])
+
+    for i in range(4):
+        write_image(paths["covid"], paths["covid_masks"], "%d.png" % i, i)
+    write_image(paths["normal"], paths["normal_masks"], "normal.png", 10)
+    return paths
+
+
+@pytest.mark.parametrize("use_stacks", [True, False])
+@pytest.mark.parametrize("change", ["added", "overwritten"])
+def test_changed_image_is_the_only_one_decoded(folders, decoded, monkeypatch, use_stacks, change):
+    monkeypatch.setitem(utils.CONFIG_JSON, "use_image_stacks", use_stacks)
+    artifacts = (folders["covid"], folders["covid_masks"], folders["normal"], folders["normal_masks"])
+
+    pp = Preprocessing(img_target_size=TARGET_SIZE, img_input_size=TARGET_SIZE + (1,))
+    pp.process_images(*artifacts)
+    assert len(decoded) == 10
+    decoded.clear()
+
+    if change == "added":
+        # A new image and its mask, written by the masks step
+        name = "new.png"
+        write_image(folders["covid"], folders["covid_masks"], name, 20)
+        expected = [name, mask_filename(name)]
+    else:
+        # An image overwritten in place, which leaves the modification time of its folder as it was
+        name = "1.png"
+        folder_mtime = os.stat(folders["covid"]).st_mtime_ns
+        write_image(folders["covid"], folders["covid_masks"], name, 30, write_mask=False)
+        assert os.stat(folders["covid"]).st_mtime_ns == folder_mtime
+        # The mask is read from its stack, when there is one
+        expected = [name] if use_stacks else [name, mask_filename(name)]
+
+    pp.process_images(*artifacts)
+    assert sorted(decoded) == sorted(expected)
+
+    processed_path = folders["covid_processed_path"]
+    assert sorted(os.listdir(processed_path)) == sorted(Image.processed_filename(name)
+                                                        for name in os.listdir(folders["covid"]))
+    # The processed image comes from the new content of the image, not from a stale stack
+    processed = cv2.imread(os.path.join(processed_path, Image.processed_filename(name)), cv2.IMREAD_GRAYSCALE)
+    np.testing.assert_array_equal(processed, expected_processed(folders["covid"], folders["covid_masks"], name))
@@ -0,0 +1,161 @@
+import mahotas as mt
+import numpy as np
+import pytest
+
+import texture
+from feature_registry import RADIOMICS_PREFIX, radiomics_profile
+from texture import TEXTURE_CLASSES, TextureMatrices, compare_features, lbp_image, tas_image, validate_stack
+
+# Tolerances of the comparisons with mahotas and PyRadiomics
+RTOL = 1e-6
+ATOL = 1e-9
+
+# Images of the stacks, not square so swapped rows and columns show
+NUM_IMAGES = 4
+SHAPE = (48, 64)
+
+
+def random_stack(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (NUM_IMAGES,) + SHAPE, dtype=np.uint8)
+
+
+def masked_stack(seed=0):
+    """
+    Return a stack whose images are 0 outside of a random mask, and the masks.
+    """
+    rng = np.random.default_rng(seed)
+    stack = rng.integers(1, 256, (NUM_IMAGES,) + SHAPE, dtype=np.uint8)
+    masks = rng.random((NUM_IMAGES,) + SHAPE) < 0.6
+    stack[~masks] = 0
+    return stack, masks
+
+
+STACKS = {
+    "random": random_stack(),
+    "constant": np.full((NUM_IMAGES,) + SHAPE, 128, dtype=np.uint8),
+    "threshold": np.full((NUM_IMAGES,) + SHAPE, 30, dtype=np.uint8),
+    "zeros": np.zeros((NUM_IMAGES,) + SHAPE, dtype=np.uint8),
+}
+
+
+@pytest.mark.parametrize("name", STACKS)
+def test_lbp_image(name):
+    for data in STACKS[name]:
+        np.testing.assert_allclose(lbp_image(data), mt.features.lbp(data, 8, 8), rtol=RTOL, atol=ATOL)
+
+
+@pytest.mark.parametrize("name", STACKS)
+def test_tas_image(name):
+    for data in STACKS[name]:
+        np.testing.assert_allclose(tas_image(data), mt.features.tas(data), rtol=RTOL, atol=ATOL)
+
+
+@pytest.mark.parametrize("name", STACKS)
+def test_validate_stack(name):
+    assert validate_stack(STACKS[name]) == {}
+
+
+def test_validate_stack_mismatch(monkeypatch):
+    # Features off by one must be reported for every image
+    monkeypatch.setattr(texture, "lbp_image", lambda data: lbp_image(data) + 1)
+    mismatches = validate_stack(STACKS["random"])
+    assert sorted(mismatches) == list(range(NUM_IMAGES))
+
+
+def test_lbp_image_masked():
+    # mahotas ignores the pixels that are 0, as the masks do
+    stack, masks = masked_stack()
+    for data, mask in zip(stack, masks):
+        np.testing.assert_allclose(lbp_image(data, mask), mt.features.lbp(data, 8, 8, ignore_zeros=True),
+                                   rtol=RTOL, atol=ATOL)
+
+
+def test_tas_image_masked():
+    stack, masks = masked_stack()
+    for data, mask in zip(stack, masks):
+        np.testing.assert_allclose(tas_image(data, np.ones_like(mask)), tas_image(data), rtol=RTOL, atol=ATOL)
+
+        # The masked out pixels are not counted, so each histogram still sums to 1
+        features = tas_image(data, mask).reshape(6, 9)
+        np.testing.assert_allclose(features.sum(axis=1), 1, rtol=RTOL, atol=ATOL)
+
+
+def test_mask_shape():
+    data = random_stack()[0]
+    with pytest.raises(ValueError):
+        lbp_image(data, np.ones(SHAPE[::-1], dtype=bool))
+
+
+def haralick_image(name):
+    rng = np.random.default_rng(1)
+    if name == "random":
+        return rng.integers(0, 256, SHAPE, dtype=np.uint8)
+    if name == "flat":
+        return np.full(SHAPE, 100, dtype=np.uint8)
+    if name == "few_values":
+        return rng.integers(0, 4, SHAPE, dtype=np.uint8)
+    if name == "tiny":
+        return rng.integers(0, 256, (4, 4), dtype=np.uint8)
+    raise ValueError(name)
+
+
+@pytest.mark.parametrize("name", ["random", "flat", "few_values", "tiny"])
+def test_haralick(name):
+    data = haralick_image(name)
+    np.testing.assert_allclose(TextureMatrices(data).haralick(), mt.features.haralick(data).mean(0), rtol=RTOL,
+                               atol=ATOL)
+
+
+def radiomics_case(name):
+    """
+    Return an image and its mask (255 in the ROI) for the comparisons with PyRadiomics.
+    """
+    rng = np.random.default_rng(2)
+    rows, columns = np.mgrid[:SHAPE[0], :SHAPE[1]]
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[8:40, 10:54] = 255
+    if name == "random":
+        data = rng.integers(0, 256, SHAPE, dtype=np.uint8)
+    elif name == "blurred":
+        # A smooth gradient with some noise: long runs and big zones
+        data = np.clip(2 * rows + columns + rng.normal(0, 4, SHAPE), 0, 255).astype(np.uint8)
+    elif name == "flat":
+        # A single gray level in the ROI
+        data = np.full(SHAPE, 100, dtype=np.uint8)
+    elif name == "single_bin":
+        data = rng.integers(100, 110, SHAPE, dtype=np.uint8)
+    elif name == "tiny":
+        data = rng.integers(0, 256, SHAPE, dtype=np.uint8)
+        mask[:] = 0
+        mask[20:22, 30:32] = 255
+    elif name == "sparse":
+        data = rng.integers(0, 256, SHAPE, dtype=np.uint8)
+        mask[rng.random(SHAPE) < 0.7] = 0
+    else:
+        raise ValueError(name)
+    return data, mask
+
+
+@pytest.mark.parametrize("name", ["random", "blurred", "flat", "single_bin", "tiny", "sparse"])
+def test_radiomics_features(name):
+    radiomics = pytest.importorskip("radiomics")
+    sitk = pytest.importorskip("SimpleITK")
+    from radiomics import featureextractor
+
+    radiomics.setVerbosity(40)
+    data, mask = radiomics_case(name)
+    profile = radiomics_profile("lean_2d_v1")
+    params = profile["params"]
+    features = TextureMatrices.from_profile(data, mask, profile).radiomics_features()
+
+    # As ImageTuple.radiomics_features runs PyRadiomics: a float image and the binarized mask, as single slice volumes
+    extractor = featureextractor.RadiomicsFeatureExtractor(
+        dict(params, featureClass={feature_class: [] for feature_class in TEXTURE_CLASSES}))
+    sitk_image = sitk.GetImageFromArray(data[None].astype(np.float64))
+    sitk_mask = sitk.GetImageFromArray((mask[None] > profile["mask_threshold"]).astype(np.uint8))
+    result = extractor.execute(sitk_image, sitk_mask)
+    reference = {RADIOMICS_PREFIX + key[len("original_"):]: float(value) for key, value in result.items()
+                 if key.startswith("original_")}
+
+    assert reference
+    assert compare_features(features, reference, rtol=RTOL, atol=ATOL) == {}
@@ -0,0 +1,657 @@
+import numpy as np
+from numba import njit
+
+from feature_registry import RADIOMICS_PREFIX
+
+# The 2D directions of the co-occurrences and of the runs, as (row, column) offsets, in the order of mahotas
+DIRECTIONS = np.array([(0, 1), (1, 1), (1, 0), (1, -1)], dtype=np.int64)
+
+# PyRadiomics feature classes computed from the texture matrices
+TEXTURE_CLASSES = ("glcm", "glrlm", "glszm")
+
+# Tolerances of the comparison of the features with the library values
+VALIDATION_RTOL = 1e-6
+VALIDATION_ATOL = 1e-9
+
+# As PyRadiomics, added inside the logarithms and to the denominators that can be 0
+_EPS = np.spacing(1)
+
+# Parameters of the TAS features, as mahotas.features.tas: the threshold of the pixels the mean is computed on, and the
+# margin around the mean
+TAS_THRESHOLD = 30
+TAS_MARGIN = 30
+
+
+@njit
+def _cooccurrences(data, levels, num_values, num_levels):
+    """
+    Count the pairs of neighbours in each direction: of the values of the whole image, and of the gray levels of the
+    ROI (where the gray level is not 0). Neither count is symmetrical.
+    """
+    height, width = data.shape
+    values = np.zeros((len(DIRECTIONS), num_values, num_values), dtype=np.int64)
+    glcm = np.zeros((len(DIRECTIONS), num_levels, num_levels), dtype=np.int64)
+    for d in range(len(DIRECTIONS)):
+        dy, dx = DIRECTIONS[d, 0], DIRECTIONS[d, 1]
+        for y in range(height - dy):
+            for x in range(max(0, -dx), width - max(0, dx)):
+                values[d, data[y, x], data[y + dy, x + dx]] += 1
+                level, neighbour = levels[y, x], levels[y + dy, x + dx]
+                if level > 0 and neighbour > 0:
+                    glcm[d, level - 1, neighbour - 1] += 1
+    return values, glcm
+
+
+@njit
+def _runs(levels, num_levels):
+    """
+    Count the runs of each gray level of the ROI in each direction, by length.
+    """
+    height, width = levels.shape
+    runs = np.zeros((len(DIRECTIONS), num_levels, max(height, width)), dtype=np.int64)
+    for d in range(len(DIRECTIONS)):
+        dy, dx = DIRECTIONS[d, 0], DIRECTIONS[d, 1]
+        for y in range(height):
+            for x in range(width):
+                level = levels[y, x]
+                if level == 0:
+                    continue
+                # Only start from the first pixel of a run
+                py, px = y - dy, x - dx
+                if 0 <= py < height and 0 <= px < width and levels[py, px] == level:
+                    continue
+                length = 1
+                ny, nx = y + dy, x + dx
+                while 0 <= ny < height and 0 <= nx < width and levels[ny, nx] == level:
+                    length += 1
+                    ny += dy
+                    nx += dx
+                runs[d, level - 1, length - 1] += 1
+    return runs
+
+
+@njit
+def _zones(levels):
+    """
+    Find the zones (8-connected pixels of the same gray level) of the ROI, returning their gray levels and sizes.
+    """
+    height, width = levels.shape
+    visited = np.zeros(levels.shape, dtype=np.bool_)
+    stack = np.empty(height * width, dtype=np.int64)
+    zone_levels = np.empty(height * width, dtype=np.int64)
+    zone_sizes = np.empty(height * width, dtype=np.int64)
+    num_zones = 0
+    for y in range(height):
+        for x in range(width):
+            level = levels[y, x]
+            if level == 0 or visited[y, x]:
+                continue
+            # Flood fill the zone
+            visited[y, x] = True
+            stack[0] = y * width + x
+            top = 1
+            size = 0
+            while top > 0:
+                top -= 1
+                cy, cx = stack[top] // width, stack[top] % width
+                size += 1
+                for ny in range(max(cy - 1, 0), min(cy + 2, height)):
+                    for nx in range(max(cx - 1, 0), min(cx + 2, width)):
+                        if not visited[ny, nx] and levels[ny, nx] == level:
+                            visited[ny, nx] = True
+                            stack[top] = ny * width + nx
+                            top += 1
+            zone_levels[num_zones] = level
+            zone_sizes[num_zones] = size
+            num_zones += 1
+    return zone_levels[:num_zones], zone_sizes[:num_zones]
+
+
+def _entropy(p, axis):
+    return -np.sum(p * np.log2(p + _EPS), axis)
+
+
+def _mahotas_entropy(p, axis):
+    # mahotas leaves the zero probabilities out instead of adding an epsilon
+    return -np.sum(p * np.log2(np.where(p == 0, 1, p)), axis)
+
+
+def _sum_diff(p, i, j, sum_length, diff_length):
+    """
+    Return the distributions of i + j and of |i - j| of each matrix of p (one per direction).
+    """
+    sums = (i + j).astype(np.int64).ravel()
+    diffs = np.abs(i - j).astype(np.int64).ravel()
+    p_sum = np.array([np.bincount(sums, weights=matrix.ravel(), minlength=sum_length) for matrix in p])
+    p_diff = np.array([np.bincount(diffs, weights=matrix.ravel(), minlength=diff_length) for matrix in p])
+    return p_sum, p_diff
+
+
+def compare_features(features: dict, reference: dict, rtol: float = VALIDATION_RTOL, atol: float = VALIDATION_ATOL):
+    """
+    Compare features with reference values (of mahotas or PyRadiomics).
+
+    Args:
+        features (dict): The features, by name.
+        reference (dict): The reference values, by name.
+        rtol (float, optional): The relative tolerance. Defaults to VALIDATION_RTOL.
+        atol (float, optional): The absolute tolerance. Defaults to VALIDATION_ATOL.
+
+    Returns:
+        dict: the (value, reference value) of the features that differ or are missing from either, by name
+    """
+    mismatches = {}
+    for name in sorted(set(features) | set(reference)):
+        value, reference_value = features.get(name), reference.get(name)
+        if value is None or reference_value is None or \
+                not np.isclose(value, reference_value, rtol=rtol, atol=atol, equal_nan=True):
+            mismatches[name] = (value, reference_value)
+    return mismatches
+
+
+def validate_features(features: dict, reference: dict, source: str) -> dict:
+    """
+    Compare features of the texture engine with the library values (see compare_features), printing the mismatches.
+
+    Args:
+        features (dict): The features of the texture engine, by name.
+        reference (dict): The library values, by name.
+        source (str): What the features were extracted from, for the message.
+
+    Returns:
+        dict: the mismatches
+    """
+    mismatches = compare_features(features, reference)
+    if mismatches:
+        print(f"The texture engine differs from the library on {len(mismatches)} features of {source}: " +
+              ", ".join(f"{name} ({value} instead of {reference_value})"
+                        for name, (value, reference_value) in mismatches.items()))
+    return mismatches
+
+
+class TextureMatrices:
+    """
+    The texture matrices of an image and its mask, built once and shared by the texture features:
+    - the co-occurrences of the values of the whole image, for the Haralick features (as mahotas.features.haralick)
+    - the GLCM, GLRLM and GLSZM of the gray levels of the ROI, for the glcm, glrlm and glszm PyRadiomics features
+
+    The gray levels are the values inside the mask discretized with a fixed bin width, as PyRadiomics does it, and the
+    matrices are 2D (as PyRadiomics with force2D), in the 4 directions of mahotas. The matrices are built with numba
+    kernels the first time a feature needs them, and the features are computed from them with NumPy.
+
+    Attributes:
+        data (ndarray): The image, 2D of an integer type.
+        levels (ndarray): The gray level of each pixel of the ROI, from 1, and 0 outside of it.
+        gray_levels (ndarray): The gray levels present in the ROI, sorted.
+    """
+
+    def __init__(self, data, mask=None, bin_width: float = 25, mask_threshold: int = 20):
+        """
+        Args:
+            data (ndarray): The image, 2D of an integer type.
+            mask (ndarray, optional): The mask of the image, the ROI being the pixels above the threshold. Defaults to
+                None (only for the Haralick features, which don't use the mask).
+            bin_width (float, optional): The bin width of the gray levels. Defaults to 25 (the PyRadiomics default).
+            mask_threshold (int, optional): The mask threshold. Defaults to 20.
+        """
+        self.data = np.ascontiguousarray(data)
+        self.levels = np.zeros(self.data.shape, dtype=np.int64)
+        if mask is not None:
+            roi = mask > mask_threshold
+            if not roi.any():
+                raise ValueError("The mask is empty, there is no texture to extract")
+            # Bins from the multiple of the bin width below the minimum, as PyRadiomics
+            values = self.data[roi].astype(np.float64)
+            low_bound = values.min() - values.min() % bin_width
+            self.levels[roi] = np.floor((values - low_bound) / bin_width).astype(np.int64) + 1
+        self.gray_levels = np.unique(self.levels[self.levels > 0])
+        self.num_levels = int(self.gray_levels.max()) if len(self.gray_levels) else 0
+        self.__cooccurrences = None
+        self.__runs = None
+        self.__zones = None
+
+    @classmethod
+    def from_profile(cls, data, mask, profile: dict):
+        """
+        Build the texture matrices with the settings of a radiomics profile (see feature_registry).
+        """
+        setting = profile["params"].get("setting", {})
+        if not setting.get("force2D") or "binWidth" not in setting or "binCount" in setting:
+            raise ValueError(f"The texture engine needs a 2D radiomics profile with a bin width, not {profile['name']}")
+        return cls(data, mask, setting["binWidth"], profile["mask_threshold"])
+
+    def __cooccurrence_matrices(self):
+        if self.__cooccurrences is None:
+            self.__cooccurrences = _cooccurrences(self.data, self.levels, int(self.data.max()) + 1, self.num_levels)
+        return self.__cooccurrences
+
+    def haralick(self):
+        """
+        Calculate the mean of the 13 Haralick texture features over the 4 directions, as
+        `mahotas.features.haralick(data).mean(0)`.
+
+        Returns:
+            ndarray: the mean of the Haralick texture features
+        """
+        counts = self.__cooccurrence_matrices()[0]
+        cmat = (counts + counts.transpose(0, 2, 1)).astype(np.float64)
+        p = cmat / cmat.sum((1, 2), keepdims=True)
+
+        size = p.shape[1]
+        k = np.arange(size, dtype=np.float64)
+        tk = np.arange(2 * size, dtype=np.float64)
+        i, j = np.meshgrid(k, k, indexing="ij")
+        p_sum, p_diff = _sum_diff(p, i, j, 2 * size, size)
+
+        px, py = p.sum(1), p.sum(2)
+        ux, uy = px @ k, py @ k
+        vx, vy = px @ k ** 2 - ux ** 2, py @ k ** 2 - uy ** 2
+        sxy = np.sqrt(vx) * np.sqrt(vy)
+
+        feats = np.zeros((len(p), 13))
+        feats[:, 0] = (p ** 2).sum((1, 2))
+        feats[:, 1] = p_diff @ k ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            feats[:, 2] = np.where(sxy == 0, 1., ((i * j * p).sum((1, 2)) - ux * uy) / sxy)
+        feats[:, 3] = vx
+        feats[:, 4] = (p / (1 + (i - j) ** 2)).sum((1, 2))
+        feats[:, 5] = p_sum @ tk
+        feats[:, 6] = p_sum @ tk ** 2 - feats[:, 5] ** 2
+        feats[:, 7] = _mahotas_entropy(p_sum, 1)
+        feats[:, 8] = _mahotas_entropy(p, (1, 2))
+        feats[:, 9] = p_diff.var(1)
+        feats[:, 10] = _mahotas_entropy(p_diff, 1)
+
+        hx, hy = _mahotas_entropy(px, 1), _mahotas_entropy(py, 1)
+        pxpy = px[:, None, :] * py[:, :, None]
+        hxy1 = -(p * np.log2(np.where(pxpy == 0, 1, pxpy))).sum((1, 2))
+        hxy2 = _mahotas_entropy(pxpy, (1, 2))
+        hmax = np.maximum(hx, hy)
+        feats[:, 11] = np.where(hmax == 0, feats[:, 8] - hxy1, (feats[:, 8] - hxy1) / np.where(hmax == 0, 1, hmax))
+        feats[:, 12] = np.sqrt(np.maximum(0, 1 - np.exp(-2. * (hxy2 - feats[:, 8]))))
+        return feats.mean(0)
+
+    def __present(self, matrix, axes):
+        """
+        Keep the rows and columns of the gray levels present in the ROI and the directions with any count.
+        """
+        for axis in axes:
+            matrix = np.take(matrix, self.gray_levels - 1, axis=axis)
+        return matrix[matrix.sum(tuple(range(1, matrix.ndim))) > 0].astype(np.float64)
+
+    def glcm(self):
+        """
+        Return the normalized symmetrical GLCM of each direction, of shape (directions, levels, levels), the levels
+        being the gray levels present in the ROI.
+        """
+        glcm = self.__present(self.__cooccurrence_matrices()[1], (1, 2))
+        glcm = glcm + glcm.transpose(0, 2, 1)
+        return glcm / glcm.sum((1, 2), keepdims=True)
+
+    def glrlm(self):
+        """
+        Return the GLRLM of each direction, of shape (directions, levels, run lengths), with the run lengths present.
+
+        Returns:
+            tuple: the GLRLM and the run lengths
+        """
+        if self.__runs is None:
+            self.__runs = _runs(self.levels, self.num_levels)
+        runs = self.__present(self.__runs, (1,))
+        lengths = runs.sum((0, 1)) > 0
+        return runs[:, :, lengths], np.arange(1, runs.shape[2] + 1, dtype=np.float64)[lengths]
+
+    def glszm(self):
+        """
+        Return the GLSZM, of shape (levels, zone sizes), with the zone sizes present.
+
+        Returns:
+            tuple: the GLSZM and the zone sizes
+        """
+        if self.__zones is None:
+            self.__zones = _zones(self.levels)
+        zone_levels, zone_sizes = self.__zones
+        sizes, size_index = np.unique(zone_sizes, return_inverse=True)
+        glszm = np.zeros((len(self.gray_levels), len(sizes)))
+        np.add.at(glszm, (np.searchsorted(self.gray_levels, zone_levels), size_index), 1)
+        return glszm, sizes.astype(np.float64)
+
+    def glcm_features(self) -> dict:
+        """
+        Calculate the PyRadiomics glcm features, averaged over the directions.
+        """
+        p = self.glcm()
+        num_levels = self.num_levels
+        levels = self.gray_levels.astype(np.float64)
+        i, j = np.meshgrid(levels, levels, indexing="ij")
+        k_sum = np.arange(2, 2 * num_levels + 1, dtype=np.float64)
+        k_diff = np.arange(num_levels, dtype=np.float64)
+        p_sum, p_diff = _sum_diff(p, i, j, 2 * num_levels + 1, num_levels)
+        p_sum = p_sum[:, 2:]
+
+        px, py = p.sum(2, keepdims=True), p.sum(1, keepdims=True)
+        ux, uy = (i * p).sum((1, 2), keepdims=True), (j * p).sum((1, 2), keepdims=True)
+        hxy = _entropy(p, (1, 2))
+        hx, hy = _entropy(px, (1, 2)), _entropy(py, (1, 2))
+        hxy1 = -(p * np.log2(px * py + _EPS)).sum((1, 2))
+        hxy2 = _entropy(px * py, (1, 2))
+
+        sigx = np.sqrt((p * (i - ux) ** 2).sum((1, 2)))
+        sigy = np.sqrt((p * (j - uy) ** 2).sum((1, 2)))
+        corm = (p * (i - ux) * (j - uy)).sum((1, 2))
+        diff_average = p_diff @ k_diff
+        hmax = np.fmax(hx, hy)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = np.where(sigx * sigy == 0, 1, corm / (sigx * sigy))
+            imc1 = np.where(hmax == 0, 0, (hxy - hxy1) / hmax)
+            imc2 = np.sqrt(1 - np.exp(-2 * (hxy2 - hxy)))
+            imc2[hxy2 == hxy] = 0
+
+        features = {
+            "Autocorrelation": (p * i * j).sum((1, 2)),
+            "ClusterProminence": (p * (i + j - ux - uy) ** 4).sum((1, 2)),
+            "ClusterShade": (p * (i + j - ux - uy) ** 3).sum((1, 2)),
+            "ClusterTendency": (p * (i + j - ux - uy) ** 2).sum((1, 2)),
+            "Contrast": (p * (i - j) ** 2).sum((1, 2)),
+            "Correlation": correlation,
+            "DifferenceAverage": diff_average,
+            "DifferenceEntropy": _entropy(p_diff, 1),
+            "DifferenceVariance": (p_diff * (k_diff - diff_average[:, None]) ** 2).sum(1),
+            "Id": (p_diff / (1 + k_diff)).sum(1),
+            "Idm": (p_diff / (1 + k_diff ** 2)).sum(1),
+            "Idmn": (p_diff / (1 + k_diff ** 2 / num_levels ** 2)).sum(1),
+            "Idn": (p_diff / (1 + k_diff / num_levels)).sum(1),
+            "Imc1": imc1,
+            "Imc2": imc2,
+            "InverseVariance": (p_diff[:, 1:] / k_diff[1:] ** 2).sum(1),
+            "JointAverage": ux.ravel(),
+            "JointEnergy": (p ** 2).sum((1, 2)),
+            "JointEntropy": hxy,
+            "MaximumProbability": p.max((1, 2)),
+            "SumAverage": p_sum @ k_sum,
+            "SumEntropy": _entropy(p_sum, 1),
+            "SumSquares": (p * (i - ux) ** 2).sum((1, 2)),
+        }
+
+        # Maximal correlation coefficient: the square root of the second largest eigenvalue of Q
+        if p.shape[1] < 2:
+            features["MCC"] = np.ones(1)
+        else:
+            q = np.einsum("aik,ajk->aij", p / (px * py + _EPS), p)
+            eigenvalues = np.sort(np.linalg.eigvals(q), axis=1)
+            features["MCC"] = np.sqrt(eigenvalues[:, -2]).real
+
+        return {name: float(np.nanmean(values)) for name, values in features.items()}
+
+    def glrlm_features(self) -> dict:
+        """
+        Calculate the PyRadiomics glrlm features, averaged over the directions.
+        """
+        p, j = self.glrlm()
+        i = self.gray_levels.astype(np.float64)
+        num_runs = p.sum((1, 2))
+        pg, pr = p.sum(2), p.sum(1)
+        pij = p / num_runs[:, None, None]
+        pg_norm, pr_norm = pg / num_runs[:, None], pr / num_runs[:, None]
+        ug = (pg_norm * i).sum(1, keepdims=True)
+        ur = (pr_norm * j).sum(1, keepdims=True)
+        i2, j2 = (i ** 2)[:, None], (j ** 2)[None, :]
+
+        features = {
+            "GrayLevelNonUniformity": (pg ** 2).sum(1) / num_runs,
+            "GrayLevelNonUniformityNormalized": (pg ** 2).sum(1) / num_runs ** 2,
+            "GrayLevelVariance": (pg_norm * (i - ug) ** 2).sum(1),
+            "HighGrayLevelRunEmphasis": (pg * i ** 2).sum(1) / num_runs,
+            "LongRunEmphasis": (pr * j ** 2).sum(1) / num_runs,
+            "LongRunHighGrayLevelEmphasis": (p * i2 * j2).sum((1, 2)) / num_runs,
+            "LongRunLowGrayLevelEmphasis": (p * j2 / i2).sum((1, 2)) / num_runs,
+            "LowGrayLevelRunEmphasis": (pg / i ** 2).sum(1) / num_runs,
+            "RunEntropy": _entropy(pij, (1, 2)),
+            "RunLengthNonUniformity": (pr ** 2).sum(1) / num_runs,
+            "RunLengthNonUniformityNormalized": (pr ** 2).sum(1) / num_runs ** 2,
+            "RunPercentage": num_runs / (pr * j).sum(1),
+            "RunVariance": (pr_norm * (j - ur) ** 2).sum(1),
+            "ShortRunEmphasis": (pr / j ** 2).sum(1) / num_runs,
+            "ShortRunHighGrayLevelEmphasis": (p * i2 / j2).sum((1, 2)) / num_runs,
+            "ShortRunLowGrayLevelEmphasis": (p / (i2 * j2)).sum((1, 2)) / num_runs,
+        }
+        return {name: float(np.nanmean(values)) for name, values in features.items()}
+
+    def glszm_features(self) -> dict:
+        """
+        Calculate the PyRadiomics glszm features.
+        """
+        p, j = self.glszm()
+        i = self.gray_levels.astype(np.float64)
+        num_zones = p.sum()
+        num_pixels = (p.sum(0) * j).sum()
+        pg, ps = p.sum(1), p.sum(0)
+        pij = p / num_zones
+        ug = (pg / num_zones * i).sum()
+        us = (ps / num_zones * j).sum()
+        i2, j2 = (i ** 2)[:, None], (j ** 2)[None, :]
+
+        features = {
+            "GrayLevelNonUniformity": (pg ** 2).sum() / num_zones,
+            "GrayLevelNonUniformityNormalized": (pg ** 2).sum() / num_zones ** 2,
+            "GrayLevelVariance": (pg / num_zones * (i - ug) ** 2).sum(),
+            "HighGrayLevelZoneEmphasis": (pg * i ** 2).sum() / num_zones,
+            "LargeAreaEmphasis": (ps * j ** 2).sum() / num_zones,
+            "LargeAreaHighGrayLevelEmphasis": (p * i2 * j2).sum() / num_zones,
+            "LargeAreaLowGrayLevelEmphasis": (p * j2 / i2).sum() / num_zones,
+            "LowGrayLevelZoneEmphasis": (pg / i ** 2).sum() / num_zones,
+            "SizeZoneNonUniformity": (ps ** 2).sum() / num_zones,
+            "SizeZoneNonUniformityNormalized": (ps ** 2).sum() / num_zones ** 2,
+            "SmallAreaEmphasis": (ps / j ** 2).sum() / num_zones,
+            "SmallAreaHighGrayLevelEmphasis": (p * i2 / j2).sum() / num_zones,
+            "SmallAreaLowGrayLevelEmphasis": (p / (i2 * j2)).sum() / num_zones,
+            "ZoneEntropy": _entropy(pij, None),
+            "ZonePercentage": num_zones / num_pixels,
+            "ZoneVariance": (ps / num_zones * (j - us) ** 2).sum(),
+        }
+        return {name: float(value) for name, value in features.items()}
+
+    def radiomics_features(self, classes=TEXTURE_CLASSES) -> dict:
+        """
+        Calculate the PyRadiomics features of the given texture classes.
+
+        Args:
+            classes (iterable): The feature classes, among TEXTURE_CLASSES. Defaults to every one.
+
+        Returns:
+            dict: the features, by column name ("radiomics_glcm_Contrast", ...), sorted by name within each class
+        """
+        calculators = {"glcm": self.glcm_features, "glrlm": self.glrlm_features, "glszm": self.glszm_features}
+        features = {}
+        for feature_class in classes:
+            class_features = calculators[feature_class]()
+            features.update(("%s%s_%s" % (RADIOMICS_PREFIX, feature_class, name), class_features[name])
+                            for name in sorted(class_features))
+        return features
+
+
+def _lbp_map(code: int, points: int) -> int:
+    """
+    Return the smallest rotation of an LBP code, as mahotas maps them.
+    """
+    smallest = code
+    for _ in range(points):
+        code = (code >> 1) | ((code & 1) << (points - 1))
+        smallest = min(smallest, code)
+    return smallest
+
+
+def _lbp_indices(length: int, shift: float):
+    """
+    Return the index of the neighbour of each index along an axis, as mahotas samples it (with mahotas.interpolate.shift
+    and an order 1 spline, which comes down to rounding the coordinates), and -1 outside of the image.
+    """
+    coordinates = np.arange(length, dtype=np.float64) - shift
+    coordinates = coordinates + 0.5
+    indices = np.where(coordinates > 0, np.floor(coordinates + 0.5), np.ceil(coordinates - 0.5)).astype(np.int64)
+    indices[(indices < 0) | (indices >= length)] = -1
+    return indices
+
+
+# LBP tables, by (height, width, radius, points)
+_LBP_TABLES = {}
+
+
+def lbp_tables(shape, radius: float, points: int):
+    """
+    Return the LBP tables of an image shape, computed once per process:
+    - the row and the column of the neighbour of each pixel, for each point (-1 outside of the image)
+    - the histogram bin of each LBP code (the bins being the rotation invariant codes, as mahotas.features.lbp)
+
+    Returns:
+        tuple: (rows of shape (points, height), columns of shape (points, width), bins of shape (2 ** points,))
+    """
+    key = (shape[0], shape[1], radius, points)
+    tables = _LBP_TABLES.get(key)
+    if tables is None:
+        angles = np.linspace(0, 2 * np.pi, points + 1)[:-1]
+        rows = np.array([_lbp_indices(shape[0], radius * dy) for dy in np.sin(angles)])
+        columns = np.array([_lbp_indices(shape[1], radius * dx) for dx in np.cos(angles)])
+        mapped = np.array([_lbp_map(code, points) for code in range(2 ** points)])
+        pivots = np.flatnonzero(mapped == np.arange(2 ** points))
+        bins = np.searchsorted(pivots, mapped)
+        tables = _LBP_TABLES[key] = (rows, columns, bins)
+    return tables
+
+
+@njit
+def _lbp_image(data, mask, rows, columns, bins, num_bins):
+    height, width = data.shape
+    points = rows.shape[0]
+    features = np.zeros(num_bins)
+    for y in range(height):
+        for x in range(width):
+            if mask.shape[0] and not mask[y, x]:
+                continue
+            center = data[y, x]
+            code = 0
+            for k in range(points):
+                ny, nx = rows[k, y], columns[k, x]
+                # The neighbours outside of the image are 0
+                if ny >= 0 and nx >= 0 and data[ny, nx] > center:
+                    code |= 1 << k
+            features[bins[code]] += 1
+    return features
+
+
+@njit
+def _tas_image(data, mask, threshold, margin):
+    height, width = data.shape
+    features = np.zeros((6, 9))
+
+    # Mean of the pixels above the threshold
+    total = 0
+    count = 0
+    for y in range(height):
+        for x in range(width):
+            if data[y, x] > threshold:
+                total += data[y, x]
+                count += 1
+    mu = total / (count + 1e-8)
+
+    # The 3 binary images: around the mean, above the mean minus the margin, and above the mean
+    binary = np.zeros((3, height, width), dtype=np.bool_)
+    for y in range(height):
+        for x in range(width):
+            value = data[y, x]
+            binary[0, y, x] = mu - margin < value < mu + margin
+            binary[1, y, x] = value > mu - margin
+            binary[2, y, x] = value > mu
+
+    for b in range(3):
+        for y in range(height):
+            for x in range(width):
+                if mask.shape[0] and not mask[y, x]:
+                    continue
+                # Neighbours set, the borders being reflected
+                neighbours = 0
+                for dy in range(-1, 2):
+                    for dx in range(-1, 2):
+                        if dy != 0 or dx != 0:
+                            ny = min(max(y + dy, 0), height - 1)
+                            nx = min(max(x + dx, 0), width - 1)
+                            neighbours += binary[b, ny, nx]
+                # The pixels not set count for the binary image, the others for its complement
+                if binary[b, y, x]:
+                    features[3 + b, 8 - neighbours] += 1
+                else:
+                    features[b, neighbours] += 1
+
+    for h in range(6):
+        total_h = features[h].sum()
+        if total_h > 0:
+            features[h] /= total_h
+    return features.reshape(54)
+
+
+def _image_mask(data, mask):
+    if mask is None:
+        return np.zeros((0, 0), dtype=np.bool_)
+    mask = np.asarray(mask, dtype=np.bool_)
+    if mask.shape != data.shape:
+        raise ValueError(f"The mask has the shape {mask.shape}, instead of the shape of the image {data.shape}")
+    return mask
+
+
+def lbp_image(data, mask=None, radius: float = 8, points: int = 8):
+    """
+    Calculate the LBP features of an image, as mahotas.features.lbp.
+
+    The kernel is serial: the feature extraction already runs one image per worker process, on every core.
+
+    Args:
+        data (ndarray): The uint8 image.
+        mask (ndarray, optional): The pixels whose codes are counted, of the shape of the image (as mahotas with
+            ignore_zeros, for a mask of the pixels that are not 0). Defaults to None (every pixel).
+        radius (float, optional): The radius of the neighbours. Defaults to 8.
+        points (int, optional): The number of neighbours. Defaults to 8.
+
+    Returns:
+        ndarray: the features
+    """
+    data = np.ascontiguousarray(data, dtype=np.uint8)
+    rows, columns, bins = lbp_tables(data.shape, radius, points)
+    return _lbp_image(data, _image_mask(data, mask), rows, columns, bins, int(bins.max()) + 1)
+
+
+def tas_image(data, mask=None):
+    """
+    Calculate the TAS features of an image, as mahotas.features.tas (with a serial kernel, see lbp_image).
+
+    Args:
+        data (ndarray): The uint8 image.
+        mask (ndarray, optional): The pixels that are counted, of the shape of the image (the mean and the neighbours
+            still come from the whole image). Defaults to None (every pixel).
+
+    Returns:
+        ndarray: the features, of shape (54,)
+    """
+    data = np.ascontiguousarray(data, dtype=np.uint8)
+    return _tas_image(data, _image_mask(data, mask), TAS_THRESHOLD, float(TAS_MARGIN))
+
+
+def validate_stack(stack) -> dict:
+    """
+    Compare the LBP and TAS features of a stack of images with mahotas.
+
+    Returns:
+        dict: the mismatches of each image (see compare_features), by index in the stack, for the images that differ
+    """
+    import mahotas as mt
+
+    mismatches = {}
+    for n, data in enumerate(stack):
+        features = {"lbp_%d" % i: value for i, value in enumerate(lbp_image(data))}
+        features.update(("tas_%d" % i, value) for i, value in enumerate(tas_image(data)))
+        reference = {"lbp_%d" % i: value for i, value in enumerate(mt.features.lbp(data, 8, 8))}
+        reference.update(("tas_%d" % i, value) for i, value in enumerate(mt.features.tas(data)))
+        image_mismatches = compare_features(features, reference)
+        if image_mismatches:
+            mismatches[n] = image_mismatches
+    return mismatches
@@ -1,6 +1,11 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import wandb
+from artifact_storage import ArtifactCache, BackgroundUploader, LocalArtifactStorage, WandbArtifactStorage
+from characteristics_store import columns_path
 from image import Image, ImageLoader
+from dataset_statistics import HistogramStatistics
 from utils import abs_path, load_config
 
 from dataset_representation import CHARACTERISTICS_TAG, COVID_TAG, DATASET_TAG, MODEL_TAG, CovidDataset, CovidMaskDataset, CovidProcessedDataset, DatasetRepresentation, Characteristics, Model, NormalDataset, NormalMaskDataset, NormalProcessedDataset
@@ -27,6 +32,11 @@ class WandbUtils:
         """
         Initializes a new instance of the `WandbUtils` class.
 
+        The artifacts are stored according to "artifact_backend" in the config: "wandb" stores them in W&B, caching the
+        downloads by digest, and "local" stores them in the "local_artifacts_path" folder, with the W&B run disabled, so
+        the pipeline also runs without network access. With "async_artifact_uploads", the artifacts are uploaded in
+        the background while the next steps run, and `finish` waits for them.
+
         Args:
             wdb_data_alias (str): The alias of the WandB data to use for this run.
         """
@@ -35,15 +45,60 @@ class WandbUtils:
         self.project_path = load_config("wb_project_path")
         self.wdb_tags = wdb_tags
         self.artifact_alias = artifact_alias
-        self._run = wandb.init(project=self.project_name, group="main", tags=wdb_tags)
+
+        if load_config("artifact_backend") == "local":
+            self._run = wandb.init(project=self.project_name, group="main", tags=wdb_tags, mode="disabled")
+            self.storage = LocalArtifactStorage(abs_path(load_config("local_artifacts_path")))
+        else:
+            self._run = wandb.init(project=self.project_name, group="main", tags=wdb_tags)
+            self.storage = WandbArtifactStorage(self._run, self.project_path,
+                                                ArtifactCache(abs_path(load_config("artifact_cache_index"))))
+        self.uploader = BackgroundUploader(self.storage) if load_config("async_artifact_uploads") else None
 
     def finish(self):
         """
         Finish the current WandB run by calling the `finish` method of the `run` object.
         This method must be called at the end of each run to ensure that all data is properly logged.
+
+        The pending artifact uploads are waited for first, and the errors of the failed ones are raised.
+        """
+        try:
+            # Wait for the artifacts uploaded in the background.
+            self.wait_uploads()
+        finally:
+            # Call the `finish` method of the `run` object to finalize the run.
+            self._run.finish()
+
+    def wait_uploads(self, name: str = None):
+        """
+        Wait for the artifacts being uploaded in the background and report their status.
+
+        Args:
+            name (str, optional): Only wait for the uploads of this artifact. Defaults to None (every upload).
+        """
+        if self.uploader is not None:
+            self.uploader.wait(name)
+
+    def __upload(self, name, artifact_type, path, aliases, subdir=None):
+        """
+        Upload an artifact through the storage, in the background if the uploads are asynchronous.
         """
-        # Call the `finish` method of the `run` object to finalize the run.
-        self._run.finish()
+        if self.uploader is not None:
+            self.uploader.upload(name, artifact_type, path, aliases, subdir)
+        else:
+            self.storage.upload(name, artifact_type, path, aliases, subdir)
+
+    def __download(self, name, artifact_type):
+        """
+        Download an artifact through the storage. While a new version of it is being uploaded in the background, its
+        local files are returned instead, so the next step doesn't wait for the upload.
+        """
+        if self.uploader is not None:
+            local_path = self.uploader.local_path(name)
+            if local_path is not None:
+                return local_path
+        self.wait_uploads(name)
+        return self.storage.download(name, artifact_type, self.artifact_alias)
 
     def run_job(self, callback, job_type) -> any:
         """
@@ -90,15 +145,43 @@ class WandbUtils:
         # Print a message indicating that the download was successful.
         print("Artifact " + name + " downloaded")
 
-    def __create_wandb_table(self, images, masks, processed, tag):
+    @staticmethod
+    def __load_table_row(image_path, mask_path, processed_path, thumbnail_size):
+        """
+        Load the image, mask and processed image of a table row as thumbnails.
+
+        Args:
+            image_path (str): The path of the image.
+            mask_path (str): The path of the mask.
+            processed_path (str): The path of the processed image.
+            thumbnail_size (tuple): The size of the thumbnails.
+
+        Returns:
+            tuple: (image data, binary mask data, processed image data)
+        """
+        img = Image(image_path, target_size=thumbnail_size)
+        mask = Image(mask_path, target_size=thumbnail_size)
+        img_proc = Image(processed_path, target_size=thumbnail_size)
+        # The resized mask has interpolated borders, keep the pixels that are mostly inside it
+        mask_data = (mask.data > 127).astype(np.uint8)
+        return img.data, mask_data, img_proc.data
+
+    def __create_wandb_table(self, images, masks, processed, tag, sample_size=None, thumbnail_size=None):
         """
         Create a W&B table with the given images, masks, processed images, and tag.
 
+        The rows are paired by file name, a sample of them is taken, and their thumbnails are loaded in a pool of
+        threads, so the table takes a few seconds and megabytes instead of uploading every full image.
+
         Args:
             images (list): A list of image file paths.
             masks (list): A list of corresponding mask file paths.
             processed (list): A list of corresponding processed image file paths.
             tag (str): A string that specifies the tag for the W&B table.
+            sample_size (int, optional): The number of rows of the table. Defaults to "wandb_table_sample_size" in the
+                config, 0 or None there meaning every image.
+            thumbnail_size (tuple, optional): The size of the images in the table. Defaults to
+                "wandb_table_thumbnail_size" in the config.
 
         Returns:
             None
@@ -107,25 +190,38 @@ class WandbUtils:
         if len(images) != len(masks) or len(images) != len(processed):
             raise Exception("The number of images, masks, and processed images must be the same")
 
-        # Create a numpy array with the images, masks, and processed images.
-        data = np.asarray([images, masks, processed])
+        sample_size = sample_size or load_config("wandb_table_sample_size")
+        thumbnail_size = tuple(thumbnail_size or load_config("wandb_table_thumbnail_size"))
+
+        # Pair each image with its mask and processed image by file name.
+        masks_by_name = {os.path.basename(path): path for path in masks}
+        processed_by_name = {os.path.basename(path): path for path in processed}
+        rows = []
+        for image_path in sorted(images):
+            filename, fileext = os.path.splitext(os.path.basename(image_path))
+            mask_path = masks_by_name.get("%s_mask%s" % (filename, fileext))
+            processed_path = processed_by_name.get("%s_processed%s" % (filename, fileext))
+            if mask_path is not None and processed_path is not None:
+                rows.append((image_path, mask_path, processed_path))
+
+        # Take the same sample on every run.
+        if sample_size and sample_size < len(rows):
+            indexes = np.sort(np.random.default_rng(0).choice(len(rows), sample_size, replace=False))
+            rows = [rows[i] for i in indexes]
+
+        # Load the thumbnails of the rows in parallel.
+        with ThreadPoolExecutor() as executor:
+            row_data = list(executor.map(lambda row: self.__load_table_row(*row, thumbnail_size), rows))
 
         # Create a new W&B table with the columns "Filename", "Image", and "Processed".
         table = wandb.Table(columns=["Filename", "Image", "Processed"])
 
-        # Iterate over each row in the data array and add it to the W&B table.
-        for i in data.T:
-            # Create a W&B image object for the original image.
-            img = Image(i[0])
-            wandb_img = wandb.Image(img.data)
-
-            # Create a W&B image object for the mask.
-            mask = Image(i[1])
-            mask_data = mask.data
-            mask_data[mask_data > 0] = 1
-            wandb_mask = wandb.Image(mask_data, masks={
+        # Add each row to the W&B table.
+        for (image_path, _, _), (img_data, mask_data, img_proc_data) in zip(rows, row_data):
+            # Create a W&B image object for the original image, with its mask as an overlay.
+            wandb_img = wandb.Image(img_data, masks={
                 "mask": {
-                    "mask_data": np.asarray(mask_data),
+                    "mask_data": mask_data,
                     "class_labels": {
                         1: "Mask",
                     }
@@ -133,11 +229,10 @@ class WandbUtils:
             })
 
             # Create a W&B image object for the processed image.
-            img_proc = Image(i[2])
-            wandb_img_proc = wandb.Image(img_proc.data)
+            wandb_img_proc = wandb.Image(img_proc_data)
 
             # Add the row to the W&B table.
-            table.add_data(img.file_path, wandb_img, wandb_img_proc)
+            table.add_data(image_path, wandb_img, wandb_img_proc)
 
         # Log the W&B table with the specified tag.
         wandb.log({f"{tag} Table": table})
@@ -172,12 +267,15 @@ class WandbUtils:
         # Run the callback function
         self.run_job(callback, WB_JOB_LOG)
 
-    def log_table(self):
+    def log_table(self, sample_size=None, thumbnail_size=None):
         """
         Log an interactive table in W&B with covid and non-covid images and masks.
 
         Args:
-            None
+            sample_size (int, optional): The number of rows of each table. Defaults to "wandb_table_sample_size" in the
+                config.
+            thumbnail_size (tuple, optional): The size of the images in the tables. Defaults to
+                "wandb_table_thumbnail_size" in the config.
 
         Returns:
             None
@@ -186,11 +284,11 @@ class WandbUtils:
         def callback(run):
             # Create a W&B table with covid images and masks.
             self.__create_wandb_table(CovidDataset().images(), CovidMaskDataset().images(),
-                                      CovidProcessedDataset().images(), "covid")
+                                      CovidProcessedDataset().images(), "covid", sample_size, thumbnail_size)
 
             # Create a W&B table with non-covid images and masks.
             self.__create_wandb_table(NormalDataset().images(), NormalMaskDataset().images(),
-                                      NormalProcessedDataset().images(), "non-covid")
+                                      NormalProcessedDataset().images(), "non-covid", sample_size, thumbnail_size)
 
             # Finish the current W&B run.
             self.finish()
@@ -198,40 +296,40 @@ class WandbUtils:
         # Call the `run_job` method with the callback function and the `WB_JOB_LOG_TABLE` job type.
         self.run_job(callback, WB_JOB_LOG_TABLE)
 
-    def log_histogram_chart_comparison(self, samples_target_size):
+    def log_histogram_chart_comparison(self, samples_target_size, cov_statistics: HistogramStatistics = None,
+                                       non_cov_statistics: HistogramStatistics = None):
         """
         Log a comparison of histogram charts for covid and non-covid images.
 
         Args:
-            None
+            samples_target_size (tuple): The size the processed images are loaded at, when their statistics are not given.
+            cov_statistics (HistogramStatistics, optional): The statistics of the processed covid images, for instance
+                gathered during the feature extraction. Defaults to None (computed here, in a single pass).
+            non_cov_statistics (HistogramStatistics, optional): The statistics of the processed non-covid images.
 
         Returns:
             None
         """
         # Define a callback function that takes in a `run` parameter.
         def callback(run):
-            # Load the image data for the covid and non-covid images.
-            cov_processed_gen = ImageLoader().load_from(CovidProcessedDataset().path, samples_target_size)
-            non_cov_processed_gen = ImageLoader().load_from(NormalProcessedDataset().path, samples_target_size)
-
-            # Define a helper function to generate histogram data for an image generator.
-            def generate_histogram_data(image_gen):
+            # Compute the statistics that were not given, in a single pass over the images.
+            cov_stats = cov_statistics or HistogramStatistics.from_images(
+                ImageLoader().load_from(CovidProcessedDataset().path, samples_target_size))
+            non_cov_stats = non_cov_statistics or HistogramStatistics.from_images(
+                ImageLoader().load_from(NormalProcessedDataset().path, samples_target_size))
+
+            # Define a helper function to generate histogram data from the statistics of a dataset.
+            def generate_histogram_data(statistics):
                 # Define the length of the histogram.
                 HISTOGRAM_LENGTH = 254
-                # Initialize the histogram data to all zeros.
-                hist_data = [0] * HISTOGRAM_LENGTH
-                # Loop over each image in the generator.
-                for _, img in enumerate(image_gen):
-                    # Generate the histogram for the image.
-                    hist = img.hist()
-                    # Add the histogram data to the overall histogram data.
-                    hist_data += hist[:-1]
+                # Sum of the histograms of every image.
+                hist_data = statistics.totals[:HISTOGRAM_LENGTH]
                 # Convert the histogram data to a list of tuples where each tuple contains the intensity value and the corresponding histogram value.
-                return [(i, val) for i, val in enumerate(hist_data)]
+                return [(i, int(val)) for i, val in enumerate(hist_data)]
 
             # Generate histogram data for the covid and non-covid images.
-            cov_hist_data = generate_histogram_data(cov_processed_gen)
-            non_cov_hist_data = generate_histogram_data(non_cov_processed_gen)
+            cov_hist_data = generate_histogram_data(cov_stats)
+            non_cov_hist_data = generate_histogram_data(non_cov_stats)
 
             # Create wandb.Table objects to represent the histogram data.
             cov_table = wandb.Table(data=cov_hist_data, columns=["Intensity", "Value"])
@@ -269,17 +367,9 @@ class WandbUtils:
         """
         # Define a callback function that takes in a `run` parameter.
         def callback(run):
-            # Create a new W&B artifact with the tag and type specified in the DatasetRepresentation object.
-            artifact = wandb.Artifact(dataset_artifact.tag, type=DATASET_TAG)
-
-            # Add the directory specified in the DatasetRepresentation object to the artifact.
-            artifact.add_dir(dataset_artifact.path)
-
-            # Log the artifact to W&B using the provided aliases.
-            run.log_artifact(artifact, aliases=dataset_artifact.aliases + [self.artifact_alias])
-
-            # Wait for the artifact logging
-            artifact.wait()
+            # Store the directory specified in the DatasetRepresentation object, with the provided aliases.
+            self.__upload(dataset_artifact.tag, DATASET_TAG, dataset_artifact.path,
+                          dataset_artifact.aliases + [self.artifact_alias])
 
         # Call the `run_job` method with the callback function and the `WB_JOB_UPLOAD_DATASET` job type.
         self.run_job(callback, WB_JOB_UPLOAD_DATASET)
@@ -296,12 +386,8 @@ class WandbUtils:
         """
         # Define a callback function that takes in a `run` parameter.
         def callback(run):
-            # Get the W&B artifact path for the specified dataset artifact.
-            artifact_wdb_path = dataset_artifact.wb_artifact_path(self.project_path, self.artifact_alias)
-            # Use the W&B artifact with the specified path and type.
-            artifact = run.use_artifact(artifact_wdb_path, type=DATASET_TAG)
-            # Download the artifact to the local machine and return the path where it was downloaded to.
-            return artifact.download()
+            # Return the local path of the artifact, downloading it only if it isn't cached.
+            return self.__download(dataset_artifact.tag, DATASET_TAG)
 
         # Call the `run_job` method with the callback function and the `WB_JOB_LOAD_DATASET` job type.
         return self.run_job(callback, WB_JOB_LOAD_DATASET)
@@ -316,33 +402,8 @@ class WandbUtils:
         Returns:
             str: A string representing the local path where the model was downloaded to.
         """
-        # Get the W&B artifact path for the model artifact.
-        artifact_wdb_path = self.__get_wb_artifact_path(MODEL_TAG)
-
-        # Use the W&B artifact with the specified path and type.
-        artifact = run.use_artifact(artifact_wdb_path, type=MODEL_TAG)
-
-        # Download the artifact to the local machine and return the path where it was downloaded to.
-        return artifact.download()
-
-    def generate_model_artifact(self):
-        """
-        Generate a W&B artifact for the model.
-
-        Args:
-            None
-
-        Returns:
-            wandb.Artifact: An instance of the wandb.Artifact class that represents the model artifact.
-        """
-        # Create a new W&B artifact with the tag and type specified in the constants.
-        model = wandb.Artifact(MODEL_TAG, type=MODEL_TAG)
-
-        # Add the model file to the artifact.
-        model.add_file(Model().path)
-
-        # Return the model artifact.
-        return model
+        # Return the local path of the model artifact, downloading it only if it isn't cached.
+        return self.__download(MODEL_TAG, MODEL_TAG)
 
     def upload_model_artifact(self, run):
         """
@@ -354,14 +415,8 @@ class WandbUtils:
         Returns:
             None
         """
-        # Generate a new W&B artifact for the model.
-        model_artifact = self.generate_model_artifact()
-
-        # Log the model artifact to W&B using the provided aliases.
-        run.log_artifact(model_artifact, aliases=[self.artifact_alias])
-
-        # Wait for the artifact logging
-        model_artifact.wait()
+        # Store the model file with the provided aliases.
+        self.__upload(MODEL_TAG, MODEL_TAG, Model().path, [self.artifact_alias])
 
         # Finish the current W&B run.
         self.finish()
@@ -375,12 +430,9 @@ class WandbUtils:
         """
         # Define a callback function that takes in a `run` parameter.
         def callback(run):
-            # Get the W&B artifact path for the characteristics artifact.
-            artifact_wdb_path = Characteristics().wb_artifact_path(self.project_path, self.artifact_alias)
-            # Use the W&B artifact with the specified path and type.
-            artifact = run.use_artifact(artifact_wdb_path, type=CHARACTERISTICS_TAG)
-            # Download the artifact to the local machine and return the path where it was downloaded to.
-            return artifact.download() + "/" + load_config("generated_csv_file")
+            # Get the local path of the artifact, downloading it only if it isn't cached.
+            path = self.__download(CHARACTERISTICS_TAG, CHARACTERISTICS_TAG)
+            return path + "/" + os.path.basename(Characteristics().path)
 
         # Call the `run_job` method with the callback function and the `WB_JOB_LOAD_DATASET` job type.
         return self.run_job(callback, WB_JOB_LOAD_DATASET)
@@ -397,17 +449,16 @@ class WandbUtils:
         """
         # Define a callback function that takes in a `run` parameter.
         def callback(run):
-            # Create a new W&B artifact with the tag and type specified in the constants.
-            artifact = wandb.Artifact(CHARACTERISTICS_TAG, type=CHARACTERISTICS_TAG)
-
-            # Add the characteristics file to the artifact.
-            artifact.add_file(Characteristics().path)
-
-            # Log the artifact to W&B using the provided aliases.
-            run.log_artifact(artifact, aliases=[CHARACTERISTICS_TAG, self.artifact_alias])
-
-            # Wait for the artifact logging
-            artifact.wait()
+            # Store the characteristics file, along with the names of its columns (or the npy folder, under its own
+            # name, which holds them) with the provided aliases.
+            characteristics = Characteristics()
+            path, subdir = characteristics.path, None
+            if os.path.isdir(path):
+                subdir = os.path.basename(path)
+            elif os.path.exists(columns_path(path)):
+                path = [path, columns_path(path)]
+            self.__upload(CHARACTERISTICS_TAG, CHARACTERISTICS_TAG, path, [CHARACTERISTICS_TAG, self.artifact_alias],
+                          subdir)
 
         # Call the `run_job` method with the callback function and the `WB_JOB_UPLOAD_DATASET` job type.
         self.run_job(callback, WB_JOB_UPLOAD_DATASET)
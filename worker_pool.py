@@ -0,0 +1,262 @@
+import multiprocessing as mp
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing.connection import wait
+
+
+def _run_worker(conn, func, initializer, initargs):
+    """
+    Main loop of a worker process: call the initializer of the pool, then run the chunks of tasks received through the
+    connection until None is received, reporting when each task starts and its result.
+
+    Args:
+        conn (Connection): The connection to the parent process.
+        func (callable): A module-level (picklable) function that takes a single task.
+        initializer (callable): A function called once when the worker starts, or None.
+        initargs (tuple): The arguments passed to the initializer.
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            return
+        if item is None:
+            return
+        chunk_id, offset, tasks = item
+        for index, task in enumerate(tasks, offset):
+            conn.send(("start", chunk_id, index, None))
+            try:
+                result = (True, func(task))
+            except Exception as e:
+                # A bad task must not take the rest of the chunk down with it
+                result = (False, f"{type(e).__name__}: {e}")
+            conn.send(("done", chunk_id, index, result))
+
+
+class _Chunk:
+    """
+    The tasks of a chunk and their results, as (succeeded, result or error message) pairs.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.results = [None] * len(tasks)
+        self.remaining = len(tasks)
+
+    def set_result(self, index, result):
+        self.results[index] = result
+        self.remaining -= 1
+
+
+class _Worker:
+    """
+    A worker process, the connection to it and the part of a chunk it runs.
+    """
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        # Id of the chunk the worker runs, None while it is idle
+        self.chunk_id = None
+        # Index in the chunk of the task the worker runs or runs next, and when that task started
+        self.index = None
+        self.started = None
+
+
+class ChunkedWorkerPool:
+    """
+    A process pool that dispatches tasks in chunks and streams the results back in submission order.
+
+    The workers are spawned rather than forked, since the parent may already run numba or TBB threads, which don't
+    survive a fork. Each worker runs one chunk at a time and reports every task as it starts and ends. When a task runs
+    longer than its timeout, or its worker dies, only that worker is killed and replaced (running the initializer in the
+    new process alone): the task fails, the results the worker already reported are kept and the rest of its chunk is
+    run again first. The other workers carry on with their chunks undisturbed.
+
+    Attributes:
+        num_workers (int): The number of worker processes.
+        chunksize (int): The number of tasks sent to a worker at once.
+        task_timeout (float): The number of seconds a single task may take before it is given up on, counted from when
+            it starts running. None disables the timeout.
+        max_pending (int): The maximum number of chunks in flight or waiting to be yielded at the same time.
+    """
+
+    # How often the timeouts are checked, in seconds
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, num_workers: int = None, chunksize: int = 1, task_timeout: float = None,
+                 initializer=None, initargs=()):
+        """
+        Initializes a ChunkedWorkerPool object.
+
+        Args:
+            num_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+            chunksize (int, optional): The number of tasks sent to a worker at once. Defaults to 1.
+            task_timeout (float, optional): The per-task timeout in seconds. Defaults to None (no timeout).
+            initializer (callable, optional): A function called once in each worker when it starts.
+            initargs (tuple, optional): The arguments passed to the initializer.
+        """
+        self.num_workers = num_workers or mp.cpu_count()
+        self.chunksize = max(1, chunksize)
+        self.task_timeout = task_timeout
+        self.max_pending = self.num_workers * 2
+        self.initializer = initializer
+        self.initargs = initargs
+        self.__context = mp.get_context("spawn")
+
+    def __chunks(self, tasks):
+        """
+        Split an iterable of tasks into lists of at most `chunksize` tasks.
+        """
+        tasks = iter(tasks)
+        while True:
+            chunk = list(islice(tasks, self.chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    def __start_worker(self, func):
+        conn, child_conn = self.__context.Pipe()
+        process = self.__context.Process(target=_run_worker,
+                                         args=(child_conn, func, self.initializer, self.initargs), daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(process, conn)
+
+    def __replace_worker(self, workers, worker, func, error, chunks, queued):
+        """
+        Kill a worker, fail the task it was running and queue the rest of its chunk first, then start a new worker in
+        its place.
+        """
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join()
+        worker.conn.close()
+
+        chunk = chunks[worker.chunk_id]
+        chunk.set_result(worker.index, (False, error))
+        if worker.index + 1 < len(chunk.tasks):
+            queued.appendleft((worker.chunk_id, worker.index + 1))
+
+        workers[workers.index(worker)] = self.__start_worker(func)
+
+    @staticmethod
+    def __dispatch(workers, queued, chunks):
+        """
+        Send the queued parts of chunks to the idle workers.
+        """
+        for worker in workers:
+            if not queued:
+                return
+            if worker.chunk_id is not None:
+                continue
+            chunk_id, offset = queued.popleft()
+            worker.chunk_id, worker.index, worker.started = chunk_id, offset, None
+            try:
+                worker.conn.send((chunk_id, offset, chunks[chunk_id].tasks[offset:]))
+            except OSError:
+                # The worker is dead, which its sentinel reports to __poll
+                pass
+
+    def __poll(self, workers, func, chunks, queued):
+        """
+        Wait for the busy workers to report, record their results and replace the workers whose task timed out or
+        which died.
+        """
+        busy = [worker for worker in workers if worker.chunk_id is not None]
+        timeout = None if self.task_timeout is None else self.POLL_INTERVAL
+        wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], timeout)
+
+        for worker in busy:
+            chunk = chunks[worker.chunk_id]
+            try:
+                while worker.chunk_id is not None and worker.conn.poll():
+                    kind, chunk_id, index, result = worker.conn.recv()
+                    if kind == "start":
+                        worker.index, worker.started = index, time.monotonic()
+                        continue
+                    chunk.set_result(index, result)
+                    worker.index, worker.started = index + 1, None
+                    if worker.index == len(chunk.tasks):
+                        worker.chunk_id = None
+            except (EOFError, OSError):
+                pass
+
+            if worker.chunk_id is None:
+                continue
+            if not worker.process.is_alive():
+                self.__replace_worker(workers, worker, func, f"worker exited with code {worker.process.exitcode}",
+                                      chunks, queued)
+            elif (self.task_timeout is not None and worker.started is not None
+                  and time.monotonic() >= worker.started + self.task_timeout):
+                self.__replace_worker(workers, worker, func, f"timed out after {self.task_timeout}s", chunks, queued)
+
+    @staticmethod
+    def __stop(workers):
+        for worker in workers:
+            if worker.chunk_id is None and worker.process.is_alive():
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+            else:
+                # Unfinished workers would block join() forever
+                worker.process.terminate()
+        for worker in workers:
+            worker.process.join()
+            worker.conn.close()
+
+    def map(self, func, tasks):
+        """
+        Run `func` over every task in the worker pool.
+
+        The results are yielded in the same order as the tasks, as soon as they are available. Only a bounded number of
+        chunks is kept in flight, so the tasks can be a lazy iterable of any length.
+
+        Args:
+            func (callable): A module-level (picklable) function that takes a single task.
+            tasks (iterable): The tasks to run.
+
+        Yields:
+            tuple: (task, succeeded, result or error message) for every task.
+        """
+        workers = [self.__start_worker(func) for _ in range(self.num_workers)]
+        # The chunks in flight or whose results were not yielded yet, by id, and their ids in the order of the tasks
+        chunks = {}
+        order = deque()
+        # (chunk id, index of the first task) of the parts of chunks waiting for a worker
+        queued = deque()
+        chunk_iter = self.__chunks(tasks)
+        chunk_ids = iter(range(1 << 62))
+
+        def submit():
+            chunk = next(chunk_iter, None)
+            if chunk is not None:
+                chunk_id = next(chunk_ids)
+                chunks[chunk_id] = _Chunk(chunk)
+                order.append(chunk_id)
+                queued.append((chunk_id, 0))
+
+        try:
+            # Fill the pipeline
+            for _ in range(self.max_pending):
+                submit()
+
+            while order:
+                if chunks[order[0]].remaining:
+                    self.__dispatch(workers, queued, chunks)
+                    self.__poll(workers, func, chunks, queued)
+                    continue
+
+                chunk = chunks.pop(order.popleft())
+                # Keep the pipeline full while the caller consumes the results
+                submit()
+                self.__dispatch(workers, queued, chunks)
+
+                for task, (succeeded, result) in zip(chunk.tasks, chunk.results):
+                    yield task, succeeded, result
+        finally:
+            self.__stop(workers)